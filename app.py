@@ -82,28 +82,211 @@ called, the unit arguments are still separated out of the args dict, but
 they are ignored.
 """
 
+import time
+_startup_t0 = time.perf_counter()
+
 import flask
-import pyromat as pm
-import numpy as np
 from flask import Flask, request
+from werkzeug.security import safe_join
+import importlib.util
+import gc
+import os
 import sys
+import threading
+import contextlib
+import base64
+import io
+import gzip
+import hashlib
+import mimetypes
+import json
+import html
+import random
+import tempfile
+import cProfile
+import pstats
+import tracemalloc
+from collections import OrderedDict, deque
 
 __version__ = '0.1'
 
+
+# ### Startup
+# The PMGI_STARTUP environment variable selects how the heavy
+# dependencies are loaded when this module is imported.
+#   'default'   Import numpy and PYroMat normally.
+#   'lazy'      Defer importing numpy and PYroMat (and loading the PYroMat
+#               substance data) until they are first used.  This is best
+#               for single-process hosts that are often cold-started.
+#   'preload'   Import everything, exercise every substance, and freeze
+#               the resulting objects out of the garbage collector.  This
+#               is intended for pre-fork servers (e.g. gunicorn --preload)
+#               so that the workers share the data pages copy-on-write.
+STARTUP_MODE = os.environ.get('PMGI_STARTUP', 'default').lower()
+
+
+def lazy_import(name):
+    """Import a module that will not be executed until first accessed
+    module = lazy_import(name)
+
+The module is registered in sys.modules, so subsequent imports by other
+modules (e.g. PYroMat importing numpy) will also receive the lazy module.
+"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+if STARTUP_MODE == 'lazy':
+    np = lazy_import('numpy')
+    pm = lazy_import('pyromat')
+else:
+    import pyromat as pm
+    import numpy as np
+
+# Brotli is optional.  Without it, responses are only compressed with gzip.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# cairosvg is optional.  Without it, diagrams are only rendered as SVG.
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
 # ### Helper functions
 def toarray(a):
-    try:
-        return np.asarray(a, dtype=float)
-    except ValueError:
+    # Comma separated strings are split up front rather than after a failed
+    # conversion attempt
+    if isinstance(a, str) and ',' in a:
         return np.asarray(a.split(','), dtype=float)
+    # Packed arrays are sent as {'base64': ...}
+    elif isinstance(a, dict):
+        return frombase64(a['base64'], a.get('dtype', '<f8'))
+    return np.asarray(a, dtype=float)
+
+
+def frombase64(text, dtype='<f8'):
+    """Decode a base64 packed array
+    array = frombase64(text, dtype='<f8')
+
+This is the conditioning function for JSON array arguments of the form
+    {'base64': 'AAAAAADAckA...'}
+The decoded bytes are interpreted as a flat array of little-endian
+float64 values without copying them.  Only float64 data are accepted.
+"""
+    if np.dtype(dtype) != np.dtype('<f8'):
+        raise ValueError('Packed arrays must be little-endian float64.')
+    return np.frombuffer(base64.b64decode(text, validate=True), dtype='<f8')
+
+
+def read_binary_arrays(body, mimetype, columns=None):
+    """Read the property arrays from a binary request body
+    arrays = read_binary_arrays(body, mimetype, columns=None)
+
+body is the bytes of the request body, and mimetype is one of
+    'application/octet-stream'
+        The body is the concatenation of equal-length columns of
+        little-endian float64 values, one per property.  columns is a
+        comma separated string naming the properties in order.
+    'application/x-npy'
+        The body is a NumPy .npy file.  If its dtype is a structured
+        float64 type, the field names are the properties.  Otherwise, it
+        must be a float64 array with one row per property named in order
+        by columns.
+Returns a dict of read-only numpy arrays that share memory with body.
+Raises ValueError if the body cannot be interpreted.
+"""
+    names = columns.split(',') if columns else []
+
+    if mimetype == 'application/octet-stream':
+        if not names:
+            raise ValueError('Binary arrays require the columns argument.')
+        data = np.frombuffer(body, dtype='<f8')
+        if data.size % len(names):
+            raise ValueError('The binary body does not divide evenly into '
+                             f'{len(names)} columns.')
+        data = data.reshape(len(names), -1)
+        return {name: data[ii] for ii, name in enumerate(names)}
+
+    elif mimetype == 'application/x-npy':
+        stream = io.BytesIO(body)
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(stream)
+        count = int(np.prod(shape))
+        data = np.frombuffer(body, dtype=dtype, count=count,
+                             offset=stream.tell())
+        if dtype.names:
+            if any(dtype[name] != np.dtype('<f8') for name in dtype.names):
+                raise ValueError(
+                    'Packed arrays must be little-endian float64.')
+            return {name: data[name] for name in dtype.names}
+        if dtype != np.dtype('<f8'):
+            raise ValueError('Packed arrays must be little-endian float64.')
+        if not names:
+            raise ValueError('Binary arrays require the columns argument.')
+        data = data.reshape(shape, order='F' if fortran else 'C')
+        data = data.reshape(len(names), -1)
+        return {name: data[ii] for ii, name in enumerate(names)}
+
+    raise ValueError('Unsupported binary content type: ' + str(mimetype))
 
 
 def tobool(a):
+    # JSON requests may send a real boolean
+    if not isinstance(a, str):
+        return bool(a)
     if a.lower() in ['0', 'f', 'false']:
         return False
     return True
 
 
+# The properties returned by subst.state()
+STATE_PROPS = ('p', 'T', 'd', 'x', 'e', 'h', 's', 'cp', 'cv', 'f', 'g', 'gam',
+               'v')
+
+
+def toprops(a):
+    """Condition a property selection (e.g. 'T,s' or ['T', 's'])"""
+    if isinstance(a, str):
+        a = a.split(',')
+    props = []
+    for prop in a:
+        prop = str(prop).strip()
+        if prop not in STATE_PROPS:
+            raise ValueError('Unrecognized property: ' + prop)
+        if prop not in props:
+            props.append(prop)
+    if not props:
+        raise ValueError('No properties were selected.')
+    return props
+
+
+def toids(a):
+    """Condition a list of substance ids (e.g. 'ig.N2,ig.O2' or a list)"""
+    if isinstance(a, str):
+        a = a.split(',')
+    ids = []
+    for idstr in a:
+        idstr = str(idstr).strip()
+        if idstr and idstr not in ids:
+            ids.append(idstr)
+    if not ids:
+        raise ValueError('No substances were selected.')
+    return ids
+
+
 def ismultiphase(subst):
     """Test whether the PYroMat substance instance is a multi-phase model
     :param subst: A PYroMat substance instance
@@ -132,6 +315,19 @@ def ismultiphase(subst):
     #    a new substance model with ps() that has a different meaning.
 
 
+def state_props(subst):
+    """The properties that subst.state() returns for a substance
+    props = state_props(subst)
+
+The ideal gas models have no quality, and their state() does not return
+the free energies (f and g).  These are the properties that may be
+selected with props= for the substance.
+"""
+    if ismultiphase(subst):
+        return STATE_PROPS
+    return tuple(prop for prop in STATE_PROPS if prop not in ('x', 'f', 'g'))
+
+
 def json_friendly(unfriendly):
     """Clean up an output dictionary or list for output as JSON.
     friendly = json_friendly(unfriendly)
@@ -156,16 +352,21 @@ unless a numpy array is passed explicitly.
                 return "nan"
             else:
                 return unfriendly.item()
-        if any(np.isinf(unfriendly)) or any(np.isnan(unfriendly)):
-            bad_inf = np.isinf(unfriendly)
-            bad_nan = np.isnan(unfriendly)
-            lst = unfriendly.tolist()
-            for i in np.where(bad_inf)[0]:
-                lst[i] = "inf"
-            for i in np.where(bad_nan)[0]:
-                lst[i] = "nan"
+        lst = unfriendly.tolist()
+        # Only floating point arrays can hold inf or nan
+        if not np.issubdtype(unfriendly.dtype, np.floating):
             return lst
-        return unfriendly.tolist()
+        bad_inf = np.isinf(unfriendly)
+        bad_nan = np.isnan(unfriendly)
+        if bad_inf.any() or bad_nan.any():
+            # Walk down nested lists for arrays with more than one dimension
+            for bad, flag in ((bad_inf, "inf"), (bad_nan, "nan")):
+                for index in zip(*np.nonzero(bad)):
+                    row = lst
+                    for i in index[:-1]:
+                        row = row[i]
+                    row[index[-1]] = flag
+        return lst
     # If this is a dict, recurse inside
     elif isinstance(unfriendly, dict):
         for name, value in unfriendly.items():
@@ -179,6 +380,134 @@ unless a numpy array is passed explicitly.
     return unfriendly
 
 
+def round_significant(values, digits):
+    """Round floating point arrays to a number of significant digits
+    rounded = round_significant(values, digits)
+
+Like json_friendly(), dicts and lists are searched recursively for numpy
+arrays, but a new structure is returned and the original is left alone.
+Arrays that are not floating point and all other values are passed
+through.  If digits is None, values is returned unchanged.
+
+Each value is scaled by an exact power of ten before it is rounded, so
+the result is the float nearest to the rounded decimal, and it prints
+with no more than the requested digits.  Powers of ten above 1e22 are
+not exact, so the few values that would need them are rounded by string
+formatting instead.  NaN and inf are unchanged.
+"""
+    if digits is None:
+        return values
+    if isinstance(values, np.ndarray):
+        if not np.issubdtype(values.dtype, np.floating):
+            return values
+        flat = values.reshape(-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mag = np.floor(np.log10(np.abs(flat)))
+        # Zeros, NaN, and inf have no magnitude
+        mag[~np.isfinite(mag)] = 0.
+        k = mag - (digits - 1)
+        scale = 10. ** np.minimum(np.abs(k), 22)
+        rounded = np.where(k < 0,
+                           np.round(flat * scale) / scale,
+                           np.round(flat / scale) * scale)
+        for index in np.nonzero(np.abs(k) > 22)[0]:
+            rounded[index] = float(f'{flat[index]:.{digits}g}')
+        return rounded.reshape(values.shape)
+    elif isinstance(values, dict):
+        return {name: round_significant(value, digits)
+                for name, value in values.items()}
+    elif isinstance(values, list):
+        return [round_significant(value, digits) for value in values]
+    return values
+
+
+def get_rss():
+    """Return the resident set size of this process in bytes
+    rss = get_rss()
+
+Returns None if the platform does not provide /proc/self/statm.
+"""
+    try:
+        with open('/proc/self/statm') as ff:
+            pages = int(ff.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def preload():
+    """Load all PYroMat data and freeze it out of the garbage collector
+    elapsed = preload()
+
+Every substance in the PYroMat data is retrieved and evaluated once at
+the middle of its temperature range, so any values cached by the
+substance models are built now rather than in the first request.  Then,
+all surviving objects are moved to the permanent generation with
+gc.freeze(), so later collections in the worker processes do not touch
+(and therefore do not copy) the pages shared with the master process.
+
+Returns the elapsed time in seconds.
+"""
+    t0 = time.perf_counter()
+    for idstr, subst in pm.dat.data.items():
+        try:
+            Tmin, Tmax = subst.Tlim()
+            subst.state(T=0.5 * (Tmin + Tmax), p=pm.config['def_p'])
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+            pass
+    get_valid_units()
+    gc.collect()
+    gc.freeze()
+    return time.perf_counter() - t0
+
+
+def pack_arrays(unpacked, buffers, offset=0):
+    """Replace the numpy arrays in an output structure with references
+    packed, offset = pack_arrays(unpacked, buffers, offset=0)
+
+This is the binary counterpart of json_friendly().  The structure is
+copied recursively, and every numpy array with more than one element is
+replaced by a reference,
+    {'$array': {'offset': offset, 'shape': [...]}}
+where offset is the position (in bytes) of its little-endian float64
+data in the concatenation of the buffers list.  The array data are
+appended to buffers.  Arrays with a single element are made scalars, as
+in json_friendly().  Returns the packed structure and the offset of the
+end of the data.
+"""
+    if isinstance(unpacked, np.ndarray):
+        if unpacked.size == 1:
+            return json_friendly(unpacked), offset
+        data = np.ascontiguousarray(unpacked, dtype='<f8')
+        buffers.append(data)
+        ref = {'$array': {'offset': offset, 'shape': list(data.shape)}}
+        return ref, offset + data.nbytes
+    elif isinstance(unpacked, dict):
+        packed = {}
+        for name, value in unpacked.items():
+            packed[name], offset = pack_arrays(value, buffers, offset)
+        return packed, offset
+    elif isinstance(unpacked, (list, tuple)):
+        packed = []
+        for value in unpacked:
+            value, offset = pack_arrays(value, buffers, offset)
+            packed.append(value)
+        return packed, offset
+    return unpacked, offset
+
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event message
+    msg = sse_event(event, data)
+
+The event is the event name string, and data is any object that can be
+made JSON-friendly by json_friendly().  The data are encoded as a single
+line of JSON, and the message is terminated by a blank line as required
+by the text/event-stream format.
+"""
+    return f'event: {event}\ndata: {flask.json.dumps(json_friendly(data))}\n\n'
+
+
 def clean_nan(dirty, ignore=["cp", "cv", "gam"]):
     """Clean out nan values from a computed dict in place.
     result = clean_nan( dirty )
@@ -237,6 +566,63 @@ If the arrays are found to have incompatible shapes, -1 is returned.
     return count
 
 
+def pchip_slopes(x, y):
+    """Derivatives for a monotone piecewise cubic Hermite interpolant
+    m = pchip_slopes(x, y)
+
+x is a strictly increasing 1D array of n nodes, and y is an (n,) or
+(n, k) array of values at the nodes.  The slopes are chosen by the
+Fritsch-Carlson method (as in scipy's PchipInterpolator), so the
+interpolant is monotone wherever the data are, and it does not
+overshoot at local extrema.
+"""
+    h = np.diff(x)
+    if y.ndim > 1:
+        h = h[:, np.newaxis]
+    delta = np.diff(y, axis=0) / h
+    m = np.zeros_like(y)
+
+    # Interior nodes use a weighted harmonic mean of the secant slopes,
+    # or zero where the secants change sign.
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    same = delta[:-1] * delta[1:] > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        whmean = (w1 / delta[:-1] + w2 / delta[1:]) / (w1 + w2)
+        m[1:-1] = np.where(same, 1. / whmean, 0.)
+
+    # End nodes use a shape-preserving three-point formula
+    for end, h0, h1, d0, d1 in ((0, h[0], h[1], delta[0], delta[1]),
+                                (-1, h[-1], h[-2], delta[-1], delta[-2])):
+        d = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        d = np.where(np.sign(d) != np.sign(d0), 0., d)
+        d = np.where((np.sign(d0) != np.sign(d1)) &
+                     (np.abs(d) > np.abs(3 * d0)), 3 * d0, d)
+        m[end] = d
+    return m
+
+
+def pchip_eval(x, y, m, xq):
+    """Evaluate a piecewise cubic Hermite interpolant
+    yq = pchip_eval(x, y, m, xq)
+
+x, y and m are the nodes, values and slopes (see pchip_slopes()).  xq is
+an array of query points, which must be within the range of x.  Returns
+an array with the shape of xq, followed by any trailing dimension of y.
+"""
+    xq = np.asarray(xq, dtype=float)
+    i = np.clip(np.searchsorted(x, xq, side='right') - 1, 0, x.size - 2)
+    h = x[i + 1] - x[i]
+    t = (xq - x[i]) / h
+    if y.ndim > 1:
+        t = t[..., np.newaxis]
+        h = h[..., np.newaxis]
+    t2 = t * t
+    t3 = t2 * t
+    return (2 * t3 - 3 * t2 + 1) * y[i] + (t3 - 2 * t2 + t) * h * m[i] \
+        + (-2 * t3 + 3 * t2) * y[i + 1] + (t3 - t2) * h * m[i + 1]
+
+
 def get_practical_limits(subst):
     """Return practical temperature and pressure boundaries for a substance
     Tmin,pmin,Tmax,pmax = get_practical_limits( subst )
@@ -311,12 +697,20 @@ def get_default_lines(subst, prop):
     return vals
 
 
-def compute_iso_line(subst, n=25, scaling='linear', **kwargs):
+def compute_iso_line(subst, n=25, scaling='linear', props=None,
+                     deadline=None, **kwargs):
     """
     Compute a constant line for a given property at a given value
     :param subst: a pyromat substance object
     :param n: The number of points to compute to define the line
     :param scaling: Should point spacing be 'linear' or 'log'
+    :param props: A list of the properties to compute, or None for all of
+                    them (see select_state())
+    :param deadline: A time.perf_counter() time, after which a
+                    PMGIDeadlineError is raised (see check_deadline()), or
+                    None for no deadline. It is checked between chunks of
+                    points (see select_state_until()), and lines of a
+                    family that were not computed in time are left out.
     :param kwargs: A property specified by name. If 'default' is specified in
                     kwargs, the value of the prop will be ignored and a set
                     of default lines for that prop will be computed (see
@@ -352,13 +746,12 @@ def compute_iso_line(subst, n=25, scaling='linear', **kwargs):
     # If we're looking for multiples, compute each by recursion
     if multiline is not None:
         lines = []
-        for val in multiline:
-            arg = {prop: val}  # Build an argument
-            try:
-                lines.append(compute_iso_line(subst, n, scaling, **arg))
-            except pm.utility.PMParamError:
-                # This may error if stuff is out of bounds, just skip that line
-                pass
+        for index, val, line in iter_iso_lines(subst, prop, multiline,
+                                               n, scaling, props, deadline,
+                                               chunked=True):
+            # Lines that were out of bounds come back as None, skip them
+            if line is not None:
+                lines.append(line)
         return lines
 
     # We were asked for a single line, so begin computations for that line
@@ -385,7 +778,7 @@ def compute_iso_line(subst, n=25, scaling='linear', **kwargs):
 
         # We can insert the phase change points
         if multiphase and 'p' in kwargs and pc > kwargs['p'] > pt:
-            Tsat = subst.Ts(p=kwargs['p'])
+            Tsat = saturation_T(subst, kwargs['p'])
             i_insert = np.argmax(line_T > Tsat)
 
             line_T = np.insert(line_T, i_insert,
@@ -416,7 +809,7 @@ def compute_iso_line(subst, n=25, scaling='linear', **kwargs):
 
         # We can insert the phase change points
         if multiphase and 'T' in kwargs and Tc > kwargs['T'] > Tt:
-            psat = subst.ps(T=kwargs['T'])
+            psat = saturation_p(subst, kwargs['T'])
             i_insert = np.argmax(line_p > psat)
 
             line_p = np.insert(line_p, i_insert,
@@ -430,11 +823,912 @@ def compute_iso_line(subst, n=25, scaling='linear', **kwargs):
     else:  # Should never arrive here without error
         raise pm.utility.PMParamError('property invalid')
 
-    states = subst.state(**kwargs)
+    states = select_state_until(deadline, subst, props, **kwargs)
 
     return states
 
 
+def get_iso_values(subst, **kwargs):
+    """
+    Resolve the constant property and its values for an isoline request
+    :param subst: a pyromat substance object
+    :param kwargs: The same property arguments accepted by compute_iso_line()
+    :return: prop, vals - the property name and a 1D np array of the values
+                for which lines should be computed.
+    """
+    default_mode = kwargs.pop('default', None) is not None
+
+    if len(kwargs) != 1:
+        raise pm.utility.PMParamError("Specify exactly one property "
+                                      "for an isoline")
+    prop = list(kwargs.keys())[0]
+
+    if default_mode:
+        vals = get_default_lines(subst, prop)
+    else:
+        vals = np.atleast_1d(kwargs[prop]).flatten()
+    return prop, vals
+
+
+def iter_iso_lines(subst, prop, vals, n=25, scaling='linear', props=None,
+                   deadline=None, chunked=False):
+    """
+    Generate a family of isolines one line at a time
+    :param subst: a pyromat substance object
+    :param prop: The name of the property held constant on each line
+    :param vals: An iterable of the constant values, one per line
+    :param n: The number of points to compute to define each line
+    :param scaling: Should point spacing be 'linear' or 'log'
+    :param props: A list of the properties to compute, or None for all
+    :param deadline: A time.perf_counter() time, or None for no deadline
+    :param chunked: Whether to check the deadline between chunks of the
+                points of each line as well as between lines
+    :return: A generator yielding (index, val, line) tuples as soon as each
+                line is computed. If a line raises a PMParamError (e.g. it
+                is out of bounds), line will be None. If the deadline
+                passes, the generator stops early, and the lines after the
+                last index were not computed.
+    """
+    for index, val in enumerate(vals):
+        arg = {prop: val}  # Build an argument
+        try:
+            check_deadline(deadline)
+            line = compute_iso_line(subst, n, scaling, props,
+                                    deadline if chunked else None, **arg)
+        except pm.utility.PMParamError:
+            # This may error if stuff is out of bounds, just skip that line
+            line = None
+        except PMGIDeadlineError:
+            return
+        yield index, val, line
+
+
+# ### Admission control
+# Every request handler estimates the cost of its work right after its
+# arguments are checked by require().  Costs are rough estimates of the
+# compute time in microseconds.  A request whose own cost exceeds
+# COST_REQUEST_LIMIT is rejected (413), and a request that would push the
+# total cost of the requests in progress in this worker past
+# COST_WORKER_LIMIT is turned away until the others finish (429).
+COST_REQUEST_LIMIT = float(os.environ.get('PMGI_COST_REQUEST', 2e7))
+COST_WORKER_LIMIT = float(os.environ.get('PMGI_COST_WORKER', 6e7))
+
+# Per-point cost by substance class and by how the state is resolved:
+#   'direct'    T and d (or v) are given, nothing needs to be solved
+#   'solve'     T and p, or a quality, requires a density/saturation solve
+#   'inverse'   h, s, e or (p,d) requires an iterative temperature solve
+# Unknown classes are charged like mp1.
+POINT_COST = {
+    'mp1': {'direct': 5., 'solve': 50., 'inverse': 700.},
+    'igmix': {'direct': .5, 'solve': .6, 'inverse': 4.},
+    'ig2': {'direct': .2, 'solve': .3, 'inverse': 1.2},
+    'ig': {'direct': .2, 'solve': .3, 'inverse': 1.2},
+}
+# A fixed charge for every request, whatever it asks for
+COST_OVERHEAD = 100.
+
+_worker_lock = threading.Lock()
+_worker_cost = 0.
+
+
+# ### Memory accounting
+# A request's memory is dominated by its arrays, and by the copies that
+# are made of them as the response is encoded (rounding, tolist() and
+# the JSON text).  A request whose estimated peak exceeds MEMORY_LIMIT
+# (bytes, PMGI_MEMORY_LIMIT, 0 for no limit) is rejected (413) when it is
+# admitted, and again before its response is encoded, when its actual
+# size is known.  See PMGIRequest.estimate_memory() and check_memory().
+#
+# A fraction, PMGI_MEMORY_SAMPLE, of requests are traced with tracemalloc
+# to measure their peak allocation, which is reported by route in the
+# memory section of the /info response.  Traced requests are also checked
+# against the limit between the chunks of a grid.  tracemalloc counts
+# every thread, so requests that are traced at the same time as others
+# are computing (PMGI_SLOTS > 1, or streams) report an upper bound.
+MEMORY_LIMIT = float(os.environ.get('PMGI_MEMORY_LIMIT', 0.))
+MEMORY_SAMPLE = float(os.environ.get('PMGI_MEMORY_SAMPLE', 0.))
+# Bytes per returned value, from the request to the encoded response
+MEMORY_VALUE_BYTES = 100.
+# Bytes per value to encode a response, by how it is encoded
+MEMORY_ENCODE_BYTES = {'json': 64., 'binary': 24.}
+
+_memory_lock = threading.Lock()
+_memory_tracing = 0
+# Whether tracemalloc was started here, rather than by a profiler or by
+# PYTHONTRACEMALLOC, and so may be stopped here
+_memory_started = False
+_memory_stats = {}
+
+
+def count_values(data):
+    """Count the values in the arrays of a response's data
+    n = count_values(data)
+"""
+    if isinstance(data, np.ndarray):
+        return data.size
+    elif isinstance(data, dict):
+        return sum(count_values(value) for value in data.values())
+    elif isinstance(data, (list, tuple)):
+        return sum(count_values(value) for value in data)
+    return 1
+
+
+def request_memory():
+    """Return the bytes allocated since the current request started
+    allocated = request_memory()
+
+Returns None if the request is not being traced.
+"""
+    trace = flask.g.get('pmgi_memory')
+    if trace is None:
+        return None
+    return tracemalloc.get_traced_memory()[0] - trace['baseline']
+
+
+def start_memory_trace():
+    """Start tracing the memory of the current request
+    trace = start_memory_trace()
+"""
+    global _memory_tracing, _memory_started
+    with _memory_lock:
+        # The peak can only be reset while no one else is being traced
+        if not _memory_tracing:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                _memory_started = True
+        _memory_tracing += 1
+        return {'baseline': tracemalloc.get_traced_memory()[0]}
+
+
+def stop_memory_trace(trace):
+    """Stop tracing the memory of the current request
+    peak = stop_memory_trace(trace)
+
+Returns the peak bytes allocated while the request was traced.  Tracing
+is only stopped if start_memory_trace() started it.
+"""
+    global _memory_tracing, _memory_started
+    with _memory_lock:
+        peak = tracemalloc.get_traced_memory()[1] - trace['baseline']
+        _memory_tracing -= 1
+        if not _memory_tracing and _memory_started:
+            tracemalloc.stop()
+            _memory_started = False
+        return max(peak, 0)
+
+
+def record_memory(route, peak=None, refused=False):
+    """Add a request to the memory statistics for its route"""
+    with _memory_lock:
+        stats = _memory_stats.get(route)
+        if stats is None:
+            stats = _memory_stats[route] = {
+                'traced': 0, 'refused': 0, 'peak_max': 0, 'peak_total': 0,
+                'peak_last': None}
+        if refused:
+            stats['refused'] += 1
+        if peak is not None:
+            stats['traced'] += 1
+            stats['peak_total'] += peak
+            stats['peak_max'] = max(stats['peak_max'], peak)
+            stats['peak_last'] = peak
+
+
+def memory_report():
+    """Return a dict of the memory statistics
+
+The routes report how many requests were traced and refused, and the
+largest, mean, and last peak allocation of the traced requests in bytes.
+"""
+    with _memory_lock:
+        routes = {}
+        for route, stats in _memory_stats.items():
+            routes[route] = dict(stats)
+            routes[route]['peak_mean'] = \
+                stats['peak_total'] / stats['traced'] if stats['traced'] \
+                else None
+            del routes[route]['peak_total']
+        return {'limit': MEMORY_LIMIT or None, 'sample': MEMORY_SAMPLE,
+                'rss': get_rss(), 'routes': routes}
+
+
+def point_cost(idstr, props):
+    """Estimate the cost of evaluating a single state
+    cost = point_cost(idstr, props)
+
+idstr is the substance id string, and props is an iterable of the names
+of the properties that define the state.  The cost is looked up in the
+POINT_COST table.
+"""
+    subst = pm.dat.data.get(idstr)
+    cls = subst.pmclass() if subst is not None else None
+    costs = POINT_COST.get(cls, POINT_COST['mp1'])
+
+    props = set(props)
+    if props & {'h', 's', 'e'}:
+        return costs['inverse']
+    elif 'T' in props and props & {'d', 'v'}:
+        return costs['direct']
+    elif 'T' in props or 'x' in props:
+        return costs['solve']
+    return costs['inverse']
+
+
+# ### Request deadlines
+# A family of isolines is computed one line at a time, and a single slow
+# line could otherwise hold its request past the timeout of a proxy, which
+# would then send nothing at all.  Isoline requests have a deadline,
+# DEADLINE seconds (PMGI_DEADLINE) after they arrive, which is checked
+# before each line.  The client may shorten it with the deadline argument,
+# but not extend it.  Then it is also checked between the chunks of
+# DEADLINE_CHUNK points of each line, which costs a little time, since the
+# chunks are evaluated in separate calls.  The lines that were finished in
+# time are returned with a warning listing the values that were skipped.
+DEADLINE = float(os.environ.get('PMGI_DEADLINE', 25.))
+DEADLINE_CHUNK = int(os.environ.get('PMGI_DEADLINE_CHUNK', 25))
+
+
+class PMGIDeadlineError(Exception):
+    """Raised when a computation runs past the deadline of its request"""
+    pass
+
+
+def get_deadline(t0, limit=None):
+    """Return the deadline of a request that arrived at t0
+    deadline = get_deadline(t0, limit=None)
+
+t0 is a time.perf_counter() time, and limit is the number of seconds the
+client asked for, or None.  It is capped at DEADLINE.
+"""
+    if limit is None:
+        limit = DEADLINE
+    return t0 + min(max(limit, 0.), DEADLINE)
+
+
+def check_deadline(deadline):
+    """Raise PMGIDeadlineError if the deadline has passed (None never does)"""
+    if deadline is not None and time.perf_counter() >= deadline:
+        raise PMGIDeadlineError('The request passed its deadline.')
+
+
+def join_states(results, chunks, shape):
+    """Put the states of chunks of an array back together
+    states = join_states(results, chunks, shape)
+
+results is a list of the select_state() dicts of the chunks, in order,
+chunks is a list of the (start, stop) index of each chunk in the
+flattened array, and shape is the shape of the array.
+"""
+    out = {}
+    for prop in results[0]:
+        parts = [np.broadcast_to(np.atleast_1d(states[prop]).ravel(),
+                                 (stop - start,))
+                 for states, (start, stop) in zip(results, chunks)]
+        out[prop] = np.concatenate(parts).reshape(shape)
+    return out
+
+
+def select_state_until(deadline, subst, props=None, **kwargs):
+    """Evaluate a state or states like select_state(), in chunks
+    states = select_state_until(deadline, subst, props=None, **kwargs)
+
+The property arguments are broadcast together and evaluated
+DEADLINE_CHUNK states at a time.  The deadline is checked before each
+chunk.  PYroMat raises an error for a chunk whose states are all out of
+bounds, where it would have returned NaN for them in a longer array, so
+if a chunk fails, the whole array is evaluated again in one call.  The
+results are then those of select_state(), errors included.
+"""
+    if deadline is None:
+        return select_state(subst, props, **kwargs)
+    values = np.broadcast_arrays(*[np.asarray(value, dtype=float)
+                                   for value in kwargs.values()])
+    shape = values[0].shape if values else ()
+    n = int(np.prod(shape))
+    check_deadline(deadline)
+    if n <= DEADLINE_CHUNK:
+        return select_state(subst, props, **kwargs)
+
+    flat = dict(zip(kwargs, [value.ravel() for value in values]))
+    chunks = [(start, min(start + DEADLINE_CHUNK, n))
+              for start in range(0, n, DEADLINE_CHUNK)]
+    results = []
+    for start, stop in chunks:
+        check_deadline(deadline)
+        try:
+            results.append(select_state(
+                subst, props, **{name: value[start:stop].copy()
+                                 for name, value in flat.items()}))
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+            check_deadline(deadline)
+            return select_state(subst, props, **kwargs)
+    return join_states(results, chunks, shape)
+
+
+# ### Plot tiles
+# The /tiles route serves the default isolines and the steam dome of a
+# property diagram in tiles, so that a zoomed-in plot can load detailed
+# lines for only the region in view.  At zoom level L, the diagram is split
+# into 2**L by 2**L tiles, and the lines are computed with
+# TILE_POINTS * 2**L points each.  The extent of the diagram is the extent
+# of the lines at level 0.
+#
+# The lines of each substance, units and level are computed the first time
+# one of their tiles is asked for, and up to TILE_LINE_CACHE sets are kept.
+# Up to TILE_CACHE tiles are kept after they have been cut from the lines.
+TILE_LEVELS = int(os.environ.get('PMGI_TILE_LEVELS', 4))
+TILE_POINTS = 50
+TILE_LINE_CACHE = 8
+TILE_CACHE = 256
+# The families of default lines on the tiles, like the live plots
+TILE_FAMILIES = ('p', 'T', 'd', 'h', 's', 'x')
+# The properties that may be used as diagram axes
+TILE_AXES = ('T', 'p', 'd', 'v', 'e', 'h', 's')
+# Tiles only depend on the request and the installed versions
+TILE_MAX_AGE = 24 * 3600
+
+_tile_lock = threading.Lock()
+_tile_lines = OrderedDict()
+_tiles = OrderedDict()
+
+
+def compute_dome(subst, n):
+    """Compute the steam dome as a single line
+    line = compute_dome(subst, n)
+
+The saturated liquid states from the triple point to the critical point
+are followed by the saturated vapor states back to the triple point, with
+n temperatures on each side.  Values come from the substance's cached
+SaturationModel if possible.
+"""
+    Tc, pc, dc = subst.critical(density=True)
+    Tt, pt = subst.triple()
+    # The critical point is added separately
+    ep = (Tc - Tt) * .01
+    Ts = np.linspace(Tt + ep, Tc - ep, n)
+    model = get_saturation_model(subst)
+    if model is not None and model.covers_T(Ts):
+        liquid, vapor = model.states(Ts)
+        critical = model.critical
+    else:
+        dsL, dsV = subst.ds(T=Ts)
+        liquid = select_state(subst, T=Ts, d=dsL)
+        vapor = select_state(subst, T=Ts, d=dsV)
+        critical = subst.state(p=pc, d=dc)
+    return {prop: np.concatenate([np.atleast_1d(liquid[prop]),
+                                  np.atleast_1d(critical[prop]),
+                                  np.atleast_1d(vapor[prop])[::-1]])
+            for prop in liquid if prop in vapor and prop in critical}
+
+
+def get_tile_lines(subst, level):
+    """Return the lines of a substance at a zoom level, computing if needed
+    lines = get_tile_lines(subst, level)
+
+lines is a dict of lists of lines, keyed by the property that is
+constant on them, or 'steamdome'.  Each line is a dict of all of the
+state properties.  Lines are cached by substance id, the active
+PYroMat units, and level.
+"""
+    key = (subst.data['id'], level) + tuple(
+        pm.config[param] for param in pm.config if param.startswith('unit_'))
+    with _tile_lock:
+        lines = _tile_lines.get(key)
+        if lines is not None:
+            _tile_lines.move_to_end(key)
+            return lines
+
+    n = TILE_POINTS * 2 ** level
+    lines = {}
+    for prop in TILE_FAMILIES:
+        if prop == 'x' and not ismultiphase(subst):
+            continue
+        try:
+            vals = get_default_lines(subst, prop)
+        except pm.utility.PMParamError:
+            continue
+        lines[prop] = [line for index, val, line
+                       in iter_iso_lines(subst, prop, vals, n=n)
+                       if line is not None]
+    if ismultiphase(subst):
+        try:
+            lines['steamdome'] = [compute_dome(subst, n)]
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+            pass
+
+    with _tile_lock:
+        _tile_lines[key] = lines
+        while len(_tile_lines) > TILE_LINE_CACHE:
+            _tile_lines.popitem(last=False)
+    return lines
+
+
+def tile_extent(lines, x, y, xscale, yscale):
+    """Return the extent of the lines on a diagram as [x0, x1, y0, y1]
+
+The extent is in axis coordinates, which are log10 of the values on a
+log scale.
+"""
+    extent = []
+    for prop, scale in ((x, xscale), (y, yscale)):
+        lo, hi = np.inf, -np.inf
+        for family in lines.values():
+            for line in family:
+                values = tile_coordinates(line[prop], scale)
+                values = values[np.isfinite(values)]
+                if values.size:
+                    lo = min(lo, values.min())
+                    hi = max(hi, values.max())
+        if not lo < hi:
+            raise pm.utility.PMParamError(
+                f'The diagram has no extent along {prop}.')
+        extent += [float(lo), float(hi)]
+    return extent
+
+
+def tile_coordinates(values, scale):
+    """Convert values to axis coordinates (log10 on a log scale)"""
+    values = np.asarray(values, dtype=float)
+    if scale == 'log':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(values > 0, np.log10(values), np.nan)
+    return values
+
+
+def clip_line(line, x, y, xscale, yscale, window):
+    """Return the pieces of a line inside a window
+    index = clip_line(line, x, y, xscale, yscale, window)
+
+window is [x0, x1, y0, y1] in axis coordinates.  Returns a list of index
+arrays, one for each piece of the line that crosses the window.  Each
+piece includes the points just outside of the window, so that the lines
+run on to the edge of the tile.
+"""
+    xs = tile_coordinates(line[x], xscale)
+    ys = tile_coordinates(line[y], yscale)
+    x0, x1, y0, y1 = window
+    with np.errstate(invalid='ignore'):
+        inside = (xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)
+    if not inside.any():
+        return []
+    # Take in the neighbors of the points inside
+    keep = inside.copy()
+    keep[1:] |= inside[:-1]
+    keep[:-1] |= inside[1:]
+    keep &= np.isfinite(xs) & np.isfinite(ys)
+    # Split at the gaps
+    index = np.nonzero(keep)[0]
+    breaks = np.nonzero(np.diff(index) > 1)[0] + 1
+    return [piece for piece in np.split(index, breaks) if piece.size > 1]
+
+
+def make_tile(subst, x, y, xscale, yscale, level, i, j):
+    """Cut a tile from the lines of a diagram
+    tile = make_tile(subst, x, y, xscale, yscale, level, i, j)
+
+Tile i, j is the i-th from the left and the j-th from the bottom of the
+2**level by 2**level tiles.  The tile is a dict with
+    extent  [x0, x1, y0, y1], the extent of the diagram
+    window  [x0, x1, y0, y1], the region covered by the tile
+    lines   a dict keyed by family ('p', 'T', ..., 'steamdome') of dicts
+            with the x, y and (constant) value arrays of its lines, with
+            a NaN between the pieces of the lines
+The extent and window are in axis coordinates (see tile_extent()), but
+the lines are not.  Tiles are cached by substance, units and diagram.
+"""
+    key = (subst.data['id'], x, y, xscale, yscale, level, i, j) + tuple(
+        pm.config[param] for param in pm.config if param.startswith('unit_'))
+    with _tile_lock:
+        tile = _tiles.get(key)
+        if tile is not None:
+            _tiles.move_to_end(key)
+            return tile
+
+    extent = tile_extent(get_tile_lines(subst, 0), x, y, xscale, yscale)
+    count = 2 ** level
+    dx = (extent[1] - extent[0]) / count
+    dy = (extent[3] - extent[2]) / count
+    window = [extent[0] + i * dx, extent[0] + (i + 1) * dx,
+              extent[2] + j * dy, extent[2] + (j + 1) * dy]
+
+    tile_lines = {}
+    for family, lines in get_tile_lines(subst, level).items():
+        xs, ys, values = [], [], []
+        for line in lines:
+            for piece in clip_line(line, x, y, xscale, yscale, window):
+                xs += [line[x][piece], [np.nan]]
+                ys += [line[y][piece], [np.nan]]
+                if family == 'steamdome':
+                    values += [np.full(piece.size + 1, np.nan)]
+                else:
+                    values += [line[family][piece], [np.nan]]
+        if xs:
+            tile_lines[family] = {'x': np.concatenate(xs),
+                                  'y': np.concatenate(ys),
+                                  'value': np.concatenate(values)}
+    tile = {'extent': extent, 'window': window, 'lines': tile_lines}
+
+    with _tile_lock:
+        _tiles[key] = tile
+        while len(_tiles) > TILE_CACHE:
+            _tiles.popitem(last=False)
+    return tile
+
+
+# ### Diagram images
+# The /diagram route renders the standard property diagrams of a substance
+# to an SVG (or PNG) image on the server, for clients that cannot run the
+# live plots (slides, course pages, phones).  They are drawn from the same
+# default isolines and steam dome as the level 0 tiles (see
+# get_tile_lines()), with the same styles as the live plots.  Images are
+# cached by substance, units, diagram, format and size, and up to
+# DIAGRAM_CACHE of them are kept.
+DIAGRAM_CACHE = int(os.environ.get('PMGI_DIAGRAM_CACHE', 64))
+DIAGRAM_MAX_SIZE = 2000
+DIAGRAM_MIN_SIZE = 100
+# The axes of each diagram, as (x, y, xscale, yscale)
+DIAGRAMS = {
+    'Ts': ('s', 'T', 'linear', 'linear'),
+    'ph': ('h', 'p', 'linear', 'log'),
+    'pv': ('v', 'p', 'log', 'log'),
+}
+# Line styles by family, as (color, width, dash), like the live plots
+DIAGRAM_STYLES = {
+    'steamdome': ('rgb(0,0,0)', 3, None),
+    'p': ('rgb(0,100,0)', 1, '2,2'),
+    'T': ('rgb(155,0,0)', 1, '2,2'),
+    'd': ('rgb(0,155,155)', 1, '2,2'),
+    'h': ('rgb(155,155,0)', 1, '2,2'),
+    's': ('rgb(0,0,155)', 1, '6,4'),
+    'x': ('rgb(155,0,155)', 1, '2,2'),
+}
+# Space around the plot area for the tick labels and axis titles (pixels)
+DIAGRAM_MARGIN = {'left': 64, 'right': 16, 'top': 28, 'bottom': 48}
+DIAGRAM_MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+_diagram_lock = threading.Lock()
+_diagrams = OrderedDict()
+
+
+def diagram_ticks(lo, hi, scale):
+    """Return the ticks of a diagram axis as (positions, labels)
+
+lo and hi are the ends of the axis in axis coordinates (see
+tile_coordinates()).  Log axes are ticked at the decades, and linear axes
+at multiples of 1, 2 or 5 times a power of ten, so that there are about
+six ticks.
+"""
+    if scale == 'log' and np.floor(hi) - np.ceil(lo) >= 1:
+        step = max(1., np.ceil((np.floor(hi) - np.ceil(lo)) / 8.))
+        ticks = np.arange(np.ceil(lo), np.floor(hi) + .5, step)
+        return ticks, ['%g' % 10. ** tick for tick in ticks]
+    raw = (hi - lo) / 6.
+    mag = 10. ** np.floor(np.log10(raw))
+    step = mag * next(mult for mult in (1., 2., 5., 10.) if mult * mag >= raw)
+    # Whole multiples of the step, so that zero is not a rounding error,
+    # and + 0. so that it is not labelled -0
+    ticks = np.arange(np.ceil(lo / step), hi / step + 1e-6) * step + 0.
+    if scale == 'log':
+        return ticks, ['%.3g' % 10. ** tick for tick in ticks]
+    return ticks, ['%.6g' % tick for tick in ticks]
+
+
+def diagram_label(prop):
+    """Return the axis title of a property in the active PYroMat units"""
+    energy = pm.config['unit_energy']
+    matter = pm.config['unit_matter']
+    units = {
+        'T': pm.config['unit_temperature'],
+        'p': pm.config['unit_pressure'],
+        'd': f"{matter}/{pm.config['unit_volume']}",
+        'v': f"{pm.config['unit_volume']}/{matter}",
+        'e': f'{energy}/{matter}',
+        'h': f'{energy}/{matter}',
+        's': f"{energy}/{matter}/{pm.config['unit_temperature']}",
+    }
+    return f'{prop} ({units[prop]})'
+
+
+def render_diagram(subst, diagram, width, height):
+    """Render a property diagram as an SVG document
+    svg = render_diagram(subst, diagram, width, height)
+
+diagram is one of the keys of DIAGRAMS, and width and height are the
+size of the image in pixels.  The diagram shows the steam dome (of
+multi-phase substances) and the default isolines of every family that is
+not one of its axes.  Returns the document as a str.
+"""
+    x, y, xscale, yscale = DIAGRAMS[diagram]
+    lines = get_tile_lines(subst, 0)
+    x0, x1, y0, y1 = tile_extent(lines, x, y, xscale, yscale)
+    left = DIAGRAM_MARGIN['left']
+    top = DIAGRAM_MARGIN['top']
+    plot_w = width - left - DIAGRAM_MARGIN['right']
+    plot_h = height - top - DIAGRAM_MARGIN['bottom']
+
+    def to_px(xs, ys):
+        px = left + (tile_coordinates(xs, xscale) - x0) / (x1 - x0) * plot_w
+        py = top + (y1 - tile_coordinates(ys, yscale)) / (y1 - y0) * plot_h
+        return px, py
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+           f'height="{height}" viewBox="0 0 {width} {height}" '
+           'font-family="sans-serif" font-size="11">',
+           f'<title>{html.escape(subst.data["id"])} '
+           f'{y}-{x} diagram</title>',
+           f'<rect width="{width}" height="{height}" fill="white"/>',
+           '<defs><clipPath id="plot">'
+           f'<rect x="{left}" y="{top}" width="{plot_w}" '
+           f'height="{plot_h}"/></clipPath></defs>',
+           '<g clip-path="url(#plot)" fill="none">']
+    # Families first, so the dome is drawn over them
+    for family in sorted(lines, key=lambda name: name == 'steamdome'):
+        if family in (x, y) or family not in DIAGRAM_STYLES:
+            continue
+        color, stroke, dash = DIAGRAM_STYLES[family]
+        path = []
+        for line in lines[family]:
+            px, py = to_px(line[x], line[y])
+            ok = np.isfinite(px) & np.isfinite(py)
+            # Split the line at the points that can't be drawn
+            index = np.nonzero(ok)[0]
+            breaks = np.nonzero(np.diff(index) > 1)[0] + 1
+            for piece in np.split(index, breaks):
+                if piece.size < 2:
+                    continue
+                path.append('M' + ' L'.join(
+                    '%.1f %.1f' % point
+                    for point in zip(px[piece], py[piece])))
+        if path:
+            out.append(f'<path stroke="{color}" stroke-width="{stroke}"'
+                       + (f' stroke-dasharray="{dash}"' if dash else '')
+                       + f' d="{" ".join(path)}"/>')
+    out.append('</g>')
+
+    # The frame, ticks and titles
+    out.append(f'<rect x="{left}" y="{top}" width="{plot_w}" '
+               f'height="{plot_h}" fill="none" stroke="black"/>')
+    bottom = top + plot_h
+    ticks, labels = diagram_ticks(x0, x1, xscale)
+    for tick, label in zip(ticks, labels):
+        px = left + (tick - x0) / (x1 - x0) * plot_w
+        out.append(f'<path stroke="black" d="M{px:.1f} {bottom} '
+                   f'v5"/><text x="{px:.1f}" y="{bottom + 17}" '
+                   f'text-anchor="middle">{label}</text>')
+    ticks, labels = diagram_ticks(y0, y1, yscale)
+    for tick, label in zip(ticks, labels):
+        py = top + (y1 - tick) / (y1 - y0) * plot_h
+        out.append(f'<path stroke="black" d="M{left} {py:.1f} h-5"/>'
+                   f'<text x="{left - 8}" y="{py + 4:.1f}" '
+                   f'text-anchor="end">{label}</text>')
+    out.append(f'<text x="{left + plot_w / 2:.1f}" y="{height - 8}" '
+               f'text-anchor="middle" font-size="13">'
+               f'{html.escape(diagram_label(x))}</text>')
+    out.append(f'<text transform="translate(14 {top + plot_h / 2:.1f}) '
+               f'rotate(-90)" text-anchor="middle" font-size="13">'
+               f'{html.escape(diagram_label(y))}</text>')
+    out.append(f'<text x="{left + plot_w / 2:.1f}" y="{top - 10}" '
+               f'text-anchor="middle" font-size="14">'
+               f'{html.escape(subst.data["id"])}</text>')
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+def get_diagram(subst, diagram, fmt, width, height):
+    """Return a rendered diagram image, rendering it if needed
+    image = get_diagram(subst, diagram, fmt, width, height)
+
+fmt is 'svg' or 'png'.  Returns the bytes of the image.  Images are
+cached by substance id, the active PYroMat units, diagram, format and
+size.  PNG images are converted from the SVG by cairosvg, which must be
+installed.
+"""
+    key = (subst.data['id'], diagram, fmt, width, height) + tuple(
+        pm.config[param] for param in pm.config if param.startswith('unit_'))
+    with _diagram_lock:
+        image = _diagrams.get(key)
+        if image is not None:
+            _diagrams.move_to_end(key)
+            return image
+
+    image = render_diagram(subst, diagram, width, height).encode('utf-8')
+    if fmt == 'png':
+        image = cairosvg.svg2png(bytestring=image)
+
+    with _diagram_lock:
+        _diagrams[key] = image
+        while len(_diagrams) > DIAGRAM_CACHE:
+            _diagrams.popitem(last=False)
+    return image
+
+
+# ### Thermodynamic cycles
+# The /cycle route solves a chain of states in one request, in place of a
+# round trip for each state of a cycle.  Each state is either given by two
+# properties, like a /state request, or it is reached from an earlier state
+# by one of the CYCLE_PROCESSES, which holds a property of that state
+# constant, and one more property.  Any value may be an array, and they
+# are all broadcast together, so that a cycle may be swept over one (or
+# more) of its parameters.  See solve_cycle().
+#
+# The heat and work of each process are per unit matter of a steady flow,
+# with heat into and work out of the fluid positive.
+CYCLE_PROCESSES = {
+    'isentropic': 's',
+    'isobaric': 'p',
+    'isothermal': 'T',
+    'throttling': 'h',
+}
+# The properties that may be given for a state
+CYCLE_INPUTS = ('T', 'p', 'd', 'v', 'e', 'h', 's', 'x')
+CYCLE_MAX_STATES = 32
+
+
+def tocycle(a):
+    """Condition a list of cycle states (a list of dicts, or its JSON text)"""
+    if isinstance(a, str):
+        a = json.loads(a)
+    if not isinstance(a, list) or not all(isinstance(step, dict)
+                                          for step in a):
+        raise ValueError('The states must be a list of dicts.')
+    return a
+
+
+def cycle_process(process, start, stop, a, b):
+    """Return the heat and work of a process from state a to state b
+    step = cycle_process(process, start, stop, a, b)
+
+start and stop are the indices of the states.  The heat is found from
+the process (none for isentropic and throttling processes, T ds for
+isothermal processes, and the change in enthalpy otherwise), and the
+work from the energy balance of a steady flow, w = q - (hb - ha).
+"""
+    dh = b['h'] - a['h']
+    if process == 'isothermal':
+        T = pm.units.temperature_scale(np.array(a['T'], dtype=float),
+                                       to_units='abs')
+        q = T * (b['s'] - a['s'])
+    elif process in ('isentropic', 'throttling'):
+        q = np.zeros_like(dh)
+    else:
+        q = dh
+    return {'process': process, 'from': start, 'to': stop,
+            'q': q, 'w': q - dh}
+
+
+def cycle_state(subst, args):
+    """Evaluate the full state of a cycle from its property arguments
+
+The arguments are broadcast to the same shape and copied first.  Some of
+PYroMat's inverse solvers (e.g. T(s, p) of the ideal gases) do not
+broadcast a single value against an array, and they may change their
+arguments in place.
+"""
+    values = np.broadcast_arrays(*args.values())
+    return select_state(subst, None, **{name: np.array(value, dtype=float)
+                                        for name, value in zip(args, values)})
+
+
+def solve_cycle(subst, steps, close=False):
+    """Solve the states and processes of a cycle
+    cycle = solve_cycle(subst, steps, close=False)
+
+steps is a list of dicts, one per state, each of which is either
+    {'T': 300, 'p': 1}
+        A state given by two of CYCLE_INPUTS
+    {'from': 0, 'process': 'isentropic', 'p': 10, 'efficiency': .85}
+        A state reached from an earlier state (the previous one, if from
+        is not given) by one of CYCLE_PROCESSES, and given by one more
+        property.  An isentropic process may have an isentropic
+        efficiency, which is applied to the change in enthalpy.  It is a
+        compression where the enthalpy rises, and an expansion otherwise.
+If close is True, the last state returns to the first by exchanging heat
+only (e.g. a condenser or a cooler).
+
+Returns a dict with
+    states      a list of the full states (see select_state())
+    processes   a list of dicts with the process, the from and to state
+                indices, and its heat, q, and work, w (see cycle_process())
+    w_net       the total work
+    q_in        the total heat into the fluid
+    q_out       the total heat out of the fluid (positive)
+    eta         the thermal efficiency, w_net / q_in
+Raises a PMParamError if a state is not properly defined, or if it can't
+be computed.
+"""
+    if not steps:
+        raise pm.utility.PMParamError('The cycle has no states.')
+    if len(steps) > CYCLE_MAX_STATES:
+        raise pm.utility.PMParamError(
+            f'A cycle may have up to {CYCLE_MAX_STATES} states.')
+
+    states = []
+    processes = []
+    for index, step in enumerate(steps):
+        where = f'State {index}'
+        unknown = [name for name in step if name not in CYCLE_INPUTS
+                   and name not in ('from', 'process', 'efficiency')]
+        if unknown:
+            raise pm.utility.PMParamError(
+                f'{where} has unrecognized entries: ' + ', '.join(unknown))
+        given = {name: toarray(value)
+                 for name, value in step.items() if name in CYCLE_INPUTS}
+        process = step.get('process')
+
+        try:
+            if process is None:
+                if 'from' in step or 'efficiency' in step:
+                    raise pm.utility.PMParamError(
+                        f'{where} is given from a state, but has no process.')
+                if len(given) != 2:
+                    raise pm.utility.PMParamError(
+                        f'{where} must be given by two properties.')
+                state = cycle_state(subst, given)
+            else:
+                if process not in CYCLE_PROCESSES:
+                    raise pm.utility.PMParamError(
+                        f'{where} has an unrecognized process: {process}. '
+                        'Use one of: ' + ', '.join(CYCLE_PROCESSES))
+                start = step.get('from', index - 1)
+                if not isinstance(start, int) or not 0 <= start < index:
+                    raise pm.utility.PMParamError(
+                        f'{where} must come from an earlier state.')
+                held = CYCLE_PROCESSES[process]
+                if len(given) != 1 or held in given:
+                    raise pm.utility.PMParamError(
+                        f'{where} must be given by one property other than '
+                        f'{held} for an {process} process.')
+                origin = states[start]
+                args = dict(given)
+                args[held] = origin[held]
+                state = cycle_state(subst, args)
+                if 'efficiency' in step:
+                    if process != 'isentropic':
+                        raise pm.utility.PMParamError(
+                            f'{where}: only isentropic processes have an '
+                            'efficiency.')
+                    eta = toarray(step['efficiency'])
+                    if not np.all((eta > 0.) & (eta <= 1.)):
+                        raise pm.utility.PMParamError(
+                            f'{where}: efficiencies must be in (0, 1].')
+                    h0 = origin['h']
+                    hs = state['h']
+                    args = dict(given)
+                    args['h'] = np.where(hs > h0, h0 + (hs - h0) / eta,
+                                         h0 - eta * (h0 - hs))
+                    state = cycle_state(subst, args)
+                processes.append(cycle_process(process, start, index,
+                                               origin, state))
+        except pm.utility.PMAnalysisError as e:
+            raise pm.utility.PMParamError(
+                f'{where} could not be computed: {e}')
+        except ValueError:
+            # Sweeps of different lengths do not broadcast
+            raise pm.utility.PMParamError(
+                f'{where} has values of different lengths.')
+        states.append(state)
+
+    try:
+        if close and len(states) > 1:
+            processes.append(cycle_process('close', len(states) - 1, 0,
+                                           states[-1], states[0]))
+
+        w_net = sum(step['w'] for step in processes) if processes else 0.
+        q_in = sum(np.maximum(step['q'], 0.) for step in processes) \
+            if processes else 0.
+        q_out = -sum(np.minimum(step['q'], 0.) for step in processes) \
+            if processes else 0.
+    except ValueError:
+        raise pm.utility.PMParamError(
+            'The states of the cycle have values of different lengths.')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        eta = np.where(np.asarray(q_in) > 0., w_net / q_in, np.nan)
+    return {'states': states, 'processes': processes, 'w_net': w_net,
+            'q_in': q_in, 'q_out': q_out, 'eta': eta}
+
+
 ###
 # Back-end helper/handler classes
 #   These are responsible for automating some of the back-end tedium
@@ -554,6 +1848,1303 @@ out = {'message':mh._messagestr, 'error':mh._errorflag, 'warn:mh._warnflag}
         return bool(self._errorflag)
 
 
+# ### Scheduling
+# Requests are sorted into lanes before they are allowed to compute.  The
+# lower the priority number, the sooner a lane is served.  Each lane has
+# a limit on the number of requests computing at once (slots), on the
+# number waiting (depth), and on how long a request will wait (timeout).
+# Requests estimated to cost more than LANE_BULK_COST go to the bulk lane
+# whatever their route.
+LANES = {
+    'interactive': {'priority': 0, 'slots': 1, 'depth': 64, 'timeout': 10.},
+    'plot': {'priority': 1, 'slots': 1, 'depth': 32, 'timeout': 30.},
+    'bulk': {'priority': 2, 'slots': 1, 'depth': 8, 'timeout': 60.},
+}
+LANE_BULK_COST = 1e6
+# PYroMat's units are global to the process, so requests with different
+# units must not compute at the same time.  Only raise this if every
+# client is known to use the same units.
+SCHEDULER_SLOTS = int(os.environ.get('PMGI_SLOTS', 1))
+# A request that has waited longer than this (seconds) is served next,
+# regardless of its lane's priority, so the bulk lane cannot starve.
+SCHEDULER_MAX_WAIT = 5.
+
+
+class PMGILane:
+    """A single lane of the PMGIScheduler
+
+The lane holds a queue of waiting tickets per client.  Clients are kept
+in an OrderedDict, and a client is moved to the end each time it is
+served, so clients take turns regardless of how many requests each of
+them has waiting.
+
+Statistics are kept in the served, rejected, wait_total and wait_max
+attributes.  See report().
+"""
+
+    def __init__(self, name, priority=0, slots=1, depth=32, timeout=30.):
+        self.name = name
+        self.priority = priority
+        self.slots = slots
+        self.depth = depth
+        self.timeout = timeout
+        self.queues = OrderedDict()
+        self.waiting = 0
+        self.running = 0
+        self.served = 0
+        self.rejected = 0
+        self.wait_total = 0.
+        self.wait_max = 0.
+
+    def push(self, client, ticket):
+        self.queues.setdefault(client, deque()).append(ticket)
+        self.waiting += 1
+
+    def remove(self, client, ticket):
+        queue = self.queues[client]
+        queue.remove(ticket)
+        if not queue:
+            del self.queues[client]
+        self.waiting -= 1
+
+    def head(self):
+        """Return the (client, ticket) that should be served next, or None"""
+        if self.running >= self.slots:
+            return None
+        for client, queue in self.queues.items():
+            return client, queue[0]
+        return None
+
+    def oldest(self):
+        """Return the earliest enqueue time of the waiting tickets, or None"""
+        times = [queue[0][0] for queue in self.queues.values()]
+        return min(times, default=None)
+
+    def served_ticket(self, client, ticket, wait):
+        self.remove(client, ticket)
+        # Send this client to the back of the line if it has more waiting
+        if client in self.queues:
+            self.queues.move_to_end(client)
+        self.running += 1
+        self.served += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def report(self):
+        return {
+            'priority': self.priority,
+            'depth': self.waiting,
+            'running': self.running,
+            'served': self.served,
+            'rejected': self.rejected,
+            'wait_mean': self.wait_total / self.served if self.served else 0.,
+            'wait_max': self.wait_max,
+        }
+
+
+class PMGIScheduler:
+    """The PMGIScheduler decides which request computes next
+
+    scheduler = PMGIScheduler(lanes, slots=1, max_wait=5.)
+
+lanes is a dict of lane names and their PMGILane keyword arguments (see
+LANES).  slots is the number of requests that may compute at once across
+all lanes, and max_wait is the wait (in seconds) after which a request
+is served ahead of higher priority lanes.
+
+Request handlers take their turn with the slot() context manager,
+
+    with scheduler.slot(rh):
+        rh.process_units()
+        rh.process()
+
+The lane is chosen by the handler's classify() method, and the client is
+identified by its remote address.  If the lane is full or the wait times
+out, an error is logged in the handler's mh, its status is set to 429,
+and the body of the with statement is executed anyway so that the
+handler's normal error handling applies.
+"""
+
+    def __init__(self, lanes, slots=1, max_wait=5.):
+        self.lanes = {name: PMGILane(name, **kw) for name, kw in lanes.items()}
+        self.slots = slots
+        self.max_wait = max_wait
+        self.running = 0
+        self._cond = threading.Condition()
+
+    def _next(self):
+        """Return the (lane, client, ticket) that should be served next"""
+        if self.running >= self.slots:
+            return None
+        now = time.perf_counter()
+        candidates = []
+        for lane in self.lanes.values():
+            head = lane.head()
+            if head is not None:
+                candidates.append((lane, ) + head)
+        if not candidates:
+            return None
+        # Anyone who has waited too long goes first
+        overdue = [cc for cc in candidates
+                   if now - cc[2][0] > self.max_wait]
+        if overdue:
+            return min(overdue, key=lambda cc: cc[2][0])
+        return min(candidates, key=lambda cc: cc[0].priority)
+
+    def acquire(self, lane_name, client):
+        """Wait for a turn in the named lane
+    wait = acquire(lane_name, client)
+
+Returns the time spent waiting in seconds, or None if the request was
+turned away because the lane was full or the wait timed out.
+"""
+        lane = self.lanes[lane_name]
+        with self._cond:
+            if lane.waiting >= lane.depth:
+                lane.rejected += 1
+                return None
+            t0 = time.perf_counter()
+            ticket = [t0]
+            lane.push(client, ticket)
+            deadline = t0 + lane.timeout
+            while True:
+                nxt = self._next()
+                if nxt is not None and nxt[2] is ticket:
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    lane.remove(client, ticket)
+                    lane.rejected += 1
+                    # Someone else may be next now
+                    self._cond.notify_all()
+                    return None
+                self._cond.wait(remaining)
+            wait = time.perf_counter() - t0
+            lane.served_ticket(client, ticket, wait)
+            self.running += 1
+            return wait
+
+    def release(self, lane_name):
+        lane = self.lanes[lane_name]
+        with self._cond:
+            lane.running -= 1
+            self.running -= 1
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, rh):
+        # Requests that have already failed do not need a turn
+        if rh.mh:
+            yield
+            return
+        lane_name = rh.classify()
+        client = request.headers.get('X-Forwarded-For',
+                                     request.remote_addr or '')
+        client = client.split(',')[0].strip()
+        wait = self.acquire(lane_name, client)
+        if wait is None:
+            rh.status = 429
+            rh.mh.error('The server is busy.  Please try again later.')
+            yield
+            return
+        try:
+            yield
+        finally:
+            self.release(lane_name)
+
+    def report(self):
+        """Return a dict of the per-lane statistics"""
+        with self._cond:
+            return {name: lane.report() for name, lane in self.lanes.items()}
+
+
+# ### Request schemas
+# The short units map abbreviated unit strings intended for the GET
+# interface
+SHORT_UNITS = {
+    'uT': 'temperature',
+    'uE': 'energy',
+    'uMol': 'molar',
+    'uMas': 'mass',
+    'uM': 'matter',
+    'uV': 'volume',
+    'uP': 'pressure',
+    'uF': 'force',
+    'uL': 'length',
+    'uTim': 'time'
+}
+
+# Request bodies that contain packed arrays.  See read_binary_arrays().
+BINARY_MIMETYPES = ('application/octet-stream', 'application/x-npy')
+# The binary response type.  See PMGIRequest.output_binary().
+BINARY_RESPONSE = 'application/x-pmgi'
+
+_valid_units = {}
+_valid_unit_sets = {}
+
+# The units in which each unit class is measured by the conversion factors
+# of get_unit_conversions().  Matter is measured in mass or molar units.
+UNIT_REFERENCE = {
+    'temperature': 'K',
+    'energy': 'J',
+    'molar': 'kmol',
+    'mass': 'kg',
+    'volume': 'm3',
+    'pressure': 'Pa',
+    'force': 'N',
+    'length': 'm',
+    'time': 's',
+}
+# The powers of the unit classes in the units of each state property
+PROPERTY_DIMENSIONS = {
+    'T': {'temperature': 1},
+    'p': {'pressure': 1},
+    'd': {'matter': 1, 'volume': -1},
+    'v': {'volume': 1, 'matter': -1},
+    'e': {'energy': 1, 'matter': -1},
+    'h': {'energy': 1, 'matter': -1},
+    'f': {'energy': 1, 'matter': -1},
+    'g': {'energy': 1, 'matter': -1},
+    's': {'energy': 1, 'matter': -1, 'temperature': -1},
+    'cp': {'energy': 1, 'matter': -1, 'temperature': -1},
+    'cv': {'energy': 1, 'matter': -1, 'temperature': -1},
+    'x': {},
+    'gam': {},
+}
+_unit_conversions = {}
+
+
+def get_valid_units():
+    """Return the legal unit dict, building it on the first call
+    valid_units = get_valid_units()
+
+The dict is keyed by unit class (e.g. 'temperature'), and its values are
+lists of the legal unit strings.  It is shared by all requests, so it
+must not be modified.
+"""
+    if not _valid_units:
+        _valid_units.update({
+            'temperature': list(pm.units.temperature.get()),
+            'energy': list(pm.units.energy.get()),
+            'molar': list(pm.units.molar.get()),
+            'mass': list(pm.units.mass.get()),
+            'matter': list(pm.units.mass.get()) + list(pm.units.molar.get()),
+            'volume': list(pm.units.volume.get()),
+            'pressure': list(pm.units.pressure.get()),
+            'force': list(pm.units.force.get()),
+            'length': list(pm.units.length.get()),
+            'time': list(pm.units.time.get())
+        })
+        _valid_unit_sets.update(
+            {unit: frozenset(values) for unit, values in _valid_units.items()})
+    return _valid_units
+
+
+def get_unit_conversions():
+    """Return the unit conversion factors, building them on the first call
+    conversions = get_unit_conversions()
+
+The dict has
+    reference   UNIT_REFERENCE
+    scale       a dict keyed by unit class (as UNIT_REFERENCE) of dicts
+                of the factor, by unit, by which a value in the
+                reference unit is multiplied to express it in that unit
+    offset      {'temperature': {...}}, the offsets of the temperature
+                scales, which are added after the factor is applied
+    dimensions  PROPERTY_DIMENSIONS
+A value converts from unit a to unit b by the ratio of their factors.
+Only absolute temperatures (T) use the offsets.  Matter units convert
+between mass and molar units through the molecular weight, in kg/kmol.
+The factors are PYroMat's own, so the result is the same as a request
+in the new units.  It is shared by all requests, so it must not be
+modified.
+"""
+    if not _unit_conversions:
+        valid_units = get_valid_units()
+        scale = {}
+        for unit, reference in UNIT_REFERENCE.items():
+            convert = getattr(pm.units, unit)
+            scale[unit] = {
+                value: float(convert(1., from_units=reference,
+                                     to_units=value))
+                for value in valid_units[unit]}
+        offset = {'temperature': {
+            value: float(pm.units.temperature_scale(
+                0., from_units=UNIT_REFERENCE['temperature'],
+                to_units=value))
+            for value in valid_units['temperature']}}
+        _unit_conversions.update({
+            'reference': UNIT_REFERENCE,
+            'scale': scale,
+            'offset': offset,
+            'dimensions': PROPERTY_DIMENSIONS})
+    return _unit_conversions
+
+
+class PMGISchema:
+    """A compiled set of argument rules for a request handler
+
+    schema = PMGISchema(types, mandatory)
+
+types is a dict of argument names and the class or callable used to
+condition each argument's value.  mandatory is an iterable of the
+argument names that are required.  See PMGIRequest.require().
+
+Request handler classes declare their types and mandatory attributes
+once, and they are compiled into a schema when the class is defined, so
+the rules are not re-interpreted for every request.  Mandatory names
+that are not in types are an error in the class definition, so they
+raise an exception immediately.
+"""
+    __slots__ = ('types', 'mandatory', 'mandatory_set')
+
+    def __init__(self, types, mandatory=()):
+        self.types = dict(types)
+        self.mandatory = tuple(mandatory)
+        self.mandatory_set = frozenset(self.mandatory)
+        for name in self.mandatory:
+            if name not in self.types:
+                raise Exception('Mandatory argument has no type: ' + name)
+
+    def validate(self, args, mh):
+        """Check and condition the args dict in place
+    validate(args, mh)
+
+Messages are logged in the mh PMGIMessageHandler.  Returns True if an
+error occurs and False otherwise.
+"""
+        types = self.types
+        for name, value in args.items():
+            # Is this a recognized argument?
+            cast = types.get(name)
+            if cast is None:
+                mh.error(f'Unrecognized argument: {name}')
+                return True
+            try:
+                args[name] = cast(value)  # Cast to type
+            except:
+                mh.error(f'Invalid argument: {name}={value}')
+                return True
+        # Are there missing arguments?
+        if not self.mandatory_set.issubset(args):
+            mh.error('Missing mandatory arguments: ', newline=False)
+            prefix = ''
+            for name in self.mandatory:
+                if name not in args:
+                    mh.message(name, prefix=prefix, newline=False)
+                    prefix = ', '
+            # Force a newline
+            mh.message('')
+            return True
+        return False
+
+
+# ### Response compression
+# Responses of at least COMPRESS_MIN_SIZE bytes are compressed with the
+# best encoding the client accepts (brotli if it is installed, then
+# gzip).  Identical bodies are common (the info, substance, and default
+# isoline responses), so compressed bodies up to COMPRESS_CACHE_SIZE
+# bytes are kept for the last COMPRESS_CACHE responses.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = frozenset(
+    ['application/json', BINARY_RESPONSE, 'text/html', 'text/plain',
+     'image/svg+xml'])
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+COMPRESS_CACHE = 64
+COMPRESS_CACHE_SIZE = 1 << 20
+
+# Responses with these types are given an ETag (see tag_response)
+ETAG_MIMETYPES = frozenset(['application/json', BINARY_RESPONSE,
+                            'image/svg+xml', 'image/png'])
+
+_compress_lock = threading.Lock()
+_compressed_bodies = OrderedDict()
+_compression_stats = {}
+
+
+def choose_encoding(accept_encodings):
+    """Choose the content encoding for a response
+    encoding = choose_encoding(request.accept_encodings)
+
+Returns 'br', 'gzip', or None.  Brotli is preferred when the client
+rates it at least as highly as gzip.
+"""
+    best = None
+    quality = 0
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings[encoding] > quality:
+            best = encoding
+            quality = accept_encodings[encoding]
+    return best
+
+
+def compress_body(body, encoding):
+    """Compress a response body, using the cache if possible
+    data, hit = compress_body(body, encoding)
+
+hit is True if the compressed body was found in the cache.
+"""
+    key = None
+    if len(body) <= COMPRESS_CACHE_SIZE:
+        key = (hashlib.sha1(body).digest(), encoding)
+        with _compress_lock:
+            data = _compressed_bodies.get(key)
+            if data is not None:
+                _compressed_bodies.move_to_end(key)
+                return data, True
+
+    if encoding == 'br':
+        data = brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    else:
+        data = gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+    if key is not None:
+        with _compress_lock:
+            _compressed_bodies[key] = data
+            while len(_compressed_bodies) > COMPRESS_CACHE:
+                _compressed_bodies.popitem(last=False)
+    return data, False
+
+
+def record_compression(route, size, sent, encoding, hit):
+    """Add a response to the compression statistics for its route"""
+    with _compress_lock:
+        stats = _compression_stats.get(route)
+        if stats is None:
+            stats = _compression_stats[route] = {
+                'responses': 0, 'compressed': 0, 'cache_hits': 0,
+                'bytes': 0, 'bytes_sent': 0}
+        stats['responses'] += 1
+        stats['bytes'] += size
+        stats['bytes_sent'] += sent
+        if encoding:
+            stats['compressed'] += 1
+            stats[encoding] = stats.get(encoding, 0) + 1
+        if hit:
+            stats['cache_hits'] += 1
+
+
+def compression_report():
+    """Return a dict of the compression statistics by route
+
+Each route reports the number of responses, how many were compressed
+(and with which encoding), how many compressed bodies came from the
+cache, and the bytes before and after compression.
+"""
+    with _compress_lock:
+        report = {}
+        for route, stats in _compression_stats.items():
+            report[route] = dict(stats)
+            report[route]['bytes_saved'] = stats['bytes'] - stats['bytes_sent']
+        return report
+
+
+# ### Profiling
+# Requests can be profiled as they are served, so that slow ones can be
+# studied after the fact.  PMGI_PROFILE selects the profiler, and
+# profiling is off if it is not set.
+#   'sample'    A background thread samples the stack of every request in
+#               progress every PROFILE_INTERVAL seconds.  This is cheap
+#               enough to leave on in production.
+#   'cprofile'  Requests are run under cProfile, one at a time; requests
+#               that arrive while another is being profiled are not.
+#               Every call is recorded, but Python code runs up to twice
+#               as slowly.
+# A profile is kept if its request took at least PMGI_PROFILE_SLOW
+# seconds, or otherwise with probability PMGI_PROFILE_RATE.  It is saved
+# with the request to PMGI_PROFILE_DIR, where only the newest
+# PMGI_PROFILE_KEEP are kept.  See the /profiles route.
+PROFILE_MODE = os.environ.get('PMGI_PROFILE', '').lower() or None
+if PROFILE_MODE in ('0', 'off', 'false'):
+    PROFILE_MODE = None
+elif PROFILE_MODE not in (None, 'sample', 'cprofile'):
+    raise Exception('PMGI_PROFILE must be sample or cprofile: ' + PROFILE_MODE)
+PROFILE_SLOW = float(os.environ.get('PMGI_PROFILE_SLOW', 1.))
+PROFILE_RATE = float(os.environ.get('PMGI_PROFILE_RATE', 0.))
+PROFILE_DIR = os.environ.get(
+    'PMGI_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'pmgi-profiles'))
+PROFILE_KEEP = int(os.environ.get('PMGI_PROFILE_KEEP', 50))
+PROFILE_INTERVAL = 0.005
+# Request bodies are saved up to this many bytes
+PROFILE_BODY_LIMIT = 1 << 16
+# The number of functions listed in a profile's summary
+PROFILE_TOP = 40
+# Endpoints that are never profiled (or traced, see start_memory)
+PROFILE_SKIP = frozenset(['static', 'render_static', 'render_dist',
+                          'profiles'])
+
+_profile_lock = threading.Lock()
+_profile_count = 0
+# Only one cProfile profiler may run at a time
+_cprofile_lock = threading.Lock()
+
+
+class StackSampler:
+    """Sample the stacks of the threads serving profiled requests
+    sampler = StackSampler(interval)
+    sampler.start(ident)
+    ...
+    stacks = sampler.stop(ident)
+
+A single daemon thread wakes up every interval seconds and records the
+stack of each thread that has been started, as a collapsed stack: the
+functions from the outermost call in, separated by semicolons, as read by
+flame graph tools.  stop() returns the dict of sample counts by stack.
+"""
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stacks = {}
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._stacks[ident] = {}
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='pmgi-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._stacks.pop(ident, {})
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._stacks:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._stacks.items():
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    names = []
+                    while frame is not None:
+                        code = frame.f_code
+                        names.append(f'{code.co_name} '
+                                     f'({os.path.basename(code.co_filename)}'
+                                     f':{code.co_firstlineno})')
+                        frame = frame.f_back
+                    stack = ';'.join(reversed(names))
+                    stacks[stack] = stacks.get(stack, 0) + 1
+                del frames
+
+
+_sampler = StackSampler(PROFILE_INTERVAL)
+
+
+def canonical_request():
+    """Describe the current request so that it can be replayed
+    described = canonical_request()
+
+JSON bodies are parsed, so that they are saved with their keys sorted.
+Other bodies are saved as text, or base64 if they are not UTF-8, and are
+cut off after PROFILE_BODY_LIMIT bytes.
+"""
+    described = {
+        'method': request.method,
+        'path': request.path,
+        'query': request.args.to_dict(flat=False),
+        'content_type': request.content_type,
+        'route': request.url_rule.rule if request.url_rule else None}
+    if request.form:
+        described['form'] = request.form.to_dict(flat=False)
+    body = request.get_data(cache=True)
+    if not body:
+        return described
+    if request.is_json:
+        with contextlib.suppress(ValueError):
+            described['json'] = json.loads(body)
+            return described
+    described['truncated'] = len(body) > PROFILE_BODY_LIMIT
+    body = body[:PROFILE_BODY_LIMIT]
+    try:
+        described['body'] = body.decode('utf-8')
+    except UnicodeDecodeError:
+        described['body_base64'] = base64.b64encode(body).decode('ascii')
+    return described
+
+
+def summarize_stacks(stacks):
+    """Summarize the samples from a StackSampler
+    summary = summarize_stacks(stacks)
+
+Returns the number of samples and the functions that were sampled most
+often, as the innermost function (self) and anywhere in the stack
+(total), with the collapsed stacks themselves.
+"""
+    own = {}
+    total = {}
+    for stack, count in stacks.items():
+        names = stack.split(';')
+        own[names[-1]] = own.get(names[-1], 0) + count
+        for name in set(names):
+            total[name] = total.get(name, 0) + count
+    top = sorted(total, key=lambda name: (-own.get(name, 0), -total[name]))
+    return {
+        'interval': PROFILE_INTERVAL,
+        'samples': sum(stacks.values()),
+        'functions': [{'function': name, 'self': own.get(name, 0),
+                       'total': total[name]} for name in top[:PROFILE_TOP]],
+        'stacks': dict(sorted(stacks.items(), key=lambda item: -item[1]))}
+
+
+def summarize_cprofile(profile):
+    """Summarize a cProfile.Profile by the cumulative time of its functions
+    summary = summarize_cprofile(profile)
+"""
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: -item[1][3])
+    return {'functions': [
+        {'function': f'{name} ({os.path.basename(filename)}:{line})',
+         'calls': nc, 'primitive_calls': cc, 'tottime': tt, 'cumtime': ct}
+        for (filename, line, name), (cc, nc, tt, ct, _) in rows[:PROFILE_TOP]]}
+
+
+def save_profile(record, profile=None):
+    """Save a captured profile to PROFILE_DIR
+    name = save_profile(record)
+    name = save_profile(record, profile)
+
+record is a dict that can be written as JSON, and is saved as name.json.
+If profile is a cProfile.Profile, it is also saved as name.prof, which
+can be read by pstats or snakeviz.  The oldest profiles are deleted, so
+that only PROFILE_KEEP are kept.
+"""
+    global _profile_count
+    with _profile_lock:
+        _profile_count += 1
+        name = '%s-%d-%d' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                             _profile_count)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, name)
+        with open(path + '.json', 'w') as ff:
+            json.dump(record, ff, indent=1, sort_keys=True, default=str)
+        if profile is not None:
+            profile.dump_stats(path + '.prof')
+
+        # Other workers may share the directory, so go by the files
+        saved = sorted(list_profile_files(), key=lambda item: item[1])
+        for stem, _ in saved[:max(len(saved) - PROFILE_KEEP, 0)]:
+            for ext in ('.json', '.prof'):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(PROFILE_DIR, stem + ext))
+    return name
+
+
+def list_profile_files():
+    """Return a list of (name, mtime) for the profiles in PROFILE_DIR"""
+    found = []
+    with contextlib.suppress(OSError):
+        for entry in os.scandir(PROFILE_DIR):
+            if entry.name.endswith('.json'):
+                with contextlib.suppress(OSError):
+                    found.append((entry.name[:-5], entry.stat().st_mtime))
+    return found
+
+
+def list_profiles():
+    """Return a list describing the saved profiles, newest first
+
+Each entry has the name, time, reason, duration, status, method and path
+of the profile's request, and the files that can be downloaded.
+"""
+    listed = []
+    for name, _ in sorted(list_profile_files(), key=lambda item: -item[1]):
+        path = os.path.join(PROFILE_DIR, name)
+        try:
+            with open(path + '.json') as ff:
+                record = json.load(ff)
+        except (OSError, ValueError):
+            continue
+        files = [name + '.json']
+        if os.path.isfile(path + '.prof'):
+            files.append(name + '.prof')
+        listed.append({
+            'name': name, 'time': record.get('time'),
+            'reason': record.get('reason'),
+            'duration': record.get('duration'),
+            'status': record.get('status'),
+            'mode': record.get('mode'),
+            'method': record['request'].get('method'),
+            'path': record['request'].get('path'),
+            'files': files})
+    return listed
+
+
+# ### Saturation models
+# Saturation properties are served from per-substance interpolants unless
+# PMGI_EXACT_SATURATION is set.  Models are kept for up to
+# SATURATION_CACHE combinations of substance and units, and are refined
+# until their error is below SATURATION_TOL.
+SATURATION_EXACT = os.environ.get('PMGI_EXACT_SATURATION', '') not in \
+    ('', '0')
+SATURATION_TOL = 1e-6
+SATURATION_CACHE = 32
+
+_saturation_lock = threading.Lock()
+_saturation_models = OrderedDict()
+
+
+class SaturationModel:
+    """Interpolants for the saturation properties of a multi-phase substance
+
+    model = SaturationModel(subst, tol=1e-6)
+
+The saturated liquid and vapor states are sampled once between the
+triple point and (very nearly) the critical point, and monotone cubic
+interpolants (see pchip_slopes()) are built from them.  The samples are
+spaced evenly in
+    u = ((Tc - T) / (Tc - Tt))**(1/3)
+which makes the density nearly linear close to the critical point.
+Saturation temperature is interpolated against log(p).
+
+The sampling is doubled until the error at the midpoints between the
+nodes, scaled by the range of each property, is below tol (or until
+nmax nodes).  The errors that were verified are kept in the errors
+dict, keyed by property ('ps' and 'Ts' for the saturation pressure and
+temperature).
+
+Like PYroMat itself, the model is built in the units that are active at
+the time.  The values returned are in those units.  See
+get_saturation_model().
+
+Methods are
+    covers_T(T), covers_p(p)    Test whether all values are in range
+    ps(T), Ts(p)                Saturation pressure or temperature
+    states(T)                   The liquid and vapor state dicts
+"""
+    def __init__(self, subst, tol=SATURATION_TOL, n=65, nmax=16385):
+        t0 = time.perf_counter()
+        self.Tc, self.pc, self.dc = subst.critical(density=True)
+        self.Tt, self.pt = subst.triple()
+        self.dT = self.Tc - self.Tt
+        # Stay clear of the critical point itself, where ds() fails
+        u_lo = 0.01
+        self.Tmax = self.Tc - self.dT * u_lo ** 3
+
+        u = np.linspace(u_lo, 1., n)
+        y = self._sample(subst, u)
+        while True:
+            um = 0.5 * (u[1:] + u[:-1])
+            ym = self._sample(subst, um)
+            self.errors = self._build_and_check(u, y, um, ym)
+            # cp, cv, and gam diverge at the critical point, so they are
+            # reported but they do not drive the refinement.
+            err = max(value for prop, value in self.errors.items()
+                      if prop not in ('cp', 'cv', 'gam'))
+            if err < tol or u.size >= nmax:
+                break
+            # Add the midpoints to the nodes
+            u2 = np.empty(2 * u.size - 1)
+            u2[0::2] = u
+            u2[1::2] = um
+            y2 = np.empty((u2.size, y.shape[1]))
+            y2[0::2] = y
+            y2[1::2] = ym
+            u, y = u2, y2
+
+        self.n = u.size
+        self.pmin = float(np.exp(self._logp.min()))
+        self.pmax = float(np.exp(self._logp.max()))
+        # The critical point state is expensive, so keep it too
+        self.critical = subst.state(p=self.pc, d=self.dc)
+        self.build_time = time.perf_counter() - t0
+
+    def _temperature(self, u):
+        # Guard against rounding below the triple point
+        return np.maximum(self.Tc - self.dT * u ** 3, self.Tt)
+
+    def _sample(self, subst, u):
+        T = self._temperature(u)
+        dsL, dsV = subst.ds(T=T)
+        liquid = subst.state(T=T, d=dsL)
+        vapor = subst.state(T=T, d=dsV)
+        # Throw away the liquid pressure - it is not numerically correct.
+        liquid['p'] = vapor['p']
+        self.props = list(liquid.keys())
+        # The last column is the saturation pressure, which is not quite
+        # the same as the vapor state's pressure.
+        return np.column_stack(
+            [liquid[prop] for prop in self.props]
+            + [vapor[prop] for prop in self.props]
+            + [subst.ps(T=T)])
+
+    def _build_and_check(self, u, y, um, ym):
+        self._u = u
+        self._y = y
+        self._m = pchip_slopes(u, y)
+        # Ts(log p) needs increasing log(p), which is decreasing u
+        self._T = self._temperature(u[::-1])
+        self._logp = np.log(y[::-1, -1])
+        self._mT = pchip_slopes(self._logp, self._T)
+
+        # Errors at the midpoints, scaled by the range of each property
+        scale = np.ptp(y, axis=0)
+        scale[scale == 0] = 1.
+        err = np.abs(pchip_eval(u, y, self._m, um) - ym) / scale
+        nprop = len(self.props)
+        errors = {}
+        for index, prop in enumerate(self.props):
+            errors[prop] = float(max(err[:, index].max(),
+                                     err[:, nprop + index].max()))
+        errors['ps'] = float(err[:, -1].max())
+        Ts = pchip_eval(self._logp, self._T, self._mT, np.log(ym[:, -1]))
+        errors['Ts'] = float(np.abs(Ts - self._temperature(um)).max()
+                             / self.dT)
+        return errors
+
+    def covers_T(self, T):
+        T = np.asarray(T)
+        return bool(np.all((T >= self.Tt) & (T <= self.Tmax)))
+
+    def covers_p(self, p):
+        p = np.asarray(p)
+        return bool(np.all((p >= self.pmin) & (p <= self.pmax)))
+
+    def states(self, T, props=None):
+        """Return the saturated liquid and vapor state dicts at T
+    liquid, vapor = states(T)
+    liquid, vapor = states(T, props=['h', 's'])
+
+If props is given, only those properties are interpolated.
+"""
+        if props is None:
+            props = self.props
+        nprop = len(self.props)
+        cols = [self.props.index(prop) for prop in props]
+        cols += [nprop + col for col in cols]
+        u = ((self.Tc - np.asarray(T, dtype=float)) / self.dT) ** (1. / 3)
+        y = pchip_eval(self._u, self._y[:, cols], self._m[:, cols], u)
+        liquid = {prop: y[..., index] for index, prop in enumerate(props)}
+        vapor = {prop: y[..., len(props) + index]
+                 for index, prop in enumerate(props)}
+        return liquid, vapor
+
+    def ps(self, T):
+        """Return the saturation pressure at T"""
+        u = ((self.Tc - np.asarray(T, dtype=float)) / self.dT) ** (1. / 3)
+        return pchip_eval(self._u, self._y[:, -1], self._m[:, -1], u)
+
+    def Ts(self, p):
+        """Return the saturation temperature at p"""
+        return pchip_eval(self._logp, self._T, self._mT,
+                          np.log(np.asarray(p, dtype=float)))
+
+
+def get_saturation_model(subst):
+    """Return the cached SaturationModel for a substance, building it if needed
+    model = get_saturation_model(subst)
+
+Models are cached by substance id and the active PYroMat units.  Returns
+None if the substance is not multi-phase, if exact saturation properties
+have been configured (PMGI_EXACT_SATURATION), or if the model could not
+be built.
+"""
+    if SATURATION_EXACT or not ismultiphase(subst):
+        return None
+    key = (subst.data['id'],) + tuple(
+        pm.config[param] for param in pm.config if param.startswith('unit_'))
+    with _saturation_lock:
+        model = _saturation_models.get(key)
+        if model is not None:
+            _saturation_models.move_to_end(key)
+            return model
+
+    try:
+        model = SaturationModel(subst)
+    except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+        return None
+
+    with _saturation_lock:
+        _saturation_models[key] = model
+        while len(_saturation_models) > SATURATION_CACHE:
+            _saturation_models.popitem(last=False)
+    return model
+
+
+def saturation_T(subst, p):
+    """Saturation temperature from the cached model if possible, else exact"""
+    model = get_saturation_model(subst)
+    if model is not None and model.covers_p(p):
+        return model.Ts(p)
+    return subst.Ts(p=p)
+
+
+def saturation_p(subst, T):
+    """Saturation pressure from the cached model if possible, else exact"""
+    model = get_saturation_model(subst)
+    if model is not None and model.covers_T(T):
+        return model.ps(T)
+    return subst.ps(T=T)
+
+
+def quality_state(subst, **kwargs):
+    """A drop-in replacement for subst.state() with a two-phase fast path
+    :param subst: a pyromat substance object
+    :param kwargs: The property arguments to subst.state()
+    :return: A dict of state properties, as returned by subst.state()
+
+When the state is given by quality and one of T or p, the saturated
+liquid and vapor properties are taken from the cached SaturationModel
+and mixed by the lever rule, exactly as PYroMat does:  e, h, s, f, and g
+are weighted by quality, the density is taken from the weighted specific
+volume, the pressure is the vapor pressure, and cp, cv, and gam are inf,
+nan, and inf.  Points outside of the model's range, and all other
+combinations of arguments, are passed to subst.state().
+"""
+    if len(kwargs) != 2 or 'x' not in kwargs or \
+            not ('T' in kwargs or 'p' in kwargs):
+        return subst.state(**kwargs)
+    model = get_saturation_model(subst)
+    if model is None:
+        return subst.state(**kwargs)
+
+    prop = 'T' if 'T' in kwargs else 'p'
+    x, y = np.broadcast_arrays(np.asarray(kwargs['x'], dtype=float),
+                               np.asarray(kwargs[prop], dtype=float))
+    x = np.atleast_1d(x).copy()
+    y = np.atleast_1d(y).copy()
+    if prop == 'T':
+        I = (y >= model.Tt) & (y <= model.Tmax)
+    else:
+        I = (y >= model.pmin) & (y <= model.pmax)
+    I &= (x >= 0.) & (x <= 1.)
+    if not I.any():
+        return subst.state(**kwargs)
+
+    xI = x[I]
+    T = y[I] if prop == 'T' else model.Ts(y[I])
+    liquid, vapor = model.states(T, ['p', 'd', 'e', 'h', 's', 'f', 'g'])
+    fast = {
+        'p': vapor['p'],
+        'T': T,
+        'd': 1. / ((1. - xI) / liquid['d'] + xI / vapor['d']),
+        'x': xI}
+    for name in ['e', 'h', 's']:
+        fast[name] = liquid[name] * (1. - xI) + vapor[name] * xI
+    fast['cp'] = np.full_like(xI, np.inf)
+    fast['cv'] = np.full_like(xI, np.nan)
+    for name in ['f', 'g']:
+        fast[name] = liquid[name] * (1. - xI) + vapor[name] * xI
+    fast['gam'] = np.full_like(xI, np.inf)
+    fast['v'] = 1. / fast['d']
+    if I.all():
+        return fast
+
+    # Assemble the fast points with the exact evaluation of the rest
+    rest = subst.state(**{'x': x[~I], prop: y[~I]})
+    out = {}
+    for name in rest:
+        out[name] = np.empty_like(x)
+        out[name][I] = fast[name]
+        out[name][~I] = rest[name]
+    return out
+
+
+# ### Ideal gas tables
+# The ideal gas classes are piecewise polynomials in temperature.  For the
+# /compare route, the coefficients of every substance in a class are
+# stacked into arrays once, so that a property can be evaluated for all of
+# them at once instead of one substance at a time.  The tables are built
+# in PYroMat's internal units (K, Pa, kJ/kmol), and values are converted
+# to the active units when they are evaluated.
+IDEAL_GAS_CLASSES = ('ig', 'ig2')
+# The properties that IdealGasTable.evaluate() computes
+IDEAL_GAS_PROPS = ('cp', 'cv', 'gam', 'h', 'e', 's', 'd', 'v')
+
+_ideal_gas_tables = {}
+
+
+class IdealGasTable:
+    """The stacked coefficients of all substances of an ideal gas class
+
+    table = IdealGasTable(cls)
+
+cls is 'ig' (Shomate equations) or 'ig2' (NASA 7-coefficient
+polynomials).  The table holds, for the N substances of the class,
+    ids     the list of substance ids
+    mw      (N,) molecular weights
+    pref    (N,) reference pressures in Pa
+    Tlim    (N, R+1) temperature limits in K, NaN past a substance's last
+    C       (N, R, 7) coefficients of each temperature range
+where R is the largest number of temperature ranges of any substance.
+See get_ideal_gas_table().
+
+Methods are
+    index(ids)                  The rows of the named substances
+    evaluate(rows, props, T, p) The properties of the substances at T, p
+"""
+    def __init__(self, cls):
+        if cls not in IDEAL_GAS_CLASSES:
+            raise ValueError('Not an ideal gas class: ' + str(cls))
+        self.cls = cls
+        substs = [subst for idstr, subst in sorted(pm.dat.data.items())
+                  if subst.pmclass() == cls]
+        self.ids = [subst.data['id'] for subst in substs]
+        self.rows = {idstr: row for row, idstr in enumerate(self.ids)}
+        nranges = max([len(subst.data['C']) for subst in substs], default=1)
+        self.mw = np.array([subst.data['mw'] for subst in substs])
+        if cls == 'ig2':
+            self.pref = np.array([subst.data['pref'] for subst in substs])
+        else:
+            self.pref = np.array([subst._pref_pa for subst in substs])
+        self.Tlim = np.full((len(substs), nranges + 1), np.nan)
+        self.C = np.zeros((len(substs), nranges, 7))
+        for row, subst in enumerate(substs):
+            Tlim = subst.data['Tlim']
+            self.Tlim[row, :len(Tlim)] = Tlim
+            for rr, C in enumerate(subst.data['C']):
+                self.C[row, rr] = C[:7]
+
+    def index(self, ids):
+        """Return an array of the rows of the substances with the given ids"""
+        return np.array([self.rows[idstr] for idstr in ids], dtype=int)
+
+    def _molar(self, rows, T):
+        """Evaluate cp, h, and s at the reference pressure
+    cp, h, s0, valid = _molar(rows, T)
+
+rows is an index array of the substances, and T is a 1D array of
+temperatures in K.  Returns (len(rows), len(T)) arrays in kJ/kmol/K and
+kJ/kmol.  Temperatures outside a substance's limits are def_oob, and
+are False in valid.
+"""
+        T = T[np.newaxis, :]
+        Tlim = self.Tlim[rows]
+        shape = (len(rows), T.shape[1])
+        cp = np.full(shape, pm.config['def_oob'], dtype=float)
+        h = np.full(shape, pm.config['def_oob'], dtype=float)
+        s0 = np.full(shape, pm.config['def_oob'], dtype=float)
+        valid = np.zeros(shape, dtype=bool)
+        # Like _crange(), each range includes its lower limit, and the
+        # last range also includes its upper limit
+        last = np.sum(np.isfinite(Tlim), axis=1) - 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for rr in range(self.C.shape[1]):
+                lo = Tlim[:, rr, np.newaxis]
+                hi = Tlim[:, rr + 1, np.newaxis]
+                inside = (T >= lo) & ((T < hi) | ((T == hi) &
+                                                  (last == rr)[:, np.newaxis]))
+                if not inside.any():
+                    continue
+                C = [self.C[rows, rr, k, np.newaxis] for k in range(7)]
+                if self.cls == 'ig2':
+                    Ru = pm.units.const_Ru
+                    cp_r = Ru * (C[0] + T*(C[1] + T*(C[2] + T*(
+                        C[3] + T*C[4]))))
+                    h_r = Ru * (C[5] + T*(C[0] + T*(C[1]/2. + T*(
+                        C[2]/3. + T*(C[3]/4. + T*C[4]/5.)))))
+                    s_r = Ru * (C[6] + C[0]*np.log(T) + T*(C[1] + T*(
+                        C[2]/2. + T*(C[3]/3. + T*C[4]/4.))))
+                else:
+                    t = T / 1000.
+                    cp_r = C[0] + t*(C[1] + t*(C[2] + t*C[3])) + C[4]/(t*t)
+                    h_r = 1000. * (C[5] + t*(C[0] + t*(C[1]/2. + t*(
+                        C[2]/3. + t*C[3]/4.))) - C[4]/t)
+                    s_r = C[6] + C[0]*np.log(t) + t*(C[1] + t*(
+                        C[2]/2. + t*C[3]/3.)) - C[4]/(2*t*t)
+                cp = np.where(inside, cp_r, cp)
+                h = np.where(inside, h_r, h)
+                s0 = np.where(inside, s_r, s0)
+                valid |= inside
+        return cp, h, s0, valid
+
+    def evaluate(self, rows, props, T, p):
+        """Evaluate properties of several substances at the same states
+    values = evaluate(rows, props, T, p)
+
+rows is an index array of the substances (see index()), props is a list
+of names from IDEAL_GAS_PROPS, and T and p are 1D arrays of the same
+length in the active units.  Returns a dict of (len(rows), len(T))
+arrays, in the active units, with a row for each substance.
+"""
+        TK = pm.units.temperature_scale(np.array(T, dtype=float),
+                                        to_units='K')
+        pPa = pm.units.pressure(np.array(p, dtype=float), to_units='Pa')
+        cp, h, s0, valid = self._molar(rows, TK)
+        # Like PYroMat, every property is def_oob out of bounds
+        TK = np.where(valid, TK, pm.config['def_oob'])
+        Ru = pm.units.const_Ru
+        mw = self.mw[rows, np.newaxis]
+        # Conversions from kJ/kmol and kJ/kmol/K, and from kmol/m3
+        energy = pm.units.matter(pm.units.energy(1., from_units='kJ'), mw,
+                                 from_units='kmol', exponent=-1)
+        entropy = pm.units.temperature(energy, from_units='K', exponent=-1)
+        density = pm.units.volume(
+            pm.units.matter(1., mw, from_units='kmol'),
+            from_units='m3', exponent=-1)
+
+        out = {}
+        for prop in props:
+            if prop == 'cp':
+                out[prop] = cp * entropy
+            elif prop == 'cv':
+                out[prop] = (cp - Ru) * entropy
+            elif prop == 'gam':
+                out[prop] = cp / (cp - Ru)
+            elif prop == 'h':
+                out[prop] = h * energy
+            elif prop == 'e':
+                out[prop] = (h - Ru * TK) * energy
+            elif prop == 's':
+                out[prop] = (s0 - Ru * np.log(
+                    pPa / self.pref[rows, np.newaxis])) * entropy
+            elif prop == 'd':
+                out[prop] = pPa / (1000. * Ru * TK) * density
+            elif prop == 'v':
+                out[prop] = 1. / (pPa / (1000. * Ru * TK) * density)
+            else:
+                raise ValueError('Unsupported ideal gas property: ' + prop)
+        return out
+
+
+def get_ideal_gas_table(cls):
+    """Return the IdealGasTable for an ideal gas class, building it if needed
+    table = get_ideal_gas_table(cls)
+
+Returns None if cls is not one of IDEAL_GAS_CLASSES.
+"""
+    if cls not in IDEAL_GAS_CLASSES:
+        return None
+    table = _ideal_gas_tables.get(cls)
+    if table is None:
+        table = _ideal_gas_tables[cls] = IdealGasTable(cls)
+    return table
+
+
+def state_mask(subst, **kwargs):
+    """Test which states are in the domain of a substance model
+    valid = state_mask(subst, **kwargs)
+
+kwargs are the property arguments of subst.state().  They are broadcast
+together, and a boolean array of the same shape is returned, which is
+False for the states that are certainly out of bounds.  Only the
+arguments that can be checked without evaluating the model are tested:
+    T       within subst.Tlim()
+    p       positive, and no more than subst.plim() (multi-phase)
+    d, v    positive
+    x       between 0 and 1, and, for multi-phase substances, T and p
+            (if given) between the triple and critical points
+Other arguments (e.g. h or s) pass, and the model may still fail at
+states that do.  Values that are NaN or inf are never valid.
+"""
+    known = {name: np.asarray(value, dtype=float)
+             for name, value in kwargs.items()}
+    values = np.broadcast_arrays(*known.values())
+    valid = np.ones(values[0].shape if values else (), dtype=bool)
+    for value in values:
+        valid &= np.isfinite(value)
+
+    multiphase = ismultiphase(subst)
+    Tmin, Tmax = np.asarray(subst.Tlim(), dtype=float).flatten()
+    if 'T' in known:
+        valid &= (known['T'] >= Tmin) & (known['T'] <= Tmax)
+    if 'p' in known:
+        valid &= known['p'] > 0.
+        if multiphase:
+            valid &= known['p'] <= subst.plim()[1]
+    for name in ('d', 'v'):
+        if name in known:
+            valid &= known[name] > 0.
+    if 'x' in known:
+        valid &= (known['x'] >= 0.) & (known['x'] <= 1.)
+        if multiphase:
+            Tc, pc = subst.critical()
+            Tt, pt = subst.triple()
+            if 'T' in known:
+                valid &= (known['T'] >= Tt) & (known['T'] <= Tc)
+            if 'p' in known:
+                valid &= (known['p'] >= pt) & (known['p'] <= pc)
+    return valid
+
+
+def select_state(subst, props=None, **kwargs):
+    """Evaluate only the requested properties of a state or states
+    :param subst: a pyromat substance object
+    :param props: A list of property names, or None for all of them
+    :param kwargs: The property arguments to subst.state()
+    :return: A dict of the requested properties, in the order of props
+
+The state is solved once for its native pair of properties (T and d for
+multi-phase substances, T and p for the ideal gases), and each of the
+requested properties is evaluated from that pair by its own method.
+Properties that were given as arguments are returned as they are.
+
+When neither member of the native pair was given (e.g. p and s for a
+multi-phase substance), one solve can't produce both of them, so the
+full state is computed (see quality_state()) and the requested
+properties are picked from it.
+
+Like subst.state(), cp, cv, and gam are inf, nan, and inf for
+multi-phase substances under the dome.  Properties that the substance
+does not have (see state_props()) raise a PMParamError.
+"""
+    if props is not None:
+        unsupported = [prop for prop in props
+                       if prop not in state_props(subst)]
+        if unsupported:
+            raise pm.utility.PMParamError(
+                'Properties not supported by this substance model: '
+                + ', '.join(unsupported))
+    if props is None or len(kwargs) != 2:
+        states = quality_state(subst, **kwargs)
+        if props is None:
+            return states
+        return {prop: states[prop] for prop in props}
+
+    multiphase = ismultiphase(subst)
+    pair = ('T', 'd') if multiphase else ('T', 'p')
+    known = {}
+    for name, value in kwargs.items():
+        known[name] = np.asarray(value, dtype=float)
+    if 'd' not in known and 'v' in known:
+        known['d'] = 1. / known['v']
+    missing = [name for name in pair if name not in known]
+    if len(missing) > 1 or (multiphase and 'x' in kwargs):
+        # Quality states are cheaper by the lever rule
+        states = quality_state(subst, **kwargs)
+        return {prop: states[prop] for prop in props}
+    for name in missing:
+        known[name] = getattr(subst, name)(**kwargs)
+
+    values = np.broadcast_arrays(*[np.atleast_1d(known[name])
+                                   for name in pair])
+    native = dict(zip(pair, values))
+    shape = values[0].shape
+    for name in known:
+        known[name] = np.array(np.broadcast_to(known[name], shape))
+
+    # Points under the dome
+    dome = None
+    if multiphase and ('cp' in props or 'cv' in props or 'gam' in props):
+        if 'x' not in known:
+            known['x'] = subst.x(**native)
+        dome = known['x'] >= 0.
+
+    out = {}
+    for prop in props:
+        if prop in known:
+            out[prop] = known[prop]
+        elif prop == 'v':
+            d = native['d'] if 'd' in native else subst.d(**native)
+            out[prop] = 1. / d
+        elif dome is not None and prop in ('cp', 'cv', 'gam'):
+            out[prop] = np.full(shape, np.nan if prop == 'cv' else np.inf)
+            if not dome.all():
+                single = {name: value[~dome] for name, value in native.items()}
+                out[prop][~dome] = getattr(subst, prop)(**single)
+        else:
+            out[prop] = getattr(subst, prop)(**native)
+        known.setdefault(prop, out[prop])
+    return out
+
+
 ###
 # Custom request processing classes
 #   These are designed to construct a JSON dictionary that will be used
@@ -582,6 +3173,9 @@ The PMGIRequest and its children have four important attributes:
     mh      a PMGIMessageHandler instance for the request
     units   a dictionary containing units settings
     args    a dictionary containing the request's parameters
+Handlers that evaluate arrays of states may also set valid, a boolean
+array of the states that were evaluated (see state_mask()), which is
+returned with the data.
 
 A request handling process should follow these steps:
 (1) Init
@@ -657,46 +3251,64 @@ process_units()
     failure and False on success.
 """
 
+    # The scheduler lane used by requests of this class
+    lane = 'interactive'
+    # The argument rules for requests of this class.  See require().
+    types = {}
+    mandatory = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Compile each handler's argument rules when it is defined
+        cls.schema = PMGISchema(cls.types, cls.mandatory)
+
     def __init__(self, request):
         # Initialize the four parts of the output
         self.mh = PMGIMessageHandler()
         self.units = {}
         self.data = {}
+        # The HTTP status code and the estimated cost of the request
+        self.status = 200
+        self.cost = 0.
+        self.valid = None
         # Read in the request data to an args dict
-        if request.method == 'POST':
+        if request.method == 'POST' and request.mimetype in BINARY_MIMETYPES:
+            # Binary bodies carry only the arrays.  Everything else
+            # comes from the query string, GET style.
+            self.args = dict(request.args)
+            try:
+                self.args.update(read_binary_arrays(
+                    request.get_data(), request.mimetype,
+                    self.args.pop('columns', None)))
+            except ValueError as e:
+                self.mh.error('Failed to read the binary request body.')
+                self.mh.message(str(e))
+        elif request.method == 'POST':
             self.args = dict(request.json)
         elif request.method == 'GET':
             self.args = dict(request.args)
         else:
             self.args = {}
 
-        # Build legal unit dict
-        self.valid_units = {
-            'temperature': list(pm.units.temperature.get()),
-            'energy': list(pm.units.energy.get()),
-            'molar': list(pm.units.molar.get()),
-            'mass': list(pm.units.mass.get()),
-            'matter': list(pm.units.mass.get()) + list(pm.units.molar.get()),
-            'volume': list(pm.units.volume.get()),
-            'pressure': list(pm.units.pressure.get()),
-            'force': list(pm.units.force.get()),
-            'length': list(pm.units.length.get()),
-            'time': list(pm.units.time.get())
-        }
-        # The short units map abbreviated unit strings intended for the
-        # GET interface
-        self.short_units = {
-            'uT': 'temperature',
-            'uE': 'energy',
-            'uMol': 'molar',
-            'uMas': 'mass',
-            'uM': 'matter',
-            'uV': 'volume',
-            'uP': 'pressure',
-            'uF': 'force',
-            'uL': 'length',
-            'uTim': 'time'
-        }
+        # The output precision is stripped from the args too.  It applies
+        # to every request type.  See output().
+        self.precision = None
+        if 'precision' in self.args:
+            precision = self.args.pop('precision')
+            try:
+                self.precision = int(precision)
+            except (TypeError, ValueError):
+                self.mh.error('The precision argument was not an integer: '
+                              + str(precision))
+            else:
+                if not 1 <= self.precision <= 17:
+                    self.mh.error('The precision must be between 1 and 17 '
+                                  'significant digits.')
+
+        # The legal unit dict and the short unit names are shared by all
+        # requests.  See get_valid_units() and SHORT_UNITS.
+        self.valid_units = get_valid_units()
+        self.short_units = SHORT_UNITS
 
         # Process any units specifiers - strip them from the args
         # dict as they are discovered.
@@ -725,16 +3337,17 @@ process_units()
         for unit, value in self.units.items():
             # Next, retrieve the legal values. If none are found, this
             # is not a valid unit specifier string.
-            legal_values = self.valid_units.get(unit)
+            legal_values = _valid_unit_sets.get(unit)
             if legal_values is None:
                 self.mh.error('Unit not recognized: ' + str(unit))
             # Is the assigned unit legal?
-            elif value not in self.valid_units[unit]:
+            elif not isinstance(value, str) or value not in legal_values:
                 self.mh.error('Unit (' + str(
                     unit) + ') was set to unrecognized value: ' + str(value))
 
-    def require(self, types, mandatory):
+    def require(self, types=None, mandatory=None):
         """REQUIRE - enforce rules about the request arguments
+    require()
     require(types, mandatory)
 
 The require() method is intended to be called in each child request
@@ -758,36 +3371,135 @@ types or functions instead of existing types.
 Once defined in TYPES, an argument can be made mandatory by including
 its name in the MANDATORY list.
 
+Child classes should declare types and mandatory as class attributes
+and call require() with no arguments.  The class attributes are
+compiled into a PMGISchema (the schema attribute) once, when the class
+is defined.  If types and mandatory are passed explicitly, they are
+compiled on the fly instead.
+
 Returns True if an error occurs and False otherwise.  Messages are
 logged appropriately in the mh attribute.
 """
-        # Make a copy of the mandatory set.  We'll be keeping track!
-        mandatory = set(mandatory)
-        # Loop through the items
-        for name, value in self.args.items():
-            # Is this a recognized argument?
-            if name not in types:
-                self.mh.error(f'Unrecognized argument: {name}')
-                return True
-            # If the argument is known
-            try:
-                self.args[name] = types[name](value)  # Cast to type
-            except:
-                self.mh.error(f'Invalid argument: {name}={value}')
-                return True
-            # If the argument is mandatory, check it off the list
-            if name in mandatory:
-                mandatory.remove(name)
-        # Are there missing arguments?
-        if mandatory:
-            self.mh.error('Missing mandatory arguments: ', newline=False)
-            prefix = ''
-            for name in mandatory:
-                self.mh.message(name, prefix=prefix, newline=False)
-                prefix = ', '
-            # Force a newline
-            self.mh.message('')
+        if types is None:
+            schema = self.schema
+        else:
+            schema = PMGISchema(types, mandatory or ())
+        if schema.validate(self.args, self.mh):
             return True
+        return self.admit()
+
+    def estimate_cost(self):
+        """Estimate the cost of processing the request
+    cost = estimate_cost()
+
+This is a prototype that charges only the fixed COST_OVERHEAD.  Child
+classes that do significant work should override it using the checked
+arguments in the args attribute.  See POINT_COST.
+"""
+        return COST_OVERHEAD
+
+    def estimate_memory(self):
+        """Estimate the peak memory needed by the request in bytes
+    memory = estimate_memory()
+
+This is a prototype that returns 0.  Child classes that return arrays
+should override it with the number of values they will return times
+MEMORY_VALUE_BYTES.
+"""
+        return 0.
+
+    def refuse_memory(self, memory):
+        """Log the error for a request that would use too much memory
+    refuse_memory(memory)
+"""
+        self.status = 413
+        self.mh.error(f'The request is too large: it would need about '
+                      f'{memory / 2**20:.3g} MB of memory, which exceeds '
+                      f'the limit ({MEMORY_LIMIT / 2**20:.3g} MB).  Please '
+                      f'split it into smaller requests.')
+        if request.url_rule is not None:
+            record_memory(request.url_rule.rule, refused=True)
+
+    def check_memory(self, encoding='json'):
+        """Refuse a processed request whose response would use too much memory
+    refused = check_memory(encoding='json')
+
+The memory needed to encode the data (see MEMORY_ENCODE_BYTES) is added
+to what the request has allocated so far, if it is being traced, and
+compared with MEMORY_LIMIT.  If it is over, the data are discarded, an
+error is logged in mh, and the status attribute is set to 413.
+
+Returns True if the request was refused and False otherwise.
+"""
+        if not MEMORY_LIMIT or self.mh:
+            return False
+        memory = count_values(self.data) * MEMORY_ENCODE_BYTES[encoding]
+        allocated = request_memory()
+        if allocated is not None:
+            memory += allocated
+        if memory <= MEMORY_LIMIT:
+            return False
+        self.data = {}
+        self.refuse_memory(memory)
+        return True
+
+    def classify(self):
+        """Return the name of the scheduler lane for this request
+    lane = classify()
+
+The lane is the class's lane attribute, unless the estimated cost is
+over LANE_BULK_COST, in which case it is 'bulk'.
+"""
+        if self.cost > LANE_BULK_COST:
+            return 'bulk'
+        return self.lane
+
+    def admit(self):
+        """Admission control - refuse requests that cost too much
+    admit()
+
+This is called automatically by require() once the arguments have been
+checked.  The request's cost is estimated by estimate_cost() and is
+compared against COST_REQUEST_LIMIT and against the budget remaining in
+this worker, COST_WORKER_LIMIT.  If the request is refused, an error is
+logged in mh and the status attribute is set to 413 or 429.
+
+An admitted request's cost is added to the worker's total until the
+request is torn down.
+
+Returns True if the request was refused and False otherwise.
+"""
+        global _worker_cost
+        try:
+            self.cost = float(self.estimate_cost())
+        except Exception:
+            self.mh.error('Failed to estimate the cost of the request.')
+            self.mh.message(repr(sys.exc_info()[1]))
+            return True
+
+        if self.cost > COST_REQUEST_LIMIT:
+            self.status = 413
+            self.mh.error(f'The request is too large: its estimated cost '
+                          f'({self.cost:.3g}) exceeds the limit '
+                          f'({COST_REQUEST_LIMIT:.3g}).  Please split it '
+                          f'into smaller requests.')
+            return True
+
+        try:
+            self.memory = float(self.estimate_memory())
+        except Exception:
+            self.memory = 0.
+        if MEMORY_LIMIT and self.memory > MEMORY_LIMIT:
+            self.refuse_memory(self.memory)
+            return True
+
+        with _worker_lock:
+            if _worker_cost + self.cost > COST_WORKER_LIMIT:
+                self.status = 429
+                self.mh.error('The server is busy.  Please try again later.')
+                return True
+            _worker_cost += self.cost
+        flask.g.pmgi_cost = flask.g.get('pmgi_cost', 0.) + self.cost
         return False
 
     def process_units(self):
@@ -845,6 +3557,24 @@ The idstr is the ID string used by get().
             self.mh.message(repr(sys.exc_info()[1]))
         return substance
 
+    def check_props(self, subst, props):
+        """Check a property selection against the substance model
+    err = check_props(subst, props)
+
+Returns True and logs an error if any of props (a list from toprops, or
+None for all of them) is not returned by the substance model.
+"""
+        if props is None:
+            return False
+        supported = state_props(subst)
+        unsupported = [prop for prop in props if prop not in supported]
+        if unsupported:
+            self.mh.error('Properties not supported by this substance '
+                          'model: ' + ', '.join(unsupported) + '.  Use: '
+                          + ', '.join(supported))
+            return True
+        return False
+
     def process(self):
         """This is a prototype for a request process method.
     pr.process()
@@ -863,13 +3593,69 @@ The process method is responsible for populating the data attribute.
 
     def output(self):
         """Generate the serializable output of the process request.
+
+If the request set a precision, the data are rounded to that many
+significant digits first.  See round_significant().
 """
-        return {
-            'data': json_friendly(self.data),
+        out = {
+            'data': json_friendly(round_significant(self.data,
+                                                    self.precision)),
             'message': self.mh.tojson(),
             'units': self.units,
             'args': json_friendly(self.args)
         }
+        if self.valid is not None:
+            out['valid'] = json_friendly(self.valid)
+        return out
+
+    def output_binary(self):
+        """Generate the binary form of the output of the process request.
+    body = output_binary()
+
+The body has the same content as output(), but the numpy arrays are not
+converted to text.  It is laid out as
+    4 bytes     little-endian uint32 length, L, of the header
+    L bytes     UTF-8 JSON header, padded with spaces to a multiple of 8
+    remainder   little-endian float64 array data
+The header is the output() dict, except that arrays are replaced by
+references to their offset (from the start of the array data) and
+shape.  See pack_arrays().  NaN and inf are left as they are.
+"""
+        buffers = []
+        out = {
+            'data': round_significant(self.data, self.precision),
+            'message': self.mh.tojson(),
+            'units': self.units,
+            'args': self.args}
+        if self.valid is not None:
+            # Sent as 1. and 0.
+            out['valid'] = self.valid
+        header, offset = pack_arrays(out, buffers)
+        header = flask.json.dumps(header).encode('utf-8')
+        # Pad so the array data are aligned for zero-copy reads
+        header += b' ' * (-(len(header) + 4) % 8)
+        return b''.join([np.uint32(len(header)).astype('<u4').tobytes(),
+                         header] + [bb.tobytes() for bb in buffers])
+
+    def respond(self):
+        """Generate the HTTP response for the request
+    return rh.respond()
+
+If the client lists BINARY_RESPONSE in its Accept header, the response
+body is output_binary().  Otherwise, it is the JSON form of output().
+Either way, the request is refused if encoding it would exceed the
+memory limit.  See check_memory().
+"""
+        if request.accept_mimetypes[BINARY_RESPONSE] > \
+                request.accept_mimetypes['application/json'] \
+                and not self.check_memory('binary'):
+            return flask.Response(self.output_binary(), status=self.status,
+                                  mimetype=BINARY_RESPONSE)
+        self.check_memory('json')
+        return self.output(), self.status
+
+
+PMGIRequest.schema = PMGISchema(PMGIRequest.types, PMGIRequest.mandatory)
 
 
 class SubstanceRequest(PMGIRequest):
@@ -878,11 +3664,12 @@ class SubstanceRequest(PMGIRequest):
     inprops = ['e', 'h', 's', 'T', 'p', 'd', 'v', 'x']
     outprops = inprops + ['cp', 'cv', 'gam']
 
+    types = {'id': str}
+    mandatory = ('id',)
+
     def __init__(self, args):
         PMGIRequest.__init__(self, args)
-        self.require(types={
-            'id': str},
-            mandatory=['id'])
+        self.require()
 
     def process(self):
         # If there was an error, abort the processing
@@ -931,23 +3718,45 @@ class SubstanceRequest(PMGIRequest):
 class PropertyRequest(PMGIRequest):
     """
     This class will handle requests for properties at a fixed state or states.
+
+    The props argument (e.g. props='T,s') limits the properties that are
+    computed and returned.  See select_state().
+
+    States that are out of bounds (see state_mask()) are not evaluated.
+    Their properties are NaN, and the valid member of the response is
+    False for them.  The request only fails if every state is out of
+    bounds.
     """
 
+    types = {
+        's': toarray,
+        'h': toarray,
+        'e': toarray,
+        'T': toarray,
+        'p': toarray,
+        'd': toarray,
+        'v': toarray,
+        'x': toarray,
+        'props': toprops,
+        'id': str}
+    mandatory = ('id',)
+
     def __init__(self, args):
         # Clean initialization
         PMGIRequest.__init__(self, args)
         # Process the arguments
-        self.require(types={
-            's': toarray,
-            'h': toarray,
-            'e': toarray,
-            'T': toarray,
-            'p': toarray,
-            'd': toarray,
-            'v': toarray,
-            'x': toarray,
-            'id': str},
-            mandatory=['id'])
+        self.require()
+
+    def estimate_cost(self):
+        props = [name for name in self.args if name not in ('id', 'props')]
+        n = max([np.size(self.args[name]) for name in props], default=1)
+        return COST_OVERHEAD + n * point_cost(self.args.get('id'), props)
+
+    def estimate_memory(self):
+        n = max([np.size(self.args[name]) for name in self.args
+                 if name not in ('id', 'props')], default=1)
+        nprops = len(self.args.get('props') or SubstanceRequest.outprops)
+        return n * nprops * MEMORY_VALUE_BYTES
 
     def process(self):
         """Process the request
@@ -965,9 +3774,30 @@ class PropertyRequest(PMGIRequest):
         subst = self.get_substance(args.pop('id'))
         if subst is None:
             return True
+        props = args.pop('props', None)
+        if self.check_props(subst, props):
+            return True
+
+        self.valid = state_mask(subst, **args)
+        if not self.valid.any():
+            self.mh.error('Failed to generate parameter set.')
+            self.mh.message('All of the states are out of bounds for this '
+                            'substance model.')
+            return True
 
         try:
-            self.data = subst.state(**args)
+            if self.valid.all():
+                self.data = select_state(subst, props, **args)
+            else:
+                # Only evaluate the valid states
+                shape = self.valid.shape
+                states = select_state(subst, props, **{
+                    name: np.broadcast_to(value, shape)[self.valid]
+                    for name, value in args.items()})
+                self.data = {}
+                for prop, value in states.items():
+                    self.data[prop] = np.full(shape, np.nan)
+                    self.data[prop][self.valid] = value
         except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
             self.mh.error('Failed to generate parameter set.')
             self.mh.message(repr(sys.exc_info()[1]))
@@ -979,24 +3809,55 @@ class PropertyRequest(PMGIRequest):
 class IsolineRequest(PMGIRequest):
     """
     This class will handle requests for an isoline
+
+    The props argument (e.g. props='T,s') limits the properties that are
+    computed and returned.  See select_state().
+
+    The deadline argument (seconds) shortens the time the request may
+    take to compute a family of lines.  See the Request deadlines section.
     """
+    lane = 'plot'
+
+    types = {
+        's': toarray,
+        'h': toarray,
+        'e': toarray,
+        'T': toarray,
+        'p': toarray,
+        'd': toarray,
+        'v': toarray,
+        'x': toarray,
+        'default': str,
+        'props': toprops,
+        'deadline': float,
+        'id': str}
+    mandatory = ('id',)
 
     def __init__(self, args):
+        # The deadline counts from when the request arrived
+        self.t0 = time.perf_counter()
         # Clean initialization
         PMGIRequest.__init__(self, args)
-
-        self.require(types={
-            's': toarray,
-            'h': toarray,
-            'e': toarray,
-            'T': toarray,
-            'p': toarray,
-            'd': toarray,
-            'v': toarray,
-            'x': toarray,
-            'default': str,
-            'id': str},
-            mandatory=['id'])
+        self.require()
+
+    # The properties that are paired with each constant property on an
+    # isoline by compute_iso_line()
+    line_pairs = {'p': 'T', 'd': 'T', 'v': 'T', 's': 'T', 'x': 'T',
+                  'h': 'd', 'e': 'd', 'T': 'p'}
+
+    def estimate_cost(self):
+        props = [name for name in self.args
+                 if name not in ('id', 'default', 'props', 'deadline')]
+        if len(props) != 1:
+            return COST_OVERHEAD
+        prop = props[0]
+        if 'default' in self.args:
+            nlines = 10
+        else:
+            nlines = np.size(self.args[prop])
+        pair = [prop, self.line_pairs.get(prop, 'T')]
+        return COST_OVERHEAD + \
+            nlines * 50 * point_cost(self.args.get('id'), pair)
 
     def process(self):
         """Process the request
@@ -1013,31 +3874,142 @@ class IsolineRequest(PMGIRequest):
         subst = self.get_substance(args.pop('id'))
         if subst is None:
             return True
+        props = args.pop('props', None)
+        if self.check_props(subst, props):
+            return True
+        # Lines are only split into chunks for a deadline set by the client
+        limit = args.pop('deadline', None)
+        deadline = get_deadline(self.t0, limit)
 
         try:
-            self.data = compute_iso_line(subst, n=50, **args)
+            prop, vals = get_iso_values(subst, **args)
+            if 'default' in args or len(vals) > 1:
+                # A family is computed line by line, so the lines that were
+                # finished by the deadline can still be returned
+                self.data = []
+                count = 0
+                for index, val, line in iter_iso_lines(
+                        subst, prop, vals, n=50, props=props,
+                        deadline=deadline, chunked=limit is not None):
+                    count = index + 1
+                    if line is not None:
+                        self.data.append(line)
+                self.warn_late(prop, vals[count:])
+            else:
+                if limit is None:
+                    deadline = None
+                self.data = compute_iso_line(subst, n=50, props=props,
+                                             deadline=deadline, **args)
         except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
             self.mh.error('Failed to generate isoline.')
             self.mh.message(repr(sys.exc_info()[1]))
             return True
+        except PMGIDeadlineError:
+            self.mh.error('The isoline was not finished before the deadline '
+                          'of the request.')
+            return True
+        return False
+
+    def warn_late(self, prop, vals):
+        """Warn that the lines at vals were skipped at the deadline"""
+        if len(vals):
+            self.mh.warn('The request reached its deadline. Skipped the '
+                         f'isolines at {prop} = ' +
+                         ', '.join('%g' % val for val in vals))
+
+    def stream(self):
+        """Process the request as a stream of Server-Sent Events
+    for event in isr.stream(): ...
+
+This is an alternative to process() and output() that yields each line
+of the isoline family as a text/event-stream message as soon as it has
+been computed.  Each line is sent as a 'line' event,
+    {'index': i, 'value': val, 'data': {...}}
+where index is the position of the line in the family and value is the
+constant property value.  Lines that fail are not sent.  The stream is
+always terminated by a single 'summary' event, which has the same form
+as output(), but the data member reports the property, the number of
+lines sent, the values that were skipped, and the values that were not
+computed before the deadline (late).
+"""
+        if not self.mh:
+            args = self.args.copy()
+            subst = self.get_substance(args.pop('id'))
+            props = args.pop('props', None)
+            limit = args.pop('deadline', None)
+            deadline = get_deadline(self.t0, limit)
+            if subst is not None and not self.check_props(subst, props):
+                try:
+                    prop, vals = get_iso_values(subst, **args)
+                    skipped = []
+                    count = 0
+                    finished = 0
+                    for index, val, line in iter_iso_lines(
+                            subst, prop, vals, n=50, props=props,
+                            deadline=deadline, chunked=limit is not None):
+                        finished = index + 1
+                        if line is None:
+                            skipped.append(float(val))
+                            continue
+                        count += 1
+                        yield sse_event('line', {
+                            'index': index,
+                            'value': float(val),
+                            'data': round_significant(line,
+                                                      self.precision)})
+                    late = [float(val) for val in vals[finished:]]
+                    self.data = {'prop': prop, 'count': count,
+                                 'skipped': skipped, 'late': late}
+                    if skipped:
+                        self.mh.warn('Skipped isolines that were out of '
+                                     'bounds for this substance model.')
+                    self.warn_late(prop, late)
+                except (pm.utility.PMParamError,
+                        pm.utility.PMAnalysisError) as e:
+                    self.mh.error('Failed to generate isoline.')
+                    self.mh.message(repr(e))
+        else:
+            self.mh.message('Processing aborted due to error.')
+
+        yield sse_event('summary', self.output())
 
 
 class SaturationRequest(PMGIRequest):
     """
     This class will handle requests for saturation properties.
+
+    Values are interpolated from the substance's cached SaturationModel
+    when they are in its range.  Set exact=true to evaluate PYroMat
+    directly.  The props argument (e.g. props='T,s') limits the properties
+    that are returned.
     """
+    lane = 'plot'
+
+    types = {
+        'T': toarray,
+        'p': toarray,
+        'exact': tobool,
+        'props': toprops,
+        'id': str}
+    mandatory = ('id',)
 
     def __init__(self, request):
         # Clean initialization
         PMGIRequest.__init__(self, request)
         # Process the arguments
-        self.require(
-            types={
-                'T': toarray,
-                'p': toarray,
-                'id': str
-            },
-            mandatory=['id'])
+        self.require()
+
+    def estimate_cost(self):
+        idstr = self.args.get('id')
+        if 'T' in self.args:
+            n = np.size(self.args['T'])
+        elif 'p' in self.args:
+            n = np.size(self.args['p'])
+        else:
+            n = 32
+        # The saturation solve, then two states at known T and d
+        return COST_OVERHEAD + n * (point_cost(idstr, ['T', 'x'])
+                                    + 2 * point_cost(idstr, ['T', 'd']))
 
     def process(self):
         """Process the request
@@ -1055,6 +4027,8 @@ class SaturationRequest(PMGIRequest):
         # Everything that's left will be arguments to the state method
         args = self.args.copy()
         subst = self.get_substance(args.pop('id'))
+        exact = args.pop('exact', False)
+        props = args.pop('props', None)
         # get_substance() handles error logging for us - we only need to
         # return True if it fails.
         if subst is None:
@@ -1065,6 +4039,7 @@ class SaturationRequest(PMGIRequest):
                 'Substance was not in the multi-phase collection: ' + repr(
                     subst))
             return True
+        model = None if exact else get_saturation_model(subst)
 
         ## This segment of code is strictly responsible for generating
         # an array of temperature values to use
@@ -1087,7 +4062,10 @@ class SaturationRequest(PMGIRequest):
         # If p is specified, we'll need to calculate T
         elif 'p' in args:
             try:
-                Ts = subst.Ts(p=args['p'])
+                if model is not None and model.covers_p(args['p']):
+                    Ts = model.Ts(args['p'])
+                else:
+                    Ts = subst.Ts(p=args['p'])
             except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
                 self.mh.error(
                     'Failed to obtain temperature at the pressure(s) provided.')
@@ -1101,11 +4079,17 @@ class SaturationRequest(PMGIRequest):
 
         # OK, we've got Ts - go calculate the state
         try:
-            dsL, dsV = subst.ds(T=Ts)
-            self.data['liquid'] = subst.state(T=Ts, d=dsL)
-            self.data['vapor'] = subst.state(T=Ts, d=dsV)
-            # Throw away the liquid pressure - it is not numerically correct.
-            self.data['liquid']['p'] = self.data['vapor']['p']
+            if model is not None and model.covers_T(Ts):
+                self.data['liquid'], self.data['vapor'] = \
+                    model.states(Ts, props)
+            else:
+                dsL, dsV = subst.ds(T=Ts)
+                self.data['liquid'] = select_state(subst, props, T=Ts, d=dsL)
+                self.data['vapor'] = select_state(subst, props, T=Ts, d=dsV)
+                # Throw away the liquid pressure - it is not numerically
+                # correct.
+                if 'p' in self.data['vapor']:
+                    self.data['liquid']['p'] = self.data['vapor']['p']
         except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
             self.mh.error(
                 'Failed to evaluate saturation properties at the state(s) provided.')
@@ -1114,8 +4098,11 @@ class SaturationRequest(PMGIRequest):
 
         # If the request was for the steam dome, append the critical point
         if len(args) == 0:
-            crit_state = subst.state(p=pc, d=dc)
-            for prop in crit_state:
+            if model is not None:
+                crit_state = model.critical
+            else:
+                crit_state = subst.state(p=pc, d=dc)
+            for prop in self.data['liquid']:
                 self.data['liquid'][prop] = \
                     np.append(self.data['liquid'][prop], crit_state[prop])
                 self.data['vapor'][prop] = \
@@ -1131,18 +4118,610 @@ class SaturationRequest(PMGIRequest):
         return False
 
 
+class GridRequest(PMGIRequest):
+    """
+    This class will handle requests for properties on a 2D grid of states.
+
+    The grid is defined by two independent axes.  The x and y arguments
+    name the properties on each axis (e.g. x='T', y='p').  Each axis is
+    given either by explicit values (xvals, yvals) or by a range of the
+    form start,stop,n (xrange, yrange) that is spaced according to
+    xscale/yscale ('linear' or 'log').
+
+    Each property is returned as a 2D array with one row per y value and
+    one column per x value.  Cells that are out of bounds for the
+    substance (see state_mask()) are not evaluated; they are NaN and are
+    False in the 'valid' array of the response, as for /state.  The props
+    argument (e.g. props='h,s') limits the properties that are evaluated.
+    """
+    lane = 'plot'
+    types = {
+        'x': str,
+        'y': str,
+        'xvals': toarray,
+        'yvals': toarray,
+        'xrange': toarray,
+        'yrange': toarray,
+        'xscale': str,
+        'yscale': str,
+        'props': toprops,
+        'id': str}
+    mandatory = ('id', 'x', 'y')
+
+    # The properties that may be used as axes
+    axisprops = ['T', 'p', 'd', 'v', 'e', 'h', 's', 'x']
+    # The largest number of states evaluated in a single state() call
+    chunk = 20000
+
+    def __init__(self, request):
+        # Clean initialization
+        PMGIRequest.__init__(self, request)
+        self.require()
+
+    def axis_size(self, axis):
+        if axis + 'vals' in self.args:
+            return np.size(self.args[axis + 'vals'])
+        elif axis + 'range' in self.args and \
+                np.size(self.args[axis + 'range']) == 3:
+            return max(int(self.args[axis + 'range'][2]), 0)
+        return 0
+
+    def estimate_cost(self):
+        n = self.axis_size('x') * self.axis_size('y')
+        props = [self.args.get('x'), self.args.get('y')]
+        return COST_OVERHEAD + n * point_cost(self.args.get('id'), props)
+
+    def estimate_memory(self):
+        n = self.axis_size('x') * self.axis_size('y')
+        # All of the properties, and valid
+        nprops = len(self.args.get('props') or SubstanceRequest.outprops) + 1
+        return n * nprops * MEMORY_VALUE_BYTES
+
+    def get_axis(self, axis):
+        """Build the values for an axis
+    values = get_axis('x')
+
+Returns None and logs an error on failure.
+"""
+        prop = self.args[axis]
+        if prop not in self.axisprops:
+            self.mh.error(f'Grid axis {axis} must be one of: '
+                          + ', '.join(self.axisprops))
+            return None
+
+        if axis + 'vals' in self.args:
+            return np.atleast_1d(self.args[axis + 'vals']).flatten()
+        elif axis + 'range' in self.args:
+            vrange = np.atleast_1d(self.args[axis + 'range'])
+            scale = self.args.get(axis + 'scale', 'linear')
+            if vrange.size != 3 or vrange[2] < 1:
+                self.mh.error(f'{axis}range must be start,stop,n')
+                return None
+            start, stop, n = vrange[0], vrange[1], int(vrange[2])
+            if scale == 'linear':
+                return np.linspace(start, stop, n)
+            elif scale == 'log':
+                if start <= 0 or stop <= 0:
+                    self.mh.error(f'{axis}range must be positive '
+                                  f'for a log scale')
+                    return None
+                return np.logspace(np.log10(start), np.log10(stop), n)
+            self.mh.error(f'{axis}scale must be linear or log')
+            return None
+
+        self.mh.error(f'Specify {axis}vals or {axis}range for the grid')
+        return None
+
+    def process(self):
+        """Process the request
+        This method is responsible for populating the "out" member dict with
+        correctly formatted data that can be returned as a JSON object.
+        """
+        # If there was an error, abort the processing
+        if self.mh:
+            self.mh.message('Processing aborted due to error.')
+            return True
+
+        subst = self.get_substance(self.args['id'])
+        if subst is None or self.check_props(subst, self.args.get('props')):
+            return True
+
+        xprop, yprop = self.args['x'], self.args['y']
+        if xprop == yprop:
+            self.mh.error('The grid axes must be different properties.')
+            return True
+        xvals = self.get_axis('x')
+        yvals = self.get_axis('y')
+        if xvals is None or yvals is None:
+            return True
+
+        # Rows are y, columns are x
+        X, Y = np.meshgrid(xvals, yvals)
+        shape = X.shape
+        X = X.ravel()
+        Y = Y.ravel()
+
+        # Mask out the cells that are outside of the substance limits
+        valid = state_mask(subst, **{xprop: X, yprop: Y})
+
+        # Evaluate the valid cells in chunks
+        index = np.nonzero(valid)[0]
+        results = {}
+        failed = 0
+        for start in range(0, index.size, self.chunk):
+            allocated = request_memory()
+            if MEMORY_LIMIT and allocated is not None \
+                    and allocated > MEMORY_LIMIT:
+                self.refuse_memory(allocated)
+                return True
+            sel = index[start:start + self.chunk]
+            try:
+                states = select_state(subst, self.args.get('props'),
+                                      **{xprop: X[sel], yprop: Y[sel]})
+            except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+                valid[sel] = False
+                failed += sel.size
+                continue
+            for prop, values in states.items():
+                if prop not in results:
+                    results[prop] = np.full(X.shape, np.nan)
+                results[prop][sel] = values
+
+        if not results:
+            self.mh.error('Failed to evaluate any states on the grid.')
+            return True
+        if failed:
+            self.mh.warn(f'Failed to evaluate {failed} states on the grid.')
+        if not valid.all():
+            self.mh.warn('Encountered states that were out of bounds '
+                         'for this substance model.')
+
+        self.data = {prop: values.reshape(shape)
+                     for prop, values in results.items()}
+        self.valid = valid.reshape(shape)
+        self.data['xvals'] = xvals
+        self.data['yvals'] = yvals
+        return False
+
+
+class CompareRequest(PMGIRequest):
+    """
+    This class will handle requests for a property of many substances at
+    the same states.
+
+    The substances are listed by id (e.g. id='ig.N2,ig.O2,ig.CO2'), or
+    selected by collection (e.g. collection='ig'), or both, in which case
+    only the listed substances in the collection are used.  T and p are
+    broadcast to a shared array of states; p defaults to the def_p
+    configuration.  The props argument (e.g. props='cp,h') selects the
+    properties, which must be among IDEAL_GAS_PROPS.
+
+    Each property is returned as a 2D array with one row per substance
+    (in the order of the id list in the data) and one column per state.
+    Ideal gases are evaluated together from their stacked coefficients
+    (see IdealGasTable); other substances are evaluated one at a time.
+    """
+    lane = 'plot'
+
+    types = {
+        'id': toids,
+        'collection': str,
+        'T': toarray,
+        'p': toarray,
+        'props': toprops,
+    }
+    mandatory = ('T',)
+
+    # The properties returned when props is not given
+    default_props = ('cp', 'h', 's')
+
+    def __init__(self, request):
+        # Clean initialization
+        PMGIRequest.__init__(self, request)
+        self.require()
+
+    def substance_ids(self):
+        """Return the list of the requested substance ids
+    ids = substance_ids()
+
+Returns None and logs an error if none were selected or if an id is not
+recognized.
+"""
+        ids = self.args.get('id')
+        collection = self.args.get('collection')
+        if ids is None and collection is None:
+            self.mh.error('Specify the substances by id or by collection.')
+            return None
+        if ids is None:
+            ids = sorted(pm.dat.data)
+        unknown = [idstr for idstr in ids if idstr not in pm.dat.data]
+        if unknown:
+            self.mh.error('Substance not found: ' + ', '.join(unknown))
+            return None
+        if collection is not None:
+            ids = [idstr for idstr in ids
+                   if pm.dat.data[idstr].collection() == collection]
+        if not ids:
+            self.mh.error('No substances matched the request.')
+            return None
+        return ids
+
+    def npoints(self):
+        try:
+            return np.broadcast(np.atleast_1d(self.args['T']),
+                                np.atleast_1d(self.args.get('p', 1.))).size
+        except ValueError:
+            return 1
+
+    def estimate_cost(self):
+        ids = self.args.get('id') or \
+            [idstr for idstr, subst in pm.dat.data.items()
+             if subst.collection() == self.args.get('collection')]
+        n = self.npoints()
+        cost = COST_OVERHEAD
+        for idstr in ids:
+            subst = pm.dat.data.get(idstr)
+            if subst is not None and subst.pmclass() in IDEAL_GAS_CLASSES:
+                # Evaluated a whole class at a time, without the Python
+                # overhead of each substance's property methods
+                cost += n * point_cost(idstr, ['T', 'p']) / 10.
+            else:
+                cost += n * point_cost(idstr, ['T', 'p'])
+        return cost
+
+    def estimate_memory(self):
+        ids = self.args.get('id') or \
+            [idstr for idstr, subst in pm.dat.data.items()
+             if subst.collection() == self.args.get('collection')]
+        nprops = len(self.args.get('props') or self.default_props)
+        return len(ids) * self.npoints() * nprops * MEMORY_VALUE_BYTES
+
+    def process(self):
+        """Process the request
+        This method is responsible for populating the "out" member dict with
+        correctly formatted data that can be returned as a JSON object.
+        """
+        # If there was an error, abort the processing
+        if self.mh:
+            self.mh.message('Processing aborted due to error.')
+            return True
+
+        props = self.args.get('props') or list(self.default_props)
+        unsupported = [prop for prop in props if prop not in IDEAL_GAS_PROPS]
+        if unsupported:
+            self.mh.error('Properties not supported for comparison: '
+                          + ', '.join(unsupported) + '.  Use: '
+                          + ', '.join(IDEAL_GAS_PROPS))
+            return True
+        ids = self.substance_ids()
+        if ids is None:
+            return True
+        try:
+            T, p = np.broadcast_arrays(
+                np.atleast_1d(self.args['T']).ravel(),
+                np.atleast_1d(self.args.get('p', pm.config['def_p'])).ravel())
+        except ValueError:
+            self.mh.error('T and p must be the same length.')
+            return True
+
+        results = {prop: np.full((len(ids), T.size), np.nan)
+                   for prop in props}
+        # Group the ideal gases by class, and evaluate each class at once
+        groups = {}
+        failed = []
+        for row, idstr in enumerate(ids):
+            cls = pm.dat.data[idstr].pmclass()
+            if cls in IDEAL_GAS_CLASSES:
+                groups.setdefault(cls, []).append(row)
+                continue
+            try:
+                # PYroMat may convert its arguments in place
+                states = select_state(pm.dat.data[idstr], props,
+                                      T=T.copy(), p=p.copy())
+            except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+                failed.append(idstr)
+                continue
+            for prop in props:
+                results[prop][row] = states[prop]
+        for cls, rows in groups.items():
+            table = get_ideal_gas_table(cls)
+            values = table.evaluate(table.index([ids[row] for row in rows]),
+                                    props, T, p)
+            for prop in props:
+                results[prop][rows] = values[prop]
+
+        if failed:
+            self.mh.warn('Failed to evaluate: ' + ', '.join(failed))
+        if any(np.isnan(values).any() for values in results.values()):
+            self.mh.warn('Encountered states that were out of bounds '
+                         'for some of the substances.')
+
+        self.data = results
+        self.data['id'] = ids
+        self.data['T'] = T
+        self.data['p'] = p
+        return False
+
+
+class TileRequest(PMGIRequest):
+    """
+    This class will handle requests for tiles of a property diagram.
+
+    The diagram is given by its axes (e.g. x='s', y='T') and their scales
+    (xscale, yscale, 'linear' or 'log').  The tile is given by its zoom
+    level (0 to TILE_LEVELS-1) and its column i and row j, counting from
+    the lower left.  Level 0 is a single tile that covers the diagram.
+    See make_tile().
+    """
+    lane = 'plot'
+
+    types = {
+        'id': str,
+        'x': str,
+        'y': str,
+        'xscale': str,
+        'yscale': str,
+        'level': int,
+        'i': int,
+        'j': int}
+    mandatory = ('id', 'x', 'y')
+
+    def __init__(self, request):
+        # Clean initialization
+        PMGIRequest.__init__(self, request)
+        self.require()
+
+    def estimate_cost(self):
+        idstr = self.args.get('id')
+        level = min(max(self.args.get('level', 0), 0), TILE_LEVELS - 1)
+        key = (idstr, level) + tuple(
+            pm.config[param] for param in pm.config
+            if param.startswith('unit_'))
+        if key in _tile_lines and (level == 0 or key[:1] + (0,) + key[2:]
+                                   in _tile_lines):
+            return COST_OVERHEAD
+        # Ten lines of each family, and the dome
+        n = TILE_POINTS * 2 ** level
+        cost = COST_OVERHEAD
+        for prop in TILE_FAMILIES:
+            pair = [prop, IsolineRequest.line_pairs.get(prop, 'T')]
+            cost += 10 * n * point_cost(idstr, pair)
+        return cost
+
+    def process(self):
+        """Process the request
+        This method is responsible for populating the "out" member dict with
+        correctly formatted data that can be returned as a JSON object.
+        """
+        # If there was an error, abort the processing
+        if self.mh:
+            self.mh.message('Processing aborted due to error.')
+            return True
+
+        subst = self.get_substance(self.args['id'])
+        if subst is None:
+            return True
+        x, y = self.args['x'], self.args['y']
+        xscale = self.args.get('xscale', 'linear')
+        yscale = self.args.get('yscale', 'linear')
+        level = self.args.get('level', 0)
+        i, j = self.args.get('i', 0), self.args.get('j', 0)
+        if x not in TILE_AXES or y not in TILE_AXES or x == y:
+            self.mh.error('The diagram axes must be two different '
+                          'properties of: ' + ', '.join(TILE_AXES))
+            return True
+        if xscale not in ('linear', 'log') or yscale not in ('linear', 'log'):
+            self.mh.error('The axis scales must be linear or log.')
+            return True
+        if not 0 <= level < TILE_LEVELS:
+            self.mh.error(f'The zoom level must be from 0 to '
+                          f'{TILE_LEVELS - 1}.')
+            return True
+        if not (0 <= i < 2 ** level and 0 <= j < 2 ** level):
+            self.mh.error(f'There are {2 ** level} tiles across each axis '
+                          f'at zoom level {level}.')
+            return True
+
+        try:
+            self.data = make_tile(subst, x, y, xscale, yscale, level, i, j)
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+            self.mh.error('Failed to generate the tile.')
+            self.mh.message(repr(sys.exc_info()[1]))
+            return True
+        self.data = dict(self.data, level=level, i=i, j=j,
+                         levels=TILE_LEVELS)
+        return False
+
+
+class DiagramRequest(PMGIRequest):
+    """
+    This class will handle requests for rendered property diagrams.
+
+    The diagram is one of DIAGRAMS ('Ts', 'ph' or 'pv'), and the image is
+    rendered in format 'svg' or 'png', width by height pixels.  See
+    render_diagram().  On success, the image attribute holds the bytes of
+    the image, which the route sends in place of the usual response.
+    """
+    lane = 'plot'
+
+    types = {
+        'id': str,
+        'diagram': str,
+        'format': str,
+        'width': int,
+        'height': int}
+    mandatory = ('id',)
+
+    def __init__(self, request):
+        # Clean initialization
+        PMGIRequest.__init__(self, request)
+        self.image = None
+        self.mimetype = None
+        self.require()
+
+    def estimate_cost(self):
+        idstr = self.args.get('id')
+        key = (idstr, 0) + tuple(
+            pm.config[param] for param in pm.config
+            if param.startswith('unit_'))
+        if key in _tile_lines:
+            return COST_OVERHEAD
+        # The level 0 lines, like a tile
+        cost = COST_OVERHEAD
+        for prop in TILE_FAMILIES:
+            pair = [prop, IsolineRequest.line_pairs.get(prop, 'T')]
+            cost += 10 * TILE_POINTS * point_cost(idstr, pair)
+        return cost
+
+    def process(self):
+        """Process the request
+        This method is responsible for populating the image attribute with
+        the rendered diagram.
+        """
+        # If there was an error, abort the processing
+        if self.mh:
+            self.mh.message('Processing aborted due to error.')
+            return True
+
+        subst = self.get_substance(self.args['id'])
+        if subst is None:
+            return True
+        diagram = self.args.get('diagram', 'Ts')
+        fmt = self.args.get('format', 'svg').lower()
+        width = self.args.get('width', 640)
+        height = self.args.get('height', 480)
+        if diagram not in DIAGRAMS:
+            self.mh.error('The diagram must be one of: ' +
+                          ', '.join(DIAGRAMS))
+            return True
+        if fmt not in DIAGRAM_MIMETYPES:
+            self.mh.error('The format must be one of: ' +
+                          ', '.join(DIAGRAM_MIMETYPES))
+            return True
+        if fmt == 'png' and cairosvg is None:
+            self.mh.error('PNG diagrams are not available on this server. '
+                          'Use format=svg.')
+            return True
+        if not (DIAGRAM_MIN_SIZE <= width <= DIAGRAM_MAX_SIZE and
+                DIAGRAM_MIN_SIZE <= height <= DIAGRAM_MAX_SIZE):
+            self.mh.error(f'The width and height must be from '
+                          f'{DIAGRAM_MIN_SIZE} to {DIAGRAM_MAX_SIZE}.')
+            return True
+
+        try:
+            self.image = get_diagram(subst, diagram, fmt, width, height)
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+            self.mh.error('Failed to generate the diagram.')
+            self.mh.message(repr(sys.exc_info()[1]))
+            return True
+        self.mimetype = DIAGRAM_MIMETYPES[fmt]
+        return False
+
+
+class CycleRequest(PMGIRequest):
+    """
+    This class will handle requests for thermodynamic cycles.
+
+    The states argument is a list of the states of the cycle, each given
+    by two properties or by a process from an earlier state.  Set close to
+    add a heat exchange from the last state back to the first.  The props
+    argument (e.g. props='T,s') limits the properties that are returned
+    for each state.  See solve_cycle().
+    """
+
+    types = {
+        'id': str,
+        'states': tocycle,
+        'close': tobool,
+        'props': toprops}
+    mandatory = ('id', 'states')
+
+    def __init__(self, request):
+        # Clean initialization
+        PMGIRequest.__init__(self, request)
+        self.require()
+
+    def count_states(self):
+        """Return the number of states in the sweep, and of the cycle"""
+        steps = self.args.get('states') or []
+        n = 1
+        for step in steps:
+            for name, value in step.items():
+                if name in CYCLE_INPUTS or name == 'efficiency':
+                    try:
+                        n = max(n, np.size(toarray(value)))
+                    except (ValueError, TypeError, KeyError):
+                        pass
+        return n, len(steps)
+
+    def estimate_cost(self):
+        n, count = self.count_states()
+        # Most states are solved from an entropy or an enthalpy
+        return COST_OVERHEAD + \
+            2 * n * count * point_cost(self.args.get('id'), ['p', 's'])
+
+    def estimate_memory(self):
+        n, count = self.count_states()
+        nprops = len(self.args.get('props') or STATE_PROPS)
+        return n * count * (nprops + 2) * MEMORY_VALUE_BYTES
+
+    def process(self):
+        """Process the request
+        This method is responsible for populating the "out" member dict with
+        correctly formatted data that can be returned as a JSON object.
+        """
+        # If there was an error, abort the processing
+        if self.mh:
+            self.mh.message('Processing aborted due to error.')
+            return True
+
+        subst = self.get_substance(self.args['id'])
+        if subst is None:
+            return True
+        props = self.args.get('props')
+
+        try:
+            self.data = solve_cycle(subst, self.args['states'],
+                                    self.args.get('close', False))
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+            self.mh.error('Failed to solve the cycle.')
+            self.mh.message(repr(sys.exc_info()[1]))
+            return True
+        if props:
+            # Ideal gas states have no quality or free energies
+            supported = [prop for prop in STATE_PROPS
+                         if all(prop in state
+                                for state in self.data['states'])]
+            unsupported = [prop for prop in props if prop not in supported]
+            if unsupported:
+                self.data = {}
+                self.mh.error('Properties not supported by this substance '
+                              'model: ' + ', '.join(unsupported) + '.  Use: '
+                              + ', '.join(supported))
+                return True
+            self.data['states'] = [{prop: state[prop] for prop in props}
+                                   for state in self.data['states']]
+        return False
+
+
 class InfoRequest(PMGIRequest):
     """
 This class will handle generic info requests about pyromat data
 """
 
+    types = {
+        'substances': tobool,
+        'legalunits': tobool,
+        'versions': tobool,
+        'startup': tobool,
+        'lanes': tobool,
+        'compression': tobool,
+        'memory': tobool,
+        'conversions': tobool}
+
     def __init__(self, args):
         PMGIRequest.__init__(self, args)
-
-        self.require(types={
-            'substances': tobool,
-            'legalunits': tobool,
-            'versions': tobool}, mandatory=[])
+        self.require()
 
     def process(self):
         """Process the request
@@ -1174,6 +4753,13 @@ correctly formatted data that can be returned as a JSON object.
             units_dict = self.valid_units.copy()
         self.data['legalunits'] = units_dict
 
+        # Should we obtain the unit conversion factors?
+        conversions_flag = self.args.get('conversions')
+        conversions_dict = {}
+        if conversions_flag is None or conversions_flag:
+            conversions_dict = get_unit_conversions()
+        self.data['conversions'] = conversions_dict
+
         # Should we obtain the version information?
         version_flag = self.args.get('versions')
         version_dict = {}
@@ -1187,12 +4773,60 @@ correctly formatted data that can be returned as a JSON object.
             }
         self.data['versions'] = version_dict
 
+        # Should we obtain the startup report for this worker?
+        startup_flag = self.args.get('startup')
+        startup_dict = {}
+        if startup_flag is None or startup_flag:
+            startup_dict = startup_report.copy()
+            # Report the worker that is answering, not the one that
+            # imported the module; they differ after a fork.
+            startup_dict['pid'] = os.getpid()
+            startup_dict['forked'] = \
+                startup_dict['pid'] != startup_report['pid']
+            startup_dict['rss'] = get_rss()
+        self.data['startup'] = startup_dict
+
+        # Should we obtain the scheduler lane statistics?
+        lanes_flag = self.args.get('lanes')
+        lanes_dict = {}
+        if lanes_flag is None or lanes_flag:
+            lanes_dict = scheduler.report()
+        self.data['lanes'] = lanes_dict
+
+        # Should we obtain the response compression statistics?
+        compression_flag = self.args.get('compression')
+        compression_dict = {}
+        if compression_flag is None or compression_flag:
+            compression_dict = compression_report()
+        self.data['compression'] = compression_dict
+
+        # Should we obtain the memory statistics?
+        memory_flag = self.args.get('memory')
+        memory_dict = {}
+        if memory_flag is None or memory_flag:
+            memory_dict = memory_report()
+        self.data['memory'] = memory_dict
+
 
 ############################
 # Define the URL interface #
 ############################
 app = Flask(__name__, static_folder="live")
 
+# Record how long it took to get here, and run the preload if requested.
+# The report is available from the /info route.
+startup_report = {
+    'mode': STARTUP_MODE,
+    'pid': os.getpid(),
+    'import_s': time.perf_counter() - _startup_t0,
+    'preload_s': None,
+}
+if STARTUP_MODE == 'preload':
+    startup_report['preload_s'] = preload()
+
+scheduler = PMGIScheduler(LANES, slots=SCHEDULER_SLOTS,
+                          max_wait=SCHEDULER_MAX_WAIT)
+
 PREFIX = ""
 if app.debug:
     PREFIX = "/api"
@@ -1216,34 +4850,55 @@ if app.debug:
 # /isoline
 #   Return property information while holding a single property constant
 #
+# /isoline/stream
+#   Same as /isoline, but each line is streamed as a Server-Sent Event
+#
+# /grid
+#   Return property information on a 2D grid of states
+#
+# /tiles
+#   Return the isolines of a property diagram in tiles, by zoom level
+#
+# /compare
+#   Return properties of many substances at the same states
+#
+# /diagram
+#   Return a property diagram rendered as an SVG or PNG image
+#
+# /cycle
+#   Return the states, heat and work of a thermodynamic cycle
+#
 # /info
 #   Return meta information about the active installation of PYroMat
 
 @app.route('/subst', methods=['POST', 'GET'])
 def substance():
     sr = SubstanceRequest(request)
-    sr.process_units()
-    sr.process()
-    return sr.output(), 200
+    with scheduler.slot(sr):
+        sr.process_units()
+        sr.process()
+    return sr.output(), sr.status
 
 
 # The root pmgi accepts property requests.
 @app.route(f'{PREFIX}/state', methods=['POST', 'GET'])
 def state():
     pr = PropertyRequest(request)
-    pr.process_units()
-    pr.process()
+    with scheduler.slot(pr):
+        pr.process_units()
+        pr.process()
 
-    return pr.output(), 200
+    return pr.respond()
 
 
 # The saturation route computes saturation points or the steam dome
 @app.route(f'{PREFIX}/saturation', methods=['POST', 'GET'])
 def saturation():
     sr = SaturationRequest(request)
-    sr.process_units()
-    sr.process()
-    return sr.output(), 200
+    with scheduler.slot(sr):
+        sr.process_units()
+        sr.process()
+    return sr.respond()
 
 
 # The isoline route computes isolines
@@ -1251,18 +4906,301 @@ def saturation():
 def isoline():
     # Read in the request data to an args dict
     isr = IsolineRequest(request)
+    with scheduler.slot(isr):
+        isr.process_units()
+        isr.process()
+    return isr.respond()
+
+
+# The streaming isoline route sends each line as it is computed
+@app.route(f'{PREFIX}/isoline/stream', methods=['POST', 'GET'])
+def isoline_stream():
+    isr = IsolineRequest(request)
+
+    # The scheduler slot is held until the last line has been sent, so it
+    # is released when the response is closed.  Requests that are refused
+    # or have bad arguments are answered with JSON and their real status
+    # before the stream starts.
+    held = contextlib.ExitStack()
+    held.enter_context(scheduler.slot(isr))
     isr.process_units()
-    isr.process()
-    return isr.output(), 200
+    if isr.mh:
+        held.close()
+        return isr.respond()
+
+    response = flask.Response(flask.stream_with_context(isr.stream()),
+                              mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache',
+                                       'X-Accel-Buffering': 'no'})
+    response.call_on_close(held.close)
+    return response
+
+
+# The grid route computes properties on a 2D grid of states
+@app.route(f'{PREFIX}/grid', methods=['POST', 'GET'])
+def grid():
+    gr = GridRequest(request)
+    with scheduler.slot(gr):
+        gr.process_units()
+        gr.process()
+    return gr.respond()
+
+
+# The tiles route serves the isolines of a property diagram in tiles
+@app.route(f'{PREFIX}/tiles', methods=['POST', 'GET'])
+def tiles():
+    tr = TileRequest(request)
+    with scheduler.slot(tr):
+        tr.process_units()
+        tr.process()
+    response = flask.make_response(tr.respond())
+    if response.status_code == 200 and not tr.mh:
+        response.cache_control.public = True
+        response.cache_control.max_age = TILE_MAX_AGE
+    return response
+
+
+# The diagram route sends a rendered image, or the usual response if the
+# request failed
+@app.route(f'{PREFIX}/diagram', methods=['POST', 'GET'])
+def diagram():
+    dr = DiagramRequest(request)
+    with scheduler.slot(dr):
+        dr.process_units()
+        dr.process()
+    if dr.image is None:
+        return dr.respond()
+    response = flask.Response(dr.image, mimetype=dr.mimetype)
+    response.cache_control.public = True
+    response.cache_control.max_age = TILE_MAX_AGE
+    return response
+
+
+# The cycle route solves a chain of states and processes at once
+@app.route(f'{PREFIX}/cycle', methods=['POST', 'GET'])
+def cycle():
+    cr = CycleRequest(request)
+    with scheduler.slot(cr):
+        cr.process_units()
+        cr.process()
+    return cr.respond()
+
+
+# The compare route computes properties of many substances at once
+@app.route(f'{PREFIX}/compare', methods=['POST', 'GET'])
+def compare():
+    cr = CompareRequest(request)
+    with scheduler.slot(cr):
+        cr.process_units()
+        cr.process()
+    return cr.respond()
 
 
 # The info pmgi will return the results of queries (e.g. substance search)
 @app.route(f'{PREFIX}/info', methods=['POST', 'GET'])
 def info():
     ir = InfoRequest(request)
-    ir.process_units()
-    ir.process()
-    return ir.output(), 200
+    with scheduler.slot(ir):
+        ir.process_units()
+        ir.process()
+    return ir.output(), ir.status
+
+
+# Compress responses the client can accept compressed
+@app.after_request
+def compress_response(response):
+    # Static files and streams are passed through as they are
+    if request.url_rule is None or response.direct_passthrough \
+            or response.is_streamed \
+            or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = None
+    hit = False
+    if len(body) >= COMPRESS_MIN_SIZE:
+        encoding = choose_encoding(request.accept_encodings)
+    if encoding:
+        data, hit = compress_body(body, encoding)
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+    record_compression(request.url_rule.rule, len(body),
+                       response.content_length, encoding, hit)
+    return response
+
+
+# Tag PMGI responses with an ETag, and answer 304 Not Modified when the
+# client already has the body.  The results only depend on the request
+# and the installed versions, so the client may revalidate a cached copy
+# of any request (see pyromat_ajax.js), including a POST.  The tag is
+# weak because it is taken before compression.  This hook is registered
+# after compress_response, so Flask runs it first.
+@app.after_request
+def tag_response(response):
+    if request.url_rule is None or response.direct_passthrough \
+            or response.is_streamed or response.status_code != 200 \
+            or response.mimetype not in ETAG_MIMETYPES:
+        return response
+    etag = hashlib.sha1(response.get_data()).hexdigest()
+    response.set_etag(etag, weak=True)
+    if request.if_none_match.contains_weak(etag):
+        response.status_code = 304
+        response.set_data(b'')
+    return response
+
+
+# Start profiling requests, if PMGI_PROFILE is set
+@app.before_request
+def start_profile():
+    if PROFILE_MODE is None or request.url_rule is None \
+            or request.endpoint in PROFILE_SKIP:
+        return
+    capture = {'t0': time.perf_counter(), 'status': None}
+    if PROFILE_MODE == 'cprofile':
+        if not _cprofile_lock.acquire(blocking=False):
+            return
+        capture['profile'] = cProfile.Profile()
+        capture['profile'].enable()
+    else:
+        _sampler.start(threading.get_ident())
+    flask.g.pmgi_profile = capture
+
+
+# Note the status for the profile
+@app.after_request
+def note_profile_status(response):
+    capture = flask.g.get('pmgi_profile')
+    if capture is not None:
+        capture['status'] = response.status_code
+    return response
+
+
+# Stop profiling when the request is done (after the last line of a
+# stream has been sent), and keep the profile if it was slow or sampled
+@app.teardown_request
+def finish_profile(exc=None):
+    capture = flask.g.pop('pmgi_profile', None)
+    if capture is None:
+        return
+    duration = time.perf_counter() - capture['t0']
+    profile = capture.get('profile')
+    if profile is not None:
+        profile.disable()
+        _cprofile_lock.release()
+    else:
+        stacks = _sampler.stop(threading.get_ident())
+
+    if duration >= PROFILE_SLOW:
+        reason = 'slow'
+    elif random.random() < PROFILE_RATE:
+        reason = 'sampled'
+    else:
+        return
+    record = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'pid': os.getpid(),
+        'mode': PROFILE_MODE,
+        'reason': reason,
+        'duration': duration,
+        'status': capture['status'],
+        'error': repr(exc) if exc is not None else None,
+        'request': canonical_request()}
+    if profile is not None:
+        record['profile'] = summarize_cprofile(profile)
+    else:
+        record['profile'] = summarize_stacks(stacks)
+    try:
+        save_profile(record, profile)
+    except OSError as err:
+        app.logger.warning('Could not save a profile: %r', err)
+
+
+# Trace the memory of a sample of the requests
+@app.before_request
+def start_memory():
+    if MEMORY_SAMPLE <= 0 or request.url_rule is None \
+            or request.endpoint in PROFILE_SKIP:
+        return
+    if random.random() < MEMORY_SAMPLE:
+        flask.g.pmgi_memory = start_memory_trace()
+
+
+# Record the peak memory of traced requests (after the last line of a
+# stream has been sent)
+@app.teardown_request
+def finish_memory(exc=None):
+    trace = flask.g.pop('pmgi_memory', None)
+    if trace is not None:
+        record_memory(request.url_rule.rule, stop_memory_trace(trace))
+
+
+# Return the cost of finished requests to the worker's budget
+@app.teardown_request
+def release_cost(exc=None):
+    global _worker_cost
+    cost = flask.g.pop('pmgi_cost', 0.)
+    if cost:
+        with _worker_lock:
+            _worker_cost -= cost
+
+
+# Serve the built pages from live/dist (see build_live.py)
+# The bundles in assets/ have a hash of their content in their names, so
+# they never change and can be cached for good.  The pages keep their
+# names, so clients must revalidate them to pick up a new build.  Files
+# are sent precompressed when the build wrote a variant the client can
+# accept.
+LIVE_DIST = os.path.join(app.root_path, 'live', 'dist')
+LIVE_ASSET_MAX_AGE = 365 * 24 * 3600
+LIVE_ENCODING_SUFFIX = {'br': '.br', 'gzip': '.gz'}
+
+
+@app.route('/live/dist/', defaults={'filename': 'index.html'})
+@app.route('/live/dist/<path:filename>')
+def render_dist(filename):
+    path = safe_join(LIVE_DIST, filename)
+    if path is None or not os.path.isfile(path):
+        flask.abort(404)
+
+    encoding = choose_encoding(request.accept_encodings)
+    sent = path
+    if encoding and os.path.isfile(path + LIVE_ENCODING_SUFFIX[encoding]):
+        sent = path + LIVE_ENCODING_SUFFIX[encoding]
+    else:
+        encoding = None
+
+    # Pages get max_age=None, which send_file turns into no-cache
+    immutable = filename.startswith('assets/')
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = flask.send_file(
+        sent, mimetype=mimetype, conditional=True, etag=True,
+        max_age=LIVE_ASSET_MAX_AGE if immutable else None)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+# The profiles route lists the saved profiles (see PMGI_PROFILE), and
+# downloads them by file name.  It only answers requests made directly
+# from this host, and only while profiling is on.
+@app.route(f'{PREFIX}/profiles', methods=['GET'])
+@app.route(f'{PREFIX}/profiles/<name>', methods=['GET'])
+def profiles(name=None):
+    if PROFILE_MODE is None \
+            or request.remote_addr not in ('127.0.0.1', '::1') \
+            or 'X-Forwarded-For' in request.headers:
+        flask.abort(404)
+    if name is None:
+        return {'dir': PROFILE_DIR, 'profiles': list_profiles()}
+    path = safe_join(PROFILE_DIR, name)
+    if path is None or not os.path.isfile(path) \
+            or not name.endswith(('.json', '.prof')):
+        flask.abort(404)
+    return flask.send_file(path, as_attachment=True)
 
 
 # ##### DELETE ME FOR DEPLOY - ROUTE FOR SERVING STATIC HTML DURING DEV:
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+"""Benchmark the per-request overhead of the request handlers
+
+    python3 bench_requests.py [number]
+
+Times the construction of request handlers (which parses and checks the
+arguments and units, see PMGIRequest.require()) inside a flask request
+context, without computing anything.  Prints the best of 5 runs of
+number (default 20000) constructions, in microseconds per request.
+
+The handlers are the same ones the argument schemas were introduced
+for, so the script can be run on an older checkout of app.py to compare
+the overhead before and after a change.
+"""
+
+import sys
+import timeit
+
+import app
+
+CASES = [
+    ('state POST', app.PropertyRequest, '/state',
+     {'method': 'POST',
+      'json': {'id': 'mp.H2O', 'T': 300, 'p': 1,
+               'units': {'temperature': 'K', 'pressure': 'bar'}}}),
+    ('state GET', app.PropertyRequest,
+     '/state?id=mp.H2O&T=300,400&p=1&uT=K&uP=bar', {'method': 'GET'}),
+    ('isoline', app.IsolineRequest, '/isoline',
+     {'method': 'POST', 'json': {'id': 'mp.H2O', 'T': 300}}),
+]
+
+
+def run(handler, path, kwargs, number):
+    """Return the best time per construction of handler in seconds"""
+    with app.app.test_request_context(path, **kwargs):
+        request = app.request
+        times = timeit.repeat(lambda: handler(request), number=number,
+                              repeat=5)
+    return min(times) / number
+
+
+def bench(number=20000):
+    number = int(number)
+    # Every construction is admitted against the worker's budget, which is
+    # only returned when the request context ends
+    if hasattr(app, 'COST_WORKER_LIMIT'):
+        app.COST_WORKER_LIMIT = float('inf')
+    print('%-12s %9s' % ('request', 'us'))
+    for name, handler, path, kwargs in CASES:
+        print('%-12s %9.1f' % (name, 1e6 * run(handler, path, kwargs,
+                                               number)))
+
+
+if __name__ == '__main__':
+    bench(*sys.argv[1:2])
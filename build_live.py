@@ -0,0 +1,394 @@
+#!/usr/bin/python3
+"""Build the live/ pages for deployment
+
+    python3 build_live.py [source] [destination]
+
+The pages in live/ load their scripts, style sheets and HTML fragments
+one file at a time, straight from the source tree.  That is convenient
+for development, but it costs a round trip per file and none of it can
+be cached for long.  This script writes a deployable copy of the pages
+(by default, to live/dist/) in which
+
+(1) The local scripts and style sheets of each page are bundled, in
+    their original order, into one .js and one .css file.  Only runs of
+    consecutive local tags are bundled, so the order relative to the
+    external (CDN) tags is kept.
+
+(2) The HTML fragments a page's scripts load (e.g. 'unitspicker.html')
+    are placed inline in the page as <template data-fragment="...">
+    elements.  load_fragment() in pyromat_ajax.js uses them instead of
+    fetching the files.
+
+(3) Scripts, style sheets and pages are minified.  The minifiers are
+    deliberately conservative: they remove comments and redundant white
+    space but keep line breaks in scripts, so automatic semicolon
+    insertion is unaffected.
+
+(4) Bundles are written to assets/ with a hash of their content in the
+    file name (e.g. assets/live.3f2a1b9c0d.js).  Their content can
+    never change, so they may be cached forever, and pages with the
+    same bundle share a single file.  See the /live/dist/ route in
+    app.py, which serves them with immutable caching.
+
+(5) Every file is also written gzip compressed (.gz), and brotli
+    compressed (.br) if the brotli package is installed, so servers
+    don't need to compress them for each request.
+
+Web Worker scripts (WORKERS) are loaded by URL, not by the pages, so they
+can't be bundled.  Each is minified and fingerprinted on its own, and the
+quoted name in the bundles (e.g. "pmgi_worker.js") is replaced by the
+fingerprinted path.
+
+The pages themselves keep their names and should be revalidated by
+clients, so that a new build takes effect immediately.
+
+A manifest.json lists the files that were written.  The destination is
+only ever deleted if it contains a manifest from an earlier build.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# The pages to build.  Everything else is reached from them.
+PAGES = ['index.html', 'pointcalc.html', 'substance.html']
+# Web Worker scripts, which are referenced by name from the page scripts
+WORKERS = ['pmgi_worker.js']
+# The length of the content hash in asset file names
+HASH_LENGTH = 10
+# Files smaller than this are not worth precompressing
+COMPRESS_MIN_SIZE = 256
+
+# Keywords that may be followed by a regular expression literal
+_JS_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'in', 'of', 'new',
+                      'delete', 'void', 'throw', 'else', 'do')
+
+_script_tag = re.compile(
+    r'<script\b[^>]*\bsrc="(?P<src>[^"]+)"[^>]*>\s*</script>', re.I)
+_style_tag = re.compile(
+    r'<link\b[^>]*\brel="stylesheet"[^>]*>', re.I)
+_href = re.compile(r'\bhref="(?P<href>[^"]+)"', re.I)
+_fragment_name = re.compile(r'''["']([\w\-]+\.html)["']''')
+
+
+def is_local(url):
+    """Test whether a script or style sheet URL is in the source tree"""
+    return not re.match(r'^([a-z]+:)?//', url, re.I)
+
+
+def minify_js(text):
+    """Remove comments and redundant white space from a script
+    minified = minify_js(text)
+
+Strings, template literals and regular expression literals are copied
+as they are.  Line breaks are kept, except after '{', ';' or ',' and
+before '}', where they can never end a statement.
+"""
+    out = []
+    # The indices of the pieces of out that must be copied as they are
+    literal = set()
+    i = 0
+    n = len(text)
+
+    def last():
+        # The last significant character written
+        for chunk in reversed(out):
+            stripped = chunk.rstrip()
+            if stripped:
+                return stripped[-1]
+        return ''
+
+    def last_word():
+        tail = ''.join(out[-4:]).rstrip()
+        match = re.search(r'[A-Za-z_$][\w$]*$', tail)
+        return match.group(0) if match else ''
+
+    while i < n:
+        ch = text[i]
+        # Strings and template literals
+        if ch in '\'"`':
+            j = i + 1
+            while j < n and text[j] != ch:
+                j += 2 if text[j] == '\\' else 1
+            literal.add(len(out))
+            out.append(text[i:j + 1])
+            i = j + 1
+        # Line comments
+        elif text.startswith('//', i):
+            j = text.find('\n', i)
+            i = n if j < 0 else j
+        # Block comments
+        elif text.startswith('/*', i):
+            j = text.find('*/', i + 2)
+            j = n if j < 0 else j + 2
+            out.append('\n' if '\n' in text[i:j] else ' ')
+            i = j
+        # Regular expression literals
+        elif ch == '/' and (last() in '(,=:[!&|?{};+-*%<>~^' or
+                            last_word() in _JS_REGEX_KEYWORDS):
+            j = i + 1
+            in_class = False
+            while j < n and (in_class or text[j] != '/'):
+                if text[j] == '\\':
+                    j += 1
+                elif text[j] == '[':
+                    in_class = True
+                elif text[j] == ']':
+                    in_class = False
+                j += 1
+            literal.add(len(out))
+            out.append(text[i:j + 1])
+            i = j + 1
+        # White space
+        elif ch.isspace():
+            j = i
+            while j < n and text[j].isspace():
+                j += 1
+            out.append('\n' if '\n' in text[i:j] else ' ')
+            i = j
+        else:
+            j = i
+            while j < n and not text[j].isspace() and \
+                    text[j] not in '\'"`/':
+                j += 1
+            j = max(j, i + 1)
+            out.append(text[i:j])
+            i = j
+
+    # Tighten up the white space that was left between the literals
+    pieces = []
+    code = ''
+    for index, chunk in enumerate(out):
+        if index in literal:
+            pieces += [_tighten_js(code), chunk]
+            code = ''
+        else:
+            code += chunk
+    pieces.append(_tighten_js(code))
+    return ''.join(pieces).strip() + '\n'
+
+
+def _tighten_js(code):
+    code = re.sub(r'[ \t]*\n\s*', '\n', code)
+    code = re.sub(r'(?<=[{;,])\n|\n(?=})', '', code)
+    return re.sub(r' (?=[{}()\[\];,=:?<>|&!])'
+                  r'|(?<=[{}()\[\];,=:?<>|&!]) (?![+-])', '', code)
+
+
+def minify_css(text):
+    """Remove comments and redundant white space from a style sheet"""
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+    return text.replace(';}', '}').strip() + '\n'
+
+
+def minify_html(text):
+    """Remove comments and redundant white space from a page or fragment
+
+White space runs are collapsed to a single space or line break, which
+never changes how a page renders.  Inline scripts are left alone.
+"""
+    pieces = re.split(r'(<script\b.*?</script>|<pre\b.*?</pre>)', text,
+                      flags=re.S | re.I)
+    for index in range(0, len(pieces), 2):
+        piece = re.sub(r'<!--(?!\[if).*?-->', '', pieces[index], flags=re.S)
+        piece = re.sub(r'[ \t]*\n\s*', '\n', piece)
+        pieces[index] = re.sub(r'[ \t]+', ' ', piece)
+    return ''.join(pieces).strip() + '\n'
+
+
+def fingerprint(name, content):
+    """Return the content-hashed file name for an asset
+    hashed = fingerprint('index.js', b'...')
+
+The result for 'live.js' looks like 'live.3f2a1b9c0d.js'.
+"""
+    root, ext = os.path.splitext(name)
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    return f'{root}.{digest}{ext}'
+
+
+def precompress(path):
+    """Write the .gz (and .br) variants of a file, if they are smaller
+    written = precompress(path)
+
+Returns a list of the files that were written.
+"""
+    with open(path, 'rb') as ff:
+        content = ff.read()
+    written = []
+    if len(content) < COMPRESS_MIN_SIZE:
+        return written
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content, quality=11)))
+    for suffix, data in variants:
+        if len(data) < len(content):
+            with open(path + suffix, 'wb') as ff:
+                ff.write(data)
+            written.append(path + suffix)
+    return written
+
+
+def bundle_tags(page, pattern, url, make_tag, src, bundles, ext):
+    """Replace the runs of local tags matching pattern with bundles
+    page = bundle_tags(page, pattern, url, make_tag, src, bundles, ext)
+
+url(match) returns the tag's URL, and make_tag(name) returns the tag for
+a bundle.  The source of each run is added to the bundles list as a
+(name, text) tuple.
+"""
+    out = []
+    run = []
+    position = 0
+
+    def flush():
+        if not run:
+            return
+        text = ''
+        for match in run:
+            with open(os.path.join(src, url(match)), encoding='utf-8') as ff:
+                text += ff.read() + '\n'
+        name = 'bundle%d%s' % (len(bundles), ext)
+        bundles.append((name, text))
+        out.append(make_tag(name))
+        run.clear()
+
+    for match in pattern.finditer(page):
+        between = page[position:match.start()]
+        position = match.end()
+        if between.strip() or not is_local(url(match)):
+            flush()
+        # White space inside of a run is dropped with the tags
+        if not run:
+            out.append(between)
+        if is_local(url(match)):
+            run.append(match)
+        else:
+            out.append(match.group(0))
+    flush()
+    out.append(page[position:])
+    return ''.join(out)
+
+
+def build_worker(name, src, dest):
+    """Build a single Web Worker script
+    asset = build_worker('pmgi_worker.js', 'live', 'live/dist')
+
+Returns the path of the fingerprinted script, relative to dest.
+"""
+    with open(os.path.join(src, name), encoding='utf-8') as ff:
+        content = minify_js(ff.read()).encode('utf-8')
+    asset = 'assets/' + fingerprint(name, content)
+    with open(os.path.join(dest, asset), 'wb') as ff:
+        ff.write(content)
+    return asset
+
+
+def build_page(name, src, dest, workers=None):
+    """Build a single page and its assets
+    written = build_page('index.html', 'live', 'live/dist')
+    written = build_page('index.html', 'live', 'live/dist', workers)
+
+workers is a dict of the fingerprinted paths of the Web Worker scripts by
+their names (see build_worker()).  Returns a list of the files that were
+written, relative to dest.
+"""
+    with open(os.path.join(src, name), encoding='utf-8') as ff:
+        page = ff.read()
+
+    scripts = []
+    page = bundle_tags(
+        page, _script_tag, lambda m: m.group('src'),
+        lambda b: f'<script src="{b}" type="text/javascript"></script>',
+        src, scripts, '.js')
+    styles = []
+    page = bundle_tags(
+        page, _style_tag, lambda m: _href.search(m.group(0)).group('href'),
+        lambda b: f'<link rel="stylesheet" type="text/css" href="{b}">',
+        src, styles, '.css')
+
+    written = []
+    # Inline the fragments that the scripts load
+    templates = []
+    for fragment in sorted({frag for _, text in scripts
+                            for frag in _fragment_name.findall(text)}):
+        path = os.path.join(src, fragment)
+        if fragment in PAGES or not os.path.isfile(path):
+            continue
+        with open(path, encoding='utf-8') as ff:
+            templates.append(f'<template data-fragment="{fragment}">'
+                             f'{minify_html(ff.read())}</template>')
+    if templates:
+        page = page.replace('</body>', '\n'.join(templates) + '\n</body>', 1)
+
+    # Write the bundles with their fingerprinted names
+    for bundles, minify in ((scripts, minify_js), (styles, minify_css)):
+        for placeholder, text in bundles:
+            ext = os.path.splitext(placeholder)[1]
+            if ext == '.js':
+                for worker, asset in (workers or {}).items():
+                    text = text.replace(f'"{worker}"', f'"{asset}"')
+            content = minify(text).encode('utf-8')
+            asset = 'assets/' + fingerprint('live' + ext, content)
+            with open(os.path.join(dest, asset), 'wb') as ff:
+                ff.write(content)
+            written.append(asset)
+            page = page.replace(f'"{placeholder}"', f'"{asset}"')
+
+    with open(os.path.join(dest, name), 'w', encoding='utf-8') as ff:
+        ff.write(minify_html(page))
+    written.append(name)
+    return written
+
+
+def build(src='live', dest=None):
+    """Build all of the PAGES from src into dest
+    manifest = build()
+    manifest = build('live', 'live/dist')
+
+Returns the manifest dict, which is also written to dest/manifest.json.
+"""
+    if dest is None:
+        dest = os.path.join(src, 'dist')
+    if os.path.isdir(dest):
+        if not os.path.isfile(os.path.join(dest, 'manifest.json')):
+            raise Exception('Refusing to replace a directory that was not '
+                            'written by build_live.py: ' + dest)
+        shutil.rmtree(dest)
+    os.makedirs(os.path.join(dest, 'assets'))
+
+    manifest = {'pages': {}, 'files': []}
+    workers = {}
+    for name in WORKERS:
+        workers[name] = build_worker(name, src, dest)
+        manifest['files'].append(workers[name])
+    for name in PAGES:
+        written = build_page(name, src, dest, workers)
+        manifest['pages'][name] = written[:-1]
+        manifest['files'] += [path for path in written
+                              if path not in manifest['files']]
+    for name in list(manifest['files']):
+        for path in precompress(os.path.join(dest, name)):
+            manifest['files'].append(os.path.relpath(path, dest))
+
+    with open(os.path.join(dest, 'manifest.json'), 'w') as ff:
+        json.dump(manifest, ff, indent=1)
+    return manifest
+
+
+if __name__ == '__main__':
+    manifest = build(*sys.argv[1:3])
+    for name in manifest['files']:
+        print(name)
@@ -45,9 +45,11 @@ class Subject {
 }
 
 
-class UnitModel{
+class UnitModel extends Subject{
+    static EVENT_UNIT = 'unit_change'; // Data will be the new units
 
     constructor(valid_units, active_units){
+        super();
         this.valid_units = valid_units;
         this.set_units = this.set_units.bind(this);
         this.get_units = this.get_units.bind(this);
@@ -57,12 +59,14 @@ class UnitModel{
     }
 
     /**
-     * Change the current units. This invalidates all stored point data.
+     * Change the current units. Stored point data must be converted to the
+     * new units first, see DataModel.convert_units().
      * @param units - a dict of the current units. Keys are unit category,
      *                    values are the unit value
      */
     set_units(units){
         this.units = units;
+        this.notify(this, UnitModel.EVENT_UNIT, units);
     }
 
     /**
@@ -318,6 +322,19 @@ class DataModel extends Subject{
         this.notify(this, DataModel.EVENT_AUXLINE_ADD, line);
     }
 
+    /**
+     * Convert all stored points and aux lines to new units, in place. No
+     * event is sent, the views are updated by the UnitModel.
+     * @param convert - function(data), converts a dict of property arrays
+     *                  in place (see convert_units() in pyromat_ajax.js)
+     */
+    convert_units(convert){
+        convert(this.points);
+        Object.values(this.aux_lines).forEach((lines) => {
+            lines.forEach((line) => convert(line.data));
+        });
+    }
+
     /**
      * * Remove an auxiliary line its parent point integer id
      * @param id - the integer id of the parent point (via 'ptid' property)
@@ -412,7 +429,7 @@ class PlotControls extends Subject{
 
         this.hide();
 
-        this.$inner.load(html, ()=> {
+        load_fragment(this.$inner, html, ()=> {
             let $checks = $("#checkboxes", this.$inner);
             let $xsel = $("#xdropdown", this.$inner);
             let $ysel = $("#ydropdown", this.$inner);
@@ -478,7 +495,7 @@ class TableControls extends Subject{
 
         this.hide();
 
-        this.$inner.load(html, ()=> {
+        load_fragment(this.$inner, html, ()=> {
             let $checks = $("#checkboxes", this.$inner);
 
             this.checks = new PropChooserView($checks, TableControls.EVENT_SUBCOMPONENT_CHECKS, this.colopts);
@@ -541,7 +558,7 @@ class UnitPicker {
         this.$inner.addClass("modal-content");
         this.$outer.append(this.$inner);
 
-        this.$inner.load(html, ()=>{
+        load_fragment(this.$inner, html, ()=>{
             this.unit_form = $('#'+this.unit_form_name, this.$outer);
 
             // Attach the apply, revert and cancel buttons
@@ -637,15 +654,10 @@ class UnitPicker {
      * @returns {boolean}
      */
     apply_onclick(){
-        // Confirm
-        let success = confirm('Changing the units will reset all data. Are you sure?');
-        if(success){
-            // Pass the units to the controller
-            this.change_units_callback(this.get_values())
-        } else {
-            // do nothing and let the user figure it out
-            return false;
-        }
+        // The data are converted to the new units, so nothing is lost
+        this.currentval = this.get_values();
+        this.change_units_callback(this.currentval);
+        this.hide();
     }
 
     /**
@@ -778,6 +790,14 @@ class PropEntryView{
         }
     }
 
+    /**
+     * Rebuild the form with new unit strings
+     * @param units - an dict of unit strings by prop
+     */
+    set_units(units){
+        this.create_propform(this.props, units);
+    }
+
     /**
      * Convert the form values to a dict of output data
      * @returns data - a dict keyed by property and string vals
@@ -942,8 +962,10 @@ class PlotView{
     TRACEORDER = ['steamdome','p','T','d', 'h', 's', 'x', 'user']
     TRACENAMES = ['User Data', 'Steam Dome', 'Const. p', 'Const. T', 'Const. d', 'Const. h', 'Const. s', 'Const. x']
     TRACECOLORS = ['']
+    // A burst of zooms and pans only requests the tiles of the last view
+    TILE_DELAY = 150 // ms
 
-    constructor(divTarget, datasource, units, pointcallback) {
+    constructor(divTarget, datasource, units, pointcallback, tilecallback=null) {
         // TODO - plot prettiness
         this.dispprops = ['T','s','p','v'];
         this.dispisos = ['T', 'p', 'h'];
@@ -962,6 +984,8 @@ class PlotView{
 
         this.units = units;
         this.pointcallback = pointcallback;
+        // Loads the detailed isolines when zoomed in, see load_tiles()
+        this.tilecallback = tilecallback;
         this.datasource = datasource;
 
         this.init();
@@ -1095,6 +1119,161 @@ class PlotView{
         // Create the plot object
         Plotly.newPlot(this.plot.get()[0], this.traces, this.layout, {responsive: true});
         this.setupPlotClickListener();
+
+        // The tiles of the isolines are loaded for these axes
+        this.tiles = {};
+        // The key of the tile pending on each request channel
+        this.tile_slots = [];
+        this.tile_extent = null;
+        this.tile_view = null;
+        if (this.tilecallback) {
+            this.plot.get()[0].on('plotly_relayout', () => this.load_tiles());
+        }
+    }
+
+    /**
+     * The diagram that the tiles are requested for
+     */
+    tile_axes(){
+        return {
+            x: this.x_prop,
+            y: this.y_prop,
+            xscale: this.layout['xaxis']['type'],
+            yscale: this.layout['yaxis']['type']
+        };
+    }
+
+    /**
+     * Load the tiles of the isolines that are in view, when the plot is
+     * zoomed in. Deeper zoom levels have more points on each line, so lines
+     * stay smooth as the user zooms. When the plot is zoomed out, or until
+     * the tiles arrive, the global aux lines are drawn.
+     *
+     * Each pending tile holds one of a few request channels (see
+     * ajax_route()). The tiles of a new view take over the channels of
+     * tiles that have left the view, which supersedes them, and requests
+     * wait TILE_DELAY ms, so a burst of relayout events only sends the
+     * tiles of the view it ends on.
+     */
+    load_tiles(){
+        let plot = this.plot.get()[0];
+        let axes = this.tile_axes();
+        let prefix = this.tile_prefix();
+
+        // The first tile covers the whole diagram, and gives its extent
+        if (this.tile_extent == null) {
+            this.tilecallback(Object.assign({level: 0, i: 0, j: 0}, axes), (tile) => {
+                if (tile && prefix === this.tile_prefix()) {
+                    this.tile_extent = tile.extent;
+                    this.tile_levels = tile.levels;
+                    this.load_tiles();
+                }
+            });
+            return;
+        }
+
+        let [x0, x1, y0, y1] = this.tile_extent;
+        let xrange = plot.layout.xaxis.range;
+        let yrange = plot.layout.yaxis.range;
+        let zoom = Math.min(
+            (x1 - x0) / Math.abs(xrange[1] - xrange[0]),
+            (y1 - y0) / Math.abs(yrange[1] - yrange[0]));
+        let level = Math.min(this.tile_levels - 1,
+            Math.max(0, Math.floor(Math.log2(zoom))));
+        if (!(level > 0)) {
+            this.tile_view = null;
+            this.draw_auxlines(this.datasource.get_auxlines());
+            return;
+        }
+
+        // The tiles that overlap the view
+        let count = 2 ** level;
+        let index = (value, start, stop) => Math.min(count - 1, Math.max(0,
+            Math.floor((value - start) / (stop - start) * count)));
+        let keys = [];
+        let requests = [];
+        for (let i = index(Math.min(...xrange), x0, x1); i <= index(Math.max(...xrange), x0, x1); i++) {
+            for (let j = index(Math.min(...yrange), y0, y1); j <= index(Math.max(...yrange), y0, y1); j++) {
+                let key = [prefix, level, i, j].join('/');
+                keys.push(key);
+                if (!(key in this.tiles)) {
+                    requests.push([key, Object.assign({level: level, i: i, j: j}, axes)]);
+                }
+            }
+        }
+        this.tile_view = {level: level, keys: keys};
+
+        // Channels are free once their tile has arrived or left the view
+        let slot = 0;
+        let free = (n) => !this.tile_slots[n] || !keys.includes(this.tile_slots[n]);
+        requests.forEach(([key, props]) => {
+            while (!free(slot)) {
+                slot++;
+            }
+            // The tile on this channel is superseded, and is never answered
+            if (this.tile_slots[slot]) {
+                delete this.tiles[this.tile_slots[slot]];
+            }
+            let n = slot++;
+            this.tile_slots[n] = key;
+            this.tiles[key] = null;
+            let options = {channel: this.plot_div_name + ' tile ' + n, delay: this.TILE_DELAY};
+            this.tilecallback(props, (tile) => {
+                if (this.tile_slots[n] === key) {
+                    this.tile_slots[n] = null;
+                }
+                if (!tile) {
+                    delete this.tiles[key];
+                    return;
+                }
+                this.tiles[key] = tile;
+                if (this.tile_view && this.tile_view.keys.includes(key)) {
+                    this.draw_auxlines(this.datasource.get_auxlines());
+                }
+            }, options);
+        });
+        this.draw_auxlines(this.datasource.get_auxlines());
+    }
+
+    /**
+     * The part of the tile keys that identifies the diagram
+     */
+    tile_prefix(){
+        let axes = this.tile_axes();
+        // Tiles asked for in other units are dropped when they arrive
+        return [axes.x, axes.y, axes.xscale, axes.yscale,
+            JSON.stringify(this.units)].join('/');
+    }
+
+    /**
+     * Join the lines of a family from the loaded tiles in view
+     * @param prop - the family, e.g. 'p' or 'steamdome'
+     * @returns dict of x, y and value arrays, or null if the tiles in view
+     *  haven't arrived yet
+     */
+    tile_lines(prop){
+        if (this.tile_view == null) {
+            return null;
+        }
+        let tiles = this.tile_view.keys.map((key) => this.tiles[key])
+            .filter((tile) => tile);
+        if (tiles.length === 0) {
+            return null;
+        }
+        let joined = {};
+        ['x', 'y', 'value'].forEach((key) => {
+            let parts = tiles.filter((tile) => prop in tile.lines)
+                .map((tile) => tile.lines[prop][key]);
+            let size = parts.reduce((total, part) => total + part.length, 0);
+            let trace = new Float64Array(size);
+            let offset = 0;
+            parts.forEach((part) => {
+                trace.set(part, offset);
+                offset += part.length;
+            });
+            joined[key] = trace;
+        });
+        return joined;
     }
 
     /**
@@ -1176,9 +1355,11 @@ class PlotView{
         } else if (event === DataModel.EVENT_INIT_POINTS) {
             this.init();
             this.draw_auxlines(source.get_auxlines());
-        } else if (event === unitModel.EVENT_UNIT) {
+        } else if (event === UnitModel.EVENT_UNIT) {
+            this.units = source.get_units_for_prop(this.datasource.get_output_properties());
             this.init();
-            this.draw_auxlines(this.datasource.get_auxlines())
+            this.draw_auxlines(this.datasource.get_auxlines());
+            this.updatePoints(this.datasource.get_points());
         } else if (event === TableControls.EVENT_COLUMN_CHANGE) {
             this.dispprops = data;
             this.updatePoints(this.datasource.get_points());
@@ -1216,31 +1397,41 @@ class PlotView{
 
                 // Make a placeholder for the updates
                 let iso_update = null;
+                // When zoomed in, the lines come from the tiles in view
+                let tile_lines = this.tile_lines(prop);
 
                 if (prop === 'steamdome' ||
                     (this.x_prop !== prop && this.y_prop !== prop &&
                         this.dispisos.includes(prop))
                 ) {
                     // Loop over all the aux lines that are in the "global" category
-                    data['global'].forEach((line) => {
-
-                        if (line['type'] === prop) {
-
-                            // Initialize the trace update on the first call
-                            if (iso_update == null) {
-                                iso_update = {};
-                                Object.keys(line['data']).forEach((key) => {
-                                    iso_update[key] = [];
-                                });
-                            }
-
-                            // Add the line to the trace property by property
-                            Object.keys(line['data']).forEach((key) => {
-                                iso_update[key] = iso_update[key].concat(line['data'][key]);
-                                iso_update[key].push(null);
-                            });
+                    let lines = data['global'].filter((line) => line['type'] === prop);
+                    if (tile_lines != null) {
+                        if (tile_lines.x.length > 0) {
+                            iso_update = {};
+                            iso_update[this.x_prop] = tile_lines.x;
+                            iso_update[this.y_prop] = tile_lines.y;
+                            iso_update[prop] = tile_lines.value;
                         }
-                    });
+                    } else if (lines.length > 0) {
+                        iso_update = {};
+                        // Join the lines into one trace property by property,
+                        // with a gap (NaN) after each line. The lines may be
+                        // Arrays or Float64Arrays.
+                        Object.keys(lines[0]['data']).forEach((key) => {
+                            let size = 0;
+                            lines.forEach((line) => {
+                                size += line['data'][key].length + 1;
+                            });
+                            let trace = new Float64Array(size).fill(NaN);
+                            let offset = 0;
+                            lines.forEach((line) => {
+                                trace.set(line['data'][key], offset);
+                                offset += line['data'][key].length + 1;
+                            });
+                            iso_update[key] = trace;
+                        });
+                    }
                 }
 
                 // Send the updated traces to the actual plot
@@ -1404,6 +1595,14 @@ class TableView{
             this.init(this.datasource.get_output_properties());
         } else if (event === TableControls.EVENT_COLUMN_CHANGE) {
             this.columnVisibility(data);
+        } else if (event === UnitModel.EVENT_UNIT) {
+            // The headers show the units, so the table is rebuilt
+            this.units = source.get_units_for_prop(this.datasource.get_output_properties());
+            this.init(this.datasource.get_output_properties());
+            if (this.visible_columns != null) {
+                this.columnVisibility(this.visible_columns);
+            }
+            this.updatePoints(this.datasource.get_points());
         }
     }
 
@@ -1412,6 +1611,7 @@ class TableView{
      * @param columns - an array of property names to display
      */
     columnVisibility(columns){
+        this.visible_columns = columns;
 
         this.table.columns().every((ind) => {
             let col = this.table.column(ind);
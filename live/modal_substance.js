@@ -25,7 +25,7 @@ class SubstancePicker {
 
         this.callback = callback;
 
-        this.$inner.load(html, ()=>{
+        load_fragment(this.$inner, html, ()=>{
 
             this.button_updatefilt_name = "filt_update";
             this.button_cancel_name = "selection_cancel";
@@ -0,0 +1,286 @@
+/**
+ * Web Worker for fetching and decoding PMGI responses off the main thread.
+ *
+ * Large responses (isoline families, the steam dome, state tables) are slow
+ * to parse with JSON.parse, and their "nan" and "inf" strings then have to be
+ * converted one value at a time, which freezes the page. This worker does
+ * that work instead. Every numeric array in a response is returned as a
+ * Float64Array, and their buffers are transferred to the main thread without
+ * copying. Binary responses (application/x-pmgi) are asked for, and are
+ * decoded straight into views on the response body.
+ *
+ * It is driven by worker_call() in pyromat_ajax.js, and doesn't depend on
+ * any other script. Messages to the worker are dicts with an id, and one of
+ *  - url, body, headers (POST body to url, and decode the response)
+ *  - data (decode a response body the caller already has, e.g. from a cache)
+ *  - events (decode a list of [event, data] pairs from an isoline stream)
+ *  - abort (the id of a fetch to abort, with no reply)
+ *
+ * Every message is answered by a dict with the same id and done: true, with
+ *  - response (the decoded PMGI response, or null if there wasn't one)
+ *  - body (a copy of the raw body, for caching, only for fetches)
+ *  - status, etag (only for fetches)
+ *  - events (a list of [event, payload] pairs, for events)
+ *  - error (str, if the fetch failed or was aborted)
+ * Streamed responses (text/event-stream) are answered with a reply for each
+ * event before the done reply, with fields id, event, payload and data (the
+ * event's raw text).
+ */
+
+const BINARY_RESPONSE = "application/x-pmgi";
+
+// The fetches in progress, by id
+let controllers = {};
+
+
+self.onmessage = (event) => {
+    let msg = event.data;
+    if ("abort" in msg) {
+        if (controllers[msg.abort]) {
+            controllers[msg.abort].abort();
+        }
+        return;
+    }
+
+    let transfer = [];
+    let reply = {id: msg.id, done: true, response: null};
+    let work;
+    if ("url" in msg) {
+        work = fetch_response(msg, reply, transfer);
+    } else if ("events" in msg) {
+        reply.events = msg.events.map(([name, data]) =>
+            [name, typed_arrays(JSON.parse(data), transfer, false)]);
+        work = Promise.resolve();
+    } else {
+        reply.response = decode(msg.data, transfer);
+        work = Promise.resolve();
+    }
+    work.catch((err) => {
+        reply.error = String(err);
+    }).then(() => {
+        self.postMessage(reply, unique(transfer));
+    });
+};
+
+
+/**
+ * Fetch a response, and fill in the reply with it
+ * @param msg - dict, the message with url, body and headers
+ * @param reply - dict, the reply to fill in
+ * @param transfer - array, to which the buffers of the reply are added
+ * @returns Promise resolving when the reply is complete
+ */
+function fetch_response(msg, reply, transfer){
+    let controller = new AbortController();
+    controllers[msg.id] = controller;
+    return fetch(msg.url, {
+        method: "POST",
+        body: msg.body,
+        headers: msg.headers,
+        signal: controller.signal
+    }).then((response) => {
+        reply.status = response.status;
+        reply.etag = response.headers.get("ETag");
+        let type = response.headers.get("Content-Type") || "";
+        if (response.status === 304) {
+            return;
+        } else if (type.startsWith("text/event-stream")) {
+            return read_stream(msg.id, response);
+        } else if (type.startsWith(BINARY_RESPONSE)) {
+            return response.arrayBuffer().then((data) => {
+                // The decoded arrays are views on data, which the caller is
+                // free to change, so the copy for caching is taken first
+                reply.body = data.slice(0);
+                transfer.push(reply.body);
+                reply.response = decode(data, transfer);
+            });
+        }
+        return response.text().then((text) => {
+            reply.body = text;
+            reply.response = decode(text, transfer);
+        });
+    }).finally(() => {
+        delete controllers[msg.id];
+    });
+}
+
+
+/**
+ * Read a Server-Sent Events stream, and post each event as it arrives
+ * @param id - the id of the message that asked for it
+ * @param response - the fetch Response
+ * @returns Promise resolving at the end of the stream
+ */
+function read_stream(id, response){
+    let reader = response.body.getReader();
+    let decoder = new TextDecoder();
+    let buffer = "";
+
+    // Dispatch a single complete event block
+    let dispatch = (block) => {
+        let name = "message";
+        let data = "";
+        block.split("\n").forEach((line) => {
+            if (line.startsWith("event:")) {
+                name = line.slice(6).trim();
+            } else if (line.startsWith("data:")) {
+                data += line.slice(5).trim();
+            }
+        });
+        if (data === "") {
+            return;
+        }
+        let transfer = [];
+        let payload = typed_arrays(JSON.parse(data), transfer, false);
+        self.postMessage({id: id, event: name, payload: payload, data: data},
+                         unique(transfer));
+    };
+
+    // Events are separated by blank lines. Keep any partial event in the
+    // buffer until the rest of it arrives.
+    let pump = () => reader.read().then(({done, value}) => {
+        if (done) {
+            if (buffer.trim() !== "") {
+                dispatch(buffer);
+            }
+            return;
+        }
+        buffer += decoder.decode(value, {stream: true});
+        let blocks = buffer.split("\n\n");
+        buffer = blocks.pop();
+        blocks.forEach(dispatch);
+        return pump();
+    });
+    return pump();
+}
+
+
+/**
+ * Decode a PMGI response body
+ * @param data - str (JSON) or ArrayBuffer (binary) response body
+ * @param transfer - array, to which the buffers of the arrays are added
+ * @returns the response, with its numeric arrays as Float64Array
+ */
+function decode(data, transfer){
+    if (typeof data === "string") {
+        let response = JSON.parse(data);
+        typed_arrays(response, transfer, false);
+        return response;
+    }
+
+    // 4 bytes of header length, the JSON header, then float64 array data,
+    // which starts on a multiple of 8 bytes
+    let length = new DataView(data).getUint32(0, true);
+    let header = JSON.parse(new TextDecoder().decode(new Uint8Array(data, 4, length)));
+    let start = 4 + length;
+    let little = new Uint8Array(new Float64Array([1]).buffer)[7] === 0x3f;
+
+    let revive = (value) => {
+        if (Array.isArray(value)) {
+            return value.map(revive);
+        } else if (value === null || typeof value !== "object") {
+            return value;
+        } else if (!("$array" in value)) {
+            Object.keys(value).forEach((key) => {
+                value[key] = revive(value[key]);
+            });
+            return value;
+        }
+        let ref = value["$array"];
+        let count = ref.shape.reduce((a, b) => a * b, 1);
+        let values;
+        if (little) {
+            values = new Float64Array(data, start + ref.offset, count);
+        } else {
+            let view = new DataView(data, start + ref.offset, count * 8);
+            values = Float64Array.from({length: count}, (_, i) => view.getFloat64(i * 8, true));
+        }
+        return reshape(values, ref.shape);
+    };
+    let response = revive(header);
+    // Single values are still sent as JSON, with their "nan"/"inf" strings
+    response.data = typed_arrays(response.data, [], true);
+    transfer.push(data);
+    return response;
+}
+
+
+/**
+ * Split a flat Float64Array into nested arrays of rows, without copying
+ * @param values - Float64Array
+ * @param shape - array of dimensions
+ * @returns Float64Array, or nested Arrays with Float64Array rows
+ */
+function reshape(values, shape){
+    if (shape.length <= 1) {
+        return values;
+    }
+    let size = values.length / shape[0];
+    let rows = [];
+    for (let i = 0; i < shape[0]; i++) {
+        rows.push(reshape(values.subarray(i * size, (i + 1) * size), shape.slice(1)));
+    }
+    return rows;
+}
+
+
+/**
+ * Convert the numeric arrays in a parsed JSON response to Float64Array, in
+ * place
+ *
+ * An array is numeric if all of its values are numbers or the "nan" and
+ * "inf" strings used by the server. Nested numeric arrays (e.g. from the grid
+ * route) become Arrays of Float64Array rows.
+ * @param value - the parsed JSON value
+ * @param transfer - array, to which the buffers of the new arrays are added
+ * @param sentinels - bool, if true, lone "nan" and "inf" strings are
+ *  converted to numbers too. Only set this for data, never for args.
+ * @returns the converted value
+ */
+function typed_arrays(value, transfer, sentinels){
+    if (ArrayBuffer.isView(value)) {
+        return value;
+    } else if (Array.isArray(value)) {
+        if (value.length > 0 && value.every(is_number)) {
+            let values = Float64Array.from(value, to_number);
+            transfer.push(values.buffer);
+            return values;
+        }
+        value.forEach((item, i) => {
+            value[i] = typed_arrays(item, transfer, sentinels);
+        });
+        return value;
+    } else if (value !== null && typeof value === "object") {
+        Object.keys(value).forEach((key) => {
+            // Only the data of a response has sentinels
+            let data = sentinels || key === "data";
+            value[key] = typed_arrays(value[key], transfer, data);
+        });
+        return value;
+    } else if (sentinels && is_number(value)) {
+        return to_number(value);
+    }
+    return value;
+}
+
+
+function is_number(value){
+    return typeof value === "number" || value === "nan" || value === "inf" ||
+        value === "-inf";
+}
+
+
+function to_number(value){
+    if (typeof value === "number") {
+        return value;
+    }
+    return value === "nan" ? NaN : (value === "-inf" ? -Infinity : Infinity);
+}
+
+
+/**
+ * Remove duplicate buffers from a transfer list, which postMessage refuses
+ */
+function unique(transfer){
+    return Array.from(new Set(transfer));
+}
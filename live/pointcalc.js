@@ -23,20 +23,14 @@ var tableView;
  */
 $(function(){
 
-    // infodata holds the basic info about PYroMat substances.
-    // Check if the infodata has been created and saved to our localStorage
-    infodata = localStorage.getItem("infodata");
-    if (infodata === null){  // Data not stored, load it from ajax
-        ajax_info((data)=>{
-            // Data ready. Save to localStorage, and copy to variable
-            localStorage.setItem("infodata", JSON.stringify(data));
-            infodata = data;
-            init();
-        });
-    } else {
-        infodata = JSON.parse(infodata); // parse the data from localStorage
+    // infodata holds the basic info about PYroMat substances. ajax_info()
+    // keeps it in the response cache, and checks it is still current.
+    // Older versions of the page kept it in localStorage for good.
+    localStorage.removeItem("infodata");
+    ajax_info((data)=>{
+        infodata = data;
         init();
-    }
+    });
 });
 
 
@@ -97,7 +91,8 @@ function init(){
     plotView = new PlotView("plot_display",
         dataModel,
         unitModel.get_units_for_prop(dataModel.get_output_properties()),
-        compute_point);
+        compute_point,
+        compute_tile);
     dataModel.addListener(plotView);
     tableControlsModal.addListener(plotView);
     plotControlsModal.addListener(plotView);
@@ -109,6 +104,10 @@ function init(){
         unitModel.get_units_for_prop(dataModel.get_output_properties()));
     dataModel.addListener(tableView);
     tableControlsModal.addListener(tableView);
+
+    // The views show the units, and redraw when they change
+    unitModel.addListener(plotView);
+    unitModel.addListener(tableView);
 }
 
 
@@ -160,12 +159,38 @@ function change_substance(substance){
 
 /**
  * Call when the user requests a change to the units.
- * Reloads page.
+ * The data already computed are converted to the new units in place, so
+ * nothing has to be computed again. If the server doesn't publish the
+ * conversion factors, the page is reloaded instead.
  * @param units - the units dictionary keyed by unit type
  */
 function change_units(units){
     set_units_cookie(units)
-    location.reload()
+    let conversions = infodata.data.conversions;
+    if (!conversions || !conversions.scale) {
+        location.reload();
+        return;
+    }
+    // Unset units are the server defaults
+    let from_units = Object.assign({}, infodata.units, unitModel.get_units());
+    let to_units = Object.assign({}, infodata.units, units);
+    let mw = substance_mw(conversions);
+    dataModel.convert_units((data) =>
+        convert_units(data, from_units, to_units, conversions, mw));
+    unitModel.set_units(to_units);
+    propEntryForm.set_units(
+        unitModel.get_units_for_prop(dataModel.get_input_properties()));
+}
+
+/**
+ * The molecular weight of the substance in kg/kmol
+ * @param conversions - the conversions section of the /info response
+ */
+function substance_mw(conversions){
+    // infodata was computed in the server's default units
+    let mw = infodata.data.substances[dataModel.get_substance()].mw;
+    return mw * conversions.scale.molar[infodata.units.molar] /
+        conversions.scale.mass[infodata.units.mass];
 }
 
 /**
@@ -205,12 +230,22 @@ function calculate_plot_isolines(){
 // *  Wrappers for API calls
 // **********************************************************
 
+// Lines are decoded by a Web Worker into Float64Array, see ajax_route()
+const LINE_OPTIONS = {typed: true};
+
 /**
  * Wrapper for computing isolines. Automatically adds result as an
  * auxline to datamodel.
  * @param props - Dict with keys of property and numeric values
  */
 function compute_auxline(props={}){
+    // Families of default lines are streamed so each line can be drawn as
+    // soon as the server finishes it.
+    if ('default' in props){
+        compute_auxline_stream(props);
+        return;
+    }
+
     ajax_isoline(dataModel.get_substance(),
         props,
         unitModel.get_units(),
@@ -229,10 +264,27 @@ function compute_auxline(props={}){
                 });
             } else {
                 // Add the line
-                dataModel.add_auxline(prop, line, 'global');
+                dataModel.add_auxline(prop, response.data, 'global');
             }
 
-    });
+    }, false, LINE_OPTIONS);
+}
+
+/**
+ * Wrapper for computing a family of isolines over the streaming API. Each
+ * line is added as an auxline to datamodel as soon as it arrives.
+ * @param props - Dict with keys of property and numeric values
+ */
+function compute_auxline_stream(props={}){
+    // Get the property that this family is for (without default)
+    let prop = Object.keys(props).filter((key) => key !== 'default')[0];
+
+    ajax_isoline_stream(dataModel.get_substance(),
+        props,
+        unitModel.get_units(),
+        (line) => {
+            dataModel.add_auxline(prop, line.data, 'global');
+        }, null, false, LINE_OPTIONS);
 }
 
 /**
@@ -248,16 +300,38 @@ function compute_steamdome(){
             let sll = response.data['liquid'];
             let svl = response.data['vapor'];
 
-            // concatenate vapor onto liquid so we have a single line
+            // concatenate the reversed vapor line onto liquid so we have a
+            // single line
+            let dome = {};
             Object.keys(svl).forEach(key => {
-                for (let i = svl[key].length; i > -1; i--) {
-                    sll[key].push(svl[key][i]);
-                }
+                let line = new Float64Array(sll[key].length + svl[key].length);
+                line.set(sll[key]);
+                line.set(Array.from(svl[key]).reverse(), sll[key].length);
+                dome[key] = line;
             });
 
             // Add the line to the model
-            dataModel.add_auxline('steamdome', sll,parent='global');
-    });
+            dataModel.add_auxline('steamdome', dome, 'global');
+    }, false, LINE_OPTIONS);
+}
+
+
+/**
+ * Wrapper for loading a tile of the plot's isolines. Used as a callback by
+ * the PlotView when the plot is zoomed in.
+ * @param tile_props - Dict defining the tile, see ajax_tile()
+ * @param callback - Called with the tile data, or null if it failed. It is
+ *  never called if the request is superseded on its channel.
+ * @param options - dict of request options (e.g. channel and delay), see
+ *  ajax_route()
+ */
+function compute_tile(tile_props, callback, options=null){
+    ajax_tile(dataModel.get_substance(),
+        tile_props,
+        unitModel.get_units(),
+        (response) => {
+            callback(response.message.error ? null : response.data);
+        }, true, Object.assign({}, LINE_OPTIONS, options));
 }
 
 
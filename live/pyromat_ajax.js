@@ -18,6 +18,12 @@
  *  - message (related to erros)
  *  - units (active units)
  *
+ * The response is kept in the response cache and revalidated with the server
+ * on every call, which costs little more than a round trip when it has not
+ * changed. The versions it reports become part of the key for every other
+ * cached response, so nothing computed by an older server is reused. If the
+ * server can't be reached, the cached copy is used.
+ *
  * @param callback - function handle to be called on completion of ajax
  *   request. Data type will be JSON.
  *
@@ -28,9 +34,37 @@
  *
  */
 function ajax_info(callback){
-    $.get("/api/info",  // route
-        callback,  // callback function handle
-        'json');  // Data type of the response.
+    // Only ask for the parts that don't change between requests, so the
+    // response can be revalidated
+    let args = {startup: false, lanes: false, compression: false, memory: false};
+
+    cache_get(CACHE_INFO_KEY).then((entry) => {
+        let ready = (response) => {
+            cache_versions = canonical_json(response.data.versions);
+            callback(response);
+        };
+        $.ajax({
+            url: "/api/info",
+            type: "GET",
+            data: args,
+            dataType: "json",
+            headers: (entry && entry.etag) ? {'If-None-Match': entry.etag} : {},
+            success: (response, status, xhr) => {
+                if (xhr.status === 304) {
+                    response = JSON.parse(entry.body);
+                    cache_put(CACHE_INFO_KEY, entry.body, entry.etag);
+                } else {
+                    cache_put(CACHE_INFO_KEY, xhr.responseText, xhr.getResponseHeader("ETag"));
+                }
+                ready(response);
+            },
+            error: () => {
+                if (entry) {
+                    ready(JSON.parse(entry.body));
+                }
+            },
+        });
+    });
 }
 
 
@@ -45,6 +79,13 @@ function ajax_info(callback){
  *    - ...
  *  - message (related to erros)
  *  - units (active units)
+ *  - valid (true/false by state, false for states that were out of bounds
+ *    and were not evaluated. Their data are nan.)
+ *
+ * Single points requested within POINT_BATCH_DELAY ms of each other, for the
+ * same substance, units and input properties, are sent to the server as one
+ * array-valued request. Each callback still receives a response for its own
+ * point, with the same fields as if it had been sent alone.
  *
  * @param substance - str, the substance id (e.g. mp.H2O)
  * @param state_props - dict of properties to send (e.g. {T:300, p:1}
@@ -53,11 +94,15 @@ function ajax_info(callback){
  *  argument as callback(response).
  * @param ignore_err - bool, if true, errors are ignored to be handled by the
  *  callback.
+ * @param options - dict of request options, see ajax_route()
  */
-function ajax_point(substance, state_props=null, units=null, callback=null, ignore_err=false){
+function ajax_point(substance, state_props=null, units=null, callback=null, ignore_err=false, options=null){
     let requestroute = "/api/state";
+    if (options === null && batch_point(substance, state_props, units, callback, ignore_err)) {
+        return;
+    }
     let postData = build_postData(substance, state_props, units);
-    ajax_route(requestroute, postData, callback, ignore_err)
+    ajax_route(requestroute, postData, callback, ignore_err, options)
 }
 
 
@@ -90,6 +135,11 @@ function ajax_point(substance, state_props=null, units=null, callback=null, igno
  *      - p (array of p)
  *      - ...
  *
+ * A family of lines is computed until the deadline of the request. A deadline
+ * in seconds may be sent with the properties (e.g. {T:null, default:true,
+ * deadline:5}) to shorten it. The lines finished by then are returned, and a
+ * warning lists the values that were skipped.
+ *
  * @param substance - str, the substance id (e.g. mp.H2O)
  * @param state_props - dict of properties to send (e.g. {T:300}
  * @param units - dict of the units to apply
@@ -97,11 +147,194 @@ function ajax_point(substance, state_props=null, units=null, callback=null, igno
  *  argument as callback(response).
  * @param ignore_err - bool, if true, errors are ignored to be handled by the
  *  callback.
+ * @param options - dict of request options, see ajax_route()
  */
-function ajax_isoline(substance, state_props=null, units=null, callback=null, ignore_err=false){
+function ajax_isoline(substance, state_props=null, units=null, callback=null, ignore_err=false, options=null){
     let requestroute = "/api/isoline";
     let postData = build_postData(substance, state_props, units);
-    ajax_route(requestroute, postData, callback, ignore_err)
+    ajax_route(requestroute, postData, callback, ignore_err, options)
+}
+
+
+/**
+ * Acquire a family of isolines from PYroMat API, one line at a time.
+ *
+ * The request is identical to ajax_isoline(), but it is sent to the streaming
+ * route, which responds with Server-Sent Events. Each line is handed to
+ * line_callback as soon as the server has computed it, so lines can be drawn
+ * before the whole family is finished.
+ *
+ * line_callback receives a dict with fields:
+ *  - index (position of the line in the family)
+ *  - value (the constant property value of the line)
+ *  - data (arrays of state data by property, as in ajax_isoline)
+ *
+ * done_callback receives the summary, which has the same fields as the
+ * response from ajax_isoline(), except that data contains
+ *  - prop (the constant property)
+ *  - count (the number of lines sent)
+ *  - skipped (array of values for lines that could not be computed)
+ * If the stream can't be read (e.g. a network failure or a proxy error), the
+ * summary is an error, so errors are always handled as in ajax_route().
+ *
+ * @param substance - str, the substance id (e.g. mp.H2O)
+ * @param state_props - dict of properties to send (e.g. {T:0, default:true}
+ * @param units - dict of the units to apply
+ * @param line_callback - function to be called for each line. Must accept
+ *  argument as line_callback(line).
+ * @param done_callback - function to be called with the summary message.
+ *  Must accept argument as done_callback(response).
+ * @param ignore_err - bool, if true, errors are ignored to be handled by the
+ *  done_callback.
+ * @param options - dict of request options. Only typed is used, see
+ *  ajax_route().
+ */
+function ajax_isoline_stream(substance, state_props=null, units=null, line_callback=null, done_callback=null, ignore_err=false, options=null){
+    let requestroute = "/api/isoline/stream";
+    let postData = build_postData(substance, state_props, units);
+    let key = cache_key(requestroute, postData);
+    let typed = use_worker(options);
+
+    // Hand a single event to the callbacks
+    let handle_event = (event, payload) => {
+        if (event === "line") {
+            if (line_callback) {
+                line_callback(payload);
+            }
+        } else if (event === "summary") {
+            if (payload.message.error && !ignore_err) {
+                handle_error(payload);
+            } else if (done_callback) {
+                done_callback(payload);
+            }
+        }
+    };
+
+    // The events received so far, as [event, data] pairs. The family is
+    // cached once its summary has arrived without an error.
+    let events = [];
+    let summarized = false;
+    let receive = (event, data, payload) => {
+        events.push([event, data]);
+        if (event === "summary") {
+            summarized = true;
+            if (!payload.message.error) {
+                cache_put(key, JSON.stringify(events));
+            }
+        }
+        handle_event(event, payload);
+    };
+
+    // Replies that weren't streamed (e.g. a JSON refusal or a proxy error),
+    // network failures, and streams cut off before their summary, are
+    // passed to the callbacks as an error summary.
+    let fail = (response, reason) => {
+        if (summarized) {
+            return;
+        }
+        summarized = true;
+        if (!response || !response.message) {
+            response = {args: postData, data: {}, units: units, message: {
+                error: true, warn: false,
+                message: "ERROR: Failed to load the isolines: " + reason + "\n"}};
+        }
+        handle_event("summary", response);
+    };
+
+    cache_get(key).then((entry) => {
+        // A cached family is replayed event by event. Streams have no ETag,
+        // so stale families are fetched again.
+        if (cache_fresh(entry)) {
+            if (typed) {
+                worker_call({events: JSON.parse(entry.body)}).then((reply) => {
+                    reply.events.forEach(([event, payload]) => handle_event(event, payload));
+                });
+            } else {
+                JSON.parse(entry.body).forEach(([event, data]) => handle_event(event, JSON.parse(data)));
+            }
+        } else if (typed) {
+            worker_call({
+                url: requestroute,
+                body: JSON.stringify(postData),
+                headers: {'Content-Type': 'application/json; charset=utf-8'}
+            }, (reply) => receive(reply.event, reply.data, reply.payload)).then((reply) => {
+                fail(reply.response, reply.error || "HTTP " + reply.status);
+            });
+        } else {
+            fetch_isoline_stream(requestroute, postData, receive, fail);
+        }
+    });
+}
+
+
+/**
+ * Perform the streaming request for ajax_isoline_stream()
+ *
+ * The events are passed to receive(event, data, payload) as they arrive,
+ * where data is the raw text of the event and payload is data parsed.
+ * Requests that the server refuses (e.g. 413 too large or 429 busy) or that
+ * have bad arguments are answered with JSON instead of a stream. Replies
+ * that aren't a stream are passed to fail(response, reason), with the PMGI
+ * response if they are JSON or null, and so are network failures. fail() is called again once the stream has ended, and ignores
+ * the call if the summary has been received.
+ * @param route - the string for the requestroute
+ * @param postData - dict, the data to send with the POST request
+ * @param receive - function handle, must accept receive(event, data, payload)
+ * @param fail - function handle, must accept fail(response, reason)
+ */
+function fetch_isoline_stream(route, postData, receive, fail){
+    fetch(route, {
+        method: "POST",
+        body: JSON.stringify(postData),
+        headers: {'Content-Type': 'application/json; charset=utf-8'}
+    }).then((response) => {
+        let type = response.headers.get("Content-Type") || "";
+        let reason = ("HTTP " + response.status + " " + response.statusText).trim();
+        if (!type.startsWith("text/event-stream")) {
+            return response.json().catch(() => null).then((payload) => fail(payload, reason));
+        } else if (!response.body) {
+            return fail(null, reason);
+        }
+        let reader = response.body.getReader();
+        let decoder = new TextDecoder();
+        let buffer = "";
+
+        // Dispatch a single complete event block
+        let dispatch = (block) => {
+            let event = "message";
+            let data = "";
+            block.split("\n").forEach((line) => {
+                if (line.startsWith("event:")) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith("data:")) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (data === "") {
+                return;
+            }
+            receive(event, data, JSON.parse(data));
+        };
+
+        // Events are separated by blank lines. Keep any partial event in
+        // the buffer until the rest of it arrives.
+        let pump = () => reader.read().then(({done, value}) => {
+            if (done) {
+                if (buffer.trim() !== "") {
+                    dispatch(buffer);
+                }
+                return;
+            }
+            buffer += decoder.decode(value, {stream: true});
+            let blocks = buffer.split("\n\n");
+            buffer = blocks.pop();
+            blocks.forEach(dispatch);
+            return pump();
+        });
+        return pump().then(() => fail(null, "the stream ended early (" + reason + ")"));
+    }).catch((err) => {
+        fail(null, String(err));
+    });
 }
 
 
@@ -132,46 +365,609 @@ function ajax_isoline(substance, state_props=null, units=null, callback=null, ig
  *  argument as callback(response).
  * @param ignore_err - bool, if true, errors are ignored to be handled by the
  *  callback.
+ * @param options - dict of request options, see ajax_route()
  */
-function ajax_saturation(substance, state_props=null, units=null, callback=null, ignore_err=false){
+function ajax_saturation(substance, state_props=null, units=null, callback=null, ignore_err=false, options=null){
     let requestroute = "/api/saturation";
     let postData = build_postData(substance, state_props, units);
-    ajax_route(requestroute, postData, callback, ignore_err)
+    ajax_route(requestroute, postData, callback, ignore_err, options)
+}
+
+
+/**
+ * Acquire property data on a 2D grid of states from PYroMat API.
+ *
+ * Fields in response are:
+ *  - args (copy of args passed to request)
+ *  - data (2D arrays of state data by property, rows are y, columns are x)
+ *    - T (array of arrays of T)
+ *    - ...
+ *    - xvals (array of x axis values)
+ *    - yvals (array of y axis values)
+ *  - message (related to erros)
+ *  - units (active units)
+ *  - valid (array of arrays of booleans, false for states that were out of
+ *    bounds and were not evaluated, as in ajax_point(). Their data are nan.)
+ *
+ * @param substance - str, the substance id (e.g. mp.H2O)
+ * @param grid_props - dict defining the axes, (e.g. {x:'T', y:'p',
+ *  xrange:[300,600,31], yvals:[1,10,100]}). Ranges are start,stop,n and may
+ *  be given xscale:'log' or yscale:'log'.
+ * @param units - dict of the units to apply
+ * @param callback - function to be called upon completion. Must accept
+ *  argument as callback(response).
+ * @param ignore_err - bool, if true, errors are ignored to be handled by the
+ *  callback.
+ * @param options - dict of request options, see ajax_route()
+ */
+function ajax_grid(substance, grid_props=null, units=null, callback=null, ignore_err=false, options=null){
+    let requestroute = "/api/grid";
+    let postData = build_postData(substance, grid_props, units);
+    ajax_route(requestroute, postData, callback, ignore_err, options)
+}
+
+
+/**
+ * Acquire a tile of the isolines of a property diagram from PYroMat API.
+ *
+ * At zoom level L, the diagram is split into 2^L by 2^L tiles, and the lines
+ * on each tile have 2^L times as many points as at level 0. Coordinates of
+ * the extent and window are in axis coordinates (log10 of the values on a
+ * log axis), like the range of a Plotly axis.
+ *
+ * Fields in response are:
+ *  - args (copy of args passed to request)
+ *  - data
+ *    - extent ([x0, x1, y0, y1] of the whole diagram)
+ *    - window ([x0, x1, y0, y1] of this tile)
+ *    - lines (dict keyed by family, 'p', 'T', ..., or 'steamdome', of dicts
+ *      with arrays x, y and value, with a NaN between the pieces of lines)
+ *    - level, i, j (the tile), levels (the number of zoom levels)
+ *  - message (related to erros)
+ *  - units (active units)
+ *
+ * @param substance - str, the substance id (e.g. mp.H2O)
+ * @param tile_props - dict defining the tile, (e.g. {x:'s', y:'T',
+ *  level:2, i:1, j:3}). Axes may be given xscale:'log' or yscale:'log'.
+ * @param units - dict of the units to apply
+ * @param callback - function to be called upon completion. Must accept
+ *  argument as callback(response).
+ * @param ignore_err - bool, if true, errors are ignored to be handled by the
+ *  callback.
+ * @param options - dict of request options, see ajax_route()
+ */
+function ajax_tile(substance, tile_props=null, units=null, callback=null, ignore_err=false, options=null){
+    let requestroute = "/api/tiles";
+    let postData = build_postData(substance, tile_props, units);
+    ajax_route(requestroute, postData, callback, ignore_err, options)
+}
+
+
+/**
+ * Solve a thermodynamic cycle with PYroMat API, in one request.
+ *
+ * Each state is given by two properties (e.g. {p:0.1, x:0}), or by a process
+ * from an earlier state (the previous one, if from is not given) and one
+ * more property (e.g. {from:0, process:'isentropic', p:100,
+ * efficiency:0.85}). Processes are 'isentropic', 'isobaric', 'isothermal'
+ * and 'throttling'. Any value may be an array, to sweep the cycle over it.
+ *
+ * Fields in response are:
+ *  - args (copy of args passed to request)
+ *  - data
+ *    - states (array of dicts of state data by property)
+ *    - processes (array of dicts with process, from, to, q and w)
+ *    - w_net, q_in, q_out, eta (net work, heat in and out, efficiency)
+ *  - message (related to erros)
+ *  - units (active units)
+ *
+ * @param substance - str, the substance id (e.g. mp.H2O)
+ * @param cycle_props - dict with the states array, and optionally close:true
+ *  (to return from the last state to the first by heat exchange) and props
+ * @param units - dict of the units to apply
+ * @param callback - function to be called upon completion. Must accept
+ *  argument as callback(response).
+ * @param ignore_err - bool, if true, errors are ignored to be handled by the
+ *  callback.
+ * @param options - dict of request options, see ajax_route()
+ */
+function ajax_cycle(substance, cycle_props=null, units=null, callback=null, ignore_err=false, options=null){
+    let requestroute = "/api/cycle";
+    let postData = build_postData(substance, cycle_props, units);
+    ajax_route(requestroute, postData, callback, ignore_err, options)
+}
+
+
+/**
+ * Convert state data from one set of units to another, in place, so that
+ * data that were already loaded don't have to be requested again.
+ *
+ * The conversion factors come from the conversions section of the /info
+ * response, so the results are the same as a request in the new units.
+ * Properties without units (x, gam) and other keys (e.g. ptid) are left
+ * alone, as are values that aren't numbers (e.g. "nan").
+ *
+ * @param data - dict keyed by property of numbers, Arrays (which may be
+ *  nested) or Float64Arrays
+ * @param from_units - dict of the units of data, keyed by unit category
+ * @param to_units - dict of the new units, keyed by unit category
+ * @param conversions - the conversions section of the /info response
+ * @param mw - the molecular weight of the substance in kg/kmol, to convert
+ *  between mass and molar units of matter
+ * @returns data
+ */
+function convert_units(data, from_units, to_units, conversions, mw){
+    Object.keys(data).forEach((prop) => {
+        let dims = conversions.dimensions[prop];
+        if (!dims) {
+            return;
+        }
+        let factor = 1;
+        Object.keys(dims).forEach((unit_class) => {
+            let ratio = unit_scale(unit_class, to_units[unit_class], conversions, mw) /
+                unit_scale(unit_class, from_units[unit_class], conversions, mw);
+            factor *= Math.pow(ratio, dims[unit_class]);
+        });
+        // Only absolute temperatures have an offset
+        let offset_from = 0;
+        let offset_to = 0;
+        if (prop === 'T') {
+            offset_from = conversions.offset.temperature[from_units.temperature];
+            offset_to = conversions.offset.temperature[to_units.temperature];
+        }
+        let convert = (value) => (value - offset_from) * factor + offset_to;
+        data[prop] = convert_values(data[prop], convert);
+    });
+    return data;
+}
+
+
+/**
+ * Return the factor of a unit in its category, see convert_units()
+ */
+function unit_scale(unit_class, unit, conversions, mw){
+    if (unit_class === 'matter') {
+        if (unit in conversions.scale.mass) {
+            return conversions.scale.mass[unit];
+        }
+        // kmol per kg of the reference
+        return conversions.scale.molar[unit] / mw;
+    }
+    return conversions.scale[unit_class][unit];
+}
+
+
+/**
+ * Apply a conversion to a value, or to every value in an array, in place
+ */
+function convert_values(value, convert){
+    if (typeof value === "number") {
+        return convert(value);
+    } else if (ArrayBuffer.isView(value)) {
+        for (let i = 0; i < value.length; i++) {
+            value[i] = convert(value[i]);
+        }
+    } else if (Array.isArray(value)) {
+        value.forEach((item, i) => {
+            value[i] = convert_values(item, convert);
+        });
+    }
+    return value;
 }
 
 
 /**
  * Perform the actual ajax call for pyromat routines
+ *
+ * Responses are answered from the response cache when possible. Cached
+ * responses older than CACHE_REVALIDATE_AGE are revalidated with the server
+ * by their ETag. A request identical to one that is already in flight waits
+ * for that one's response instead of being sent again.
+ *
+ * Options are
+ *  - channel (str, a request on a channel supersedes the earlier requests on
+ *    the same channel: their callbacks are never called, and they are aborted
+ *    if nothing else is waiting for them)
+ *  - delay (ms, wait until there have been no new requests on the channel for
+ *    this long before sending, so a burst of requests only sends the last)
+ *  - typed (bool, fetch and decode the response in a Web Worker, see
+ *    pmgi_worker.js, so that the page doesn't freeze on large responses. The
+ *    numeric arrays of the response are Float64Array, with NaN and Infinity
+ *    in place of the "nan" and "inf" strings. Where Web Workers are not
+ *    available, the response is plain JSON.)
+ *
+ * Usage example, for a plot that is redrawn while the user types:
+ * ajax_isoline('mp.H2O', {T: value}, null, draw, false,
+ *     {channel: 'preview', delay: 200});
+ *
  * @param route - the string for the requestroute
  * @param postData - dict, the data to send with the POST request
  * @param callback - function handle, must accept argument of callback(response)
  * @param ignore_err - bool, suppress default error handling. Set true to handle
  *  errors within callback.
+ * @param options - dict of request options, or null
+ */
+function ajax_route(route, postData, callback, ignore_err=false, options=null){
+    let waiter = {callback: callback, ignore_err: ignore_err, cancelled: false,
+                  channel: null, flight: null};
+    let delay = 0;
+    if (options && options.channel) {
+        waiter.channel = options.channel;
+        delay = options.delay || 0;
+        supersede(options.channel);
+        request_channels[options.channel] = {waiter: waiter, timer: null};
+    }
+
+    let typed = use_worker(options);
+    let start = () => {
+        let key = cache_key(route, postData);
+        // Typed responses are cached as they arrived, which may be binary
+        if (typed && key !== null) {
+            key += " typed";
+        }
+        cache_get(key).then((entry) => {
+            // Only responses without errors are cached
+            if (cache_fresh(entry) && typed) {
+                worker_call({data: entry.body}).then((reply) => deliver(waiter, reply.response));
+            } else if (cache_fresh(entry)) {
+                deliver(waiter, JSON.parse(entry.body));
+            } else if (typed) {
+                send_typed_route(route, postData, waiter, key, entry);
+            } else {
+                send_route(route, postData, waiter, key, entry);
+            }
+        });
+    };
+    if (delay > 0) {
+        request_channels[waiter.channel].timer = setTimeout(start, delay);
+    } else {
+        start();
+    }
+}
+
+
+// The requests in flight, by route and arguments
+let requests_in_flight = {};
+// The latest request on each channel, see ajax_route()
+let request_channels = {};
+
+
+/**
+ * Send a request for ajax_route() to the server, or join the identical
+ * request in flight
+ * @param route - the string for the requestroute
+ * @param postData - dict, the data to send with the POST request
+ * @param waiter - dict, the callback, ignore_err and channel of the request
+ * @param key - str, the cache key, or null to skip caching
+ * @param entry - the stale cache entry to revalidate, or null
  */
-function ajax_route(route, postData, callback, ignore_err=false){
+function send_route(route, postData, waiter, key, entry){
     let requestroute = route;
+    let flight = join_flight(route + " " + canonical_json(postData), waiter);
+    if (flight === null) {
+        return;
+    }
+    let finish = (response, text) => land_flight(flight, response, () => JSON.parse(text));
 
-    $.ajax({
+    flight.xhr = $.ajax({
         url: requestroute,
         type: "POST",
         data: JSON.stringify(postData),
         dataType: "json",
         contentType: 'application/json; charset=utf-8',
-        success: (response) => {
-            // Pass errors
-            if (response.message.error && !ignore_err) {
-                handle_error(response);
-            } else {
-                // Send data to callback
-                if (callback) {
-                    callback(response);
-                }
+        headers: (entry && entry.etag) ? {'If-None-Match': entry.etag} : {},
+        success: (response, status, xhr) => {
+            if (xhr.status === 304) {
+                // Not modified, so the cached copy is good for another while
+                cache_put(key, entry.body, entry.etag);
+                finish(JSON.parse(entry.body), entry.body);
+                return;
+            }
+            if (!response.message.error) {
+                cache_put(key, xhr.responseText, xhr.getResponseHeader("ETag"));
             }
+            finish(response, xhr.responseText);
+        },
+        error: (xhr) => {
+            // Requests refused by the server (e.g. 413 too large or 429
+            // busy) still carry a PMGI message. Aborted requests don't.
+            let response = xhr.responseJSON;
+            if (!response || !response.message) {
+                response = null;
+            }
+            finish(response, xhr.responseText);
         },
     });
 }
 
 
+/**
+ * Send a typed request for ajax_route() through the worker, or join the
+ * identical request in flight
+ * @param route - the string for the requestroute
+ * @param postData - dict, the data to send with the POST request
+ * @param waiter - dict, the callback, ignore_err and channel of the request
+ * @param key - str, the cache key, or null to skip caching
+ * @param entry - the stale cache entry to revalidate, or null
+ */
+function send_typed_route(route, postData, waiter, key, entry){
+    let flight = join_flight("typed " + route + " " + canonical_json(postData), waiter);
+    if (flight === null) {
+        return;
+    }
+
+    let headers = {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Accept': BINARY_RESPONSE + ', application/json;q=0.9'
+    };
+    if (entry && entry.etag) {
+        headers['If-None-Match'] = entry.etag;
+    }
+    let msg = {url: route, body: JSON.stringify(postData), headers: headers};
+    worker_call(msg).then((reply) => {
+        if (reply.status === 304) {
+            // Not modified, so the cached copy is good for another while
+            cache_put(key, entry.body, entry.etag);
+            return worker_call({data: entry.body}).then((decoded) => decoded.response);
+        }
+        // Aborted and failed requests have no PMGI response
+        let response = reply.response;
+        if (!response || !response.message) {
+            return null;
+        }
+        if (reply.status === 200 && !response.message.error) {
+            cache_put(key, reply.body, reply.etag);
+        }
+        return response;
+    }).then((response) => {
+        land_flight(flight, response, () => structuredClone(response));
+    });
+    flight.xhr = {abort: () => pmgi_worker.postMessage({abort: msg.id})};
+}
+
+
+/**
+ * Join the identical request in flight, or start a new one
+ * @param id - str, identifies the request by its route and arguments
+ * @param waiter - dict, the callback, ignore_err and channel of the request
+ * @returns the new flight, or null if the waiter joined one already in flight
+ */
+function join_flight(id, waiter){
+    let flight = requests_in_flight[id];
+    if (flight) {
+        flight.waiters.push(waiter);
+        waiter.flight = flight;
+        return null;
+    }
+    flight = requests_in_flight[id] = {id: id, waiters: [waiter], xhr: null};
+    waiter.flight = flight;
+    return flight;
+}
+
+
+/**
+ * Hand the response to a request in flight to everybody waiting for it
+ *
+ * Every waiter but the first gets its own copy of the response, because
+ * callbacks are free to change it.
+ * @param flight - the flight from join_flight()
+ * @param response - the PMGI response, or null if there was none (e.g. the
+ *  request was aborted)
+ * @param copy - function handle returning a new copy of the response
+ */
+function land_flight(flight, response, copy){
+    if (requests_in_flight[flight.id] === flight) {
+        delete requests_in_flight[flight.id];
+    }
+    if (response === null) {
+        return;
+    }
+    flight.waiters.forEach((w, i) => deliver(w, i === 0 ? response : copy()));
+}
+
+
+// The MIME type of binary PMGI responses
+const BINARY_RESPONSE = "application/x-pmgi";
+// The script of the decoding worker
+const PMGI_WORKER = "pmgi_worker.js";
+// The decoding worker, started on first use
+let pmgi_worker = null;
+// The replies the worker still owes, by message id
+let worker_jobs = {};
+let worker_next_id = 0;
+
+
+/**
+ * Test whether a request should be decoded by the worker
+ * @param options - dict of request options, see ajax_route(), or null
+ * @returns bool
+ */
+function use_worker(options){
+    return Boolean(options && options.typed) && typeof Worker !== "undefined";
+}
+
+
+/**
+ * Send a message to the decoding worker, see pmgi_worker.js for the messages
+ * @param msg - dict, the message. Its id is assigned here.
+ * @param on_event - function handle, called with each reply for the events
+ *  of a streamed response, or null
+ * @returns Promise of the worker's final reply
+ */
+function worker_call(msg, on_event=null){
+    if (pmgi_worker === null) {
+        pmgi_worker = new Worker(PMGI_WORKER);
+        pmgi_worker.onmessage = (event) => {
+            let reply = event.data;
+            let job = worker_jobs[reply.id];
+            if (!job) {
+                return;
+            }
+            if (!reply.done) {
+                if (job.on_event) {
+                    job.on_event(reply);
+                }
+                return;
+            }
+            delete worker_jobs[reply.id];
+            job.resolve(reply);
+        };
+    }
+    msg.id = worker_next_id++;
+    return new Promise((resolve) => {
+        worker_jobs[msg.id] = {resolve: resolve, on_event: on_event};
+        pmgi_worker.postMessage(msg);
+    });
+}
+
+
+/**
+ * Hand a response to the caller that is waiting for it
+ * @param waiter - dict, the callback, ignore_err and channel of the request
+ * @param response - the PMGI response
+ */
+function deliver(waiter, response){
+    if (waiter.cancelled) {
+        return;
+    }
+    let latest = request_channels[waiter.channel];
+    if (latest && latest.waiter === waiter) {
+        delete request_channels[waiter.channel];
+    }
+    // Pass errors
+    if (response.message.error && !waiter.ignore_err) {
+        handle_error(response);
+    } else if (waiter.callback) {
+        // Send data to callback
+        waiter.callback(response);
+    }
+}
+
+
+/**
+ * Cancel the latest request on a channel, if it hasn't been answered yet
+ * @param channel - str, the channel name
+ */
+function supersede(channel){
+    let latest = request_channels[channel];
+    if (!latest) {
+        return;
+    }
+    delete request_channels[channel];
+    clearTimeout(latest.timer);
+    latest.waiter.cancelled = true;
+
+    // Abort the request, unless somebody else is waiting for it
+    let flight = latest.waiter.flight;
+    if (flight && flight.xhr && flight.waiters.every((w) => w.cancelled)) {
+        flight.xhr.abort();
+    }
+}
+
+
+// Single points requested within this many ms of each other are batched
+const POINT_BATCH_DELAY = 10;
+// A batch is sent as soon as it has this many points
+const POINT_BATCH_MAX = 256;
+// The batches waiting to be sent, by substance, units and input properties
+let point_batches = {};
+
+
+/**
+ * Add a point request to a batch, see ajax_point()
+ * @returns bool, false if the request can't be batched, because it is not
+ *  for a single point.
+ */
+function batch_point(substance, state_props, units, callback, ignore_err){
+    let props = Object.assign({}, state_props);
+    let names = Object.keys(props).sort();
+    let single = (value) => typeof value === "number" ||
+        (typeof value === "string" && value.trim() !== "" && isFinite(Number(value)));
+    if (names.length === 0 || !names.every((name) => single(props[name]))) {
+        return false;
+    }
+
+    let group = canonical_json([substance, units, names]);
+    let batch = point_batches[group];
+    if (!batch) {
+        batch = point_batches[group] = {
+            substance: substance, units: units, names: names, points: [],
+            timer: setTimeout(() => send_point_batch(group), POINT_BATCH_DELAY)
+        };
+    }
+    batch.points.push({props: props, callback: callback, ignore_err: ignore_err});
+    if (batch.points.length >= POINT_BATCH_MAX) {
+        send_point_batch(group);
+    }
+    return true;
+}
+
+
+/**
+ * Send a batch of points as one request, and split the response back out to
+ * the callers
+ * @param group - str, the key of the batch in point_batches
+ */
+function send_point_batch(group){
+    let batch = point_batches[group];
+    delete point_batches[group];
+    clearTimeout(batch.timer);
+
+    let send_alone = (point) => {
+        let postData = build_postData(batch.substance, point.props, batch.units);
+        ajax_route("/api/state", postData, point.callback, point.ignore_err);
+    };
+    if (batch.points.length === 1) {
+        send_alone(batch.points[0]);
+        return;
+    }
+
+    let count = batch.points.length;
+    let state_props = {};
+    batch.names.forEach((name) => {
+        state_props[name] = batch.points.map((point) => Number(point.props[name]));
+    });
+    let postData = build_postData(batch.substance, state_props, batch.units);
+    ajax_route("/api/state", postData, (response) => {
+        // An error here applies to every point (e.g. all out of range), so
+        // report it once
+        if (response.message.error) {
+            if (batch.points.some((point) => !point.ignore_err)) {
+                handle_error(response);
+            }
+            batch.points.forEach((point) => {
+                if (point.ignore_err && point.callback) {
+                    point.callback(response);
+                }
+            });
+            return;
+        }
+        // Pick out one point from the arrays
+        let pick = (dict, index) => {
+            let out = {};
+            Object.keys(dict).forEach((k) => {
+                let value = dict[k];
+                out[k] = (Array.isArray(value) && value.length === count) ? value[index] : value;
+            });
+            return out;
+        };
+        batch.points.forEach((point, index) => {
+            let data = pick(response.data, index);
+            // Points that fail in a batch come back as nan (and not valid,
+            // if they were out of bounds), without the error message they
+            // would get on their own
+            let invalid = response.valid && !response.valid[index];
+            if (invalid || typeof data[batch.names[0]] !== "number") {
+                send_alone(point);
+            } else if (point.callback) {
+                point.callback(Object.assign({}, response,
+                    {args: pick(response.args, index), data: data}));
+            }
+        });
+    }, true);
+}
+
+
 /**
  * Simplify construction of the postData dict for basic arguments
  *
@@ -183,6 +979,15 @@ function ajax_route(route, postData, callback, ignore_err=false){
 function build_postData(substance, state_props=null, units=null){
     let postData = Object.assign({}, state_props); // clone prop dict
 
+    // Long numeric arrays are packed so the server doesn't parse text
+    Object.keys(postData).forEach((key) => {
+        let value = postData[key];
+        if ((Array.isArray(value) || value instanceof Float64Array) &&
+            value.length >= PACK_THRESHOLD) {
+            postData[key] = pack_array(value);
+        }
+    });
+
     // append substance and units (if applicable) to the postdata
     postData.id = substance;
     if(units){
@@ -192,6 +997,264 @@ function build_postData(substance, state_props=null, units=null){
 }
 
 
+// Arrays at least this long are sent packed by build_postData
+const PACK_THRESHOLD = 64;
+
+/**
+ * Pack an array of numbers for sending to the PYroMat API
+ *
+ * The values are encoded as little-endian float64 and then base64, which the
+ * server decodes without any text parsing.
+ * @param values - Array or Float64Array of numbers
+ * @returns dict of the form {base64: "..."}
+ */
+function pack_array(values){
+    let data = Float64Array.from(values);
+    let view = new DataView(data.buffer);
+    // Typed arrays use the platform byte order, so write explicitly
+    for (let i = 0; i < data.length; i++){
+        view.setFloat64(i * 8, data[i], true);
+    }
+    let bytes = new Uint8Array(data.buffer);
+    let binary = "";
+    const chunk = 0x8000;
+    for (let i = 0; i < bytes.length; i += chunk){
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + chunk));
+    }
+    return {base64: btoa(binary)};
+}
+
+
+// **********************************************************
+// *  Response cache
+// **********************************************************
+//
+// Responses without errors are kept in IndexedDB, keyed by the route, the
+// request arguments (in a canonical order) and the versions reported by
+// ajax_info(). The server's results only depend on those, so cached
+// responses are used without asking the server until they are
+// CACHE_REVALIDATE_AGE old, and are then revalidated by their ETag. Once the
+// cache holds more than CACHE_MAX_SIZE (characters of JSON and bytes of binary
+// responses), the least recently used responses are evicted. If IndexedDB is
+// not available, nothing is cached.
+
+const CACHE_DB_NAME = "pmgi_cache";
+const CACHE_MAX_SIZE = 32 * 1024 * 1024;
+const CACHE_REVALIDATE_AGE = 7 * 24 * 3600 * 1000;
+const CACHE_INFO_KEY = "info";
+
+// The server versions, set by ajax_info(). Nothing is cached until then.
+let cache_versions = null;
+// Promise of the database, opened on first use
+let cache_db = null;
+
+
+/**
+ * Open the response cache database
+ * @returns Promise of the IDBDatabase, or of null if it can't be opened
+ */
+function cache_open(){
+    if (cache_db === null) {
+        cache_db = new Promise((resolve) => {
+            let request;
+            try {
+                request = window.indexedDB.open(CACHE_DB_NAME, 1);
+            } catch (e) {
+                resolve(null);
+                return;
+            }
+            request.onupgradeneeded = () => {
+                // The bodies are kept apart from the small records that are
+                // read to find the least recently used responses
+                request.result.createObjectStore("responses", {keyPath: "key"});
+                request.result.createObjectStore("entries", {keyPath: "key"});
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => resolve(null);
+            request.onblocked = () => resolve(null);
+        });
+    }
+    return cache_db;
+}
+
+
+/**
+ * Run a read/write transaction on both cache stores
+ * @param work - function handle, called as work(entries, responses) with the
+ *  two object stores.
+ * @returns Promise resolving to true when the transaction has completed, or
+ *  to false if it failed or the cache is not available.
+ */
+function cache_transaction(work){
+    return cache_open().then((db) => new Promise((resolve) => {
+        if (db === null) {
+            resolve(false);
+            return;
+        }
+        let tx;
+        try {
+            tx = db.transaction(["entries", "responses"], "readwrite");
+            work(tx.objectStore("entries"), tx.objectStore("responses"));
+        } catch (e) {
+            resolve(false);
+            return;
+        }
+        tx.oncomplete = () => resolve(true);
+        tx.onerror = () => resolve(false);
+        tx.onabort = () => resolve(false);
+    }));
+}
+
+
+/**
+ * Build the cache key for a request
+ * @param route - the string for the requestroute
+ * @param postData - dict, the data sent with the request
+ * @returns str, or null if the server versions are not known yet
+ */
+function cache_key(route, postData){
+    if (cache_versions === null) {
+        return null;
+    }
+    return route + " " + canonical_json(postData) + " " + cache_versions;
+}
+
+
+/**
+ * Like JSON.stringify(), but with the keys of every dict sorted, so equal
+ * requests give equal strings
+ * @param value - the value to convert
+ * @returns str
+ */
+function canonical_json(value){
+    if (Array.isArray(value) || value instanceof Float64Array) {
+        return "[" + Array.from(value, canonical_json).join(",") + "]";
+    }
+    if (value !== null && typeof value === "object") {
+        return "{" + Object.keys(value).sort().map((key) =>
+            JSON.stringify(key) + ":" + canonical_json(value[key])).join(",") + "}";
+    }
+    return JSON.stringify(value);
+}
+
+
+/**
+ * Look up a response in the cache, and mark it as recently used
+ * @param key - str, the cache key (from cache_key), or null
+ * @returns Promise of the entry, with fields
+ *  - body (the response body, str or ArrayBuffer)
+ *  - etag (the ETag the server sent with it, or null)
+ *  - stored (when it was last received or revalidated, in ms)
+ *  or of null if it is not cached.
+ */
+function cache_get(key){
+    if (key === null) {
+        return Promise.resolve(null);
+    }
+    let entry = null;
+    let body = null;
+    return cache_transaction((entries, responses) => {
+        entries.get(key).onsuccess = (event) => {
+            entry = event.target.result || null;
+            if (entry) {
+                entry.used = Date.now();
+                entries.put(entry);
+            }
+        };
+        responses.get(key).onsuccess = (event) => {
+            let record = event.target.result;
+            body = record ? record.body : null;
+        };
+    }).then((ok) => {
+        if (!ok || entry === null || body === null) {
+            return null;
+        }
+        entry.body = body;
+        return entry;
+    });
+}
+
+
+/**
+ * Test whether a cache entry may be used without asking the server
+ * @param entry - the entry from cache_get(), or null
+ * @returns bool
+ */
+function cache_fresh(entry){
+    return entry !== null && Date.now() - entry.stored < CACHE_REVALIDATE_AGE;
+}
+
+
+/**
+ * Store a response in the cache, and evict the least recently used responses
+ * if the cache has grown too large
+ * @param key - str, the cache key (from cache_key), or null to do nothing
+ * @param body - str or ArrayBuffer, the response body
+ * @param etag - str, the ETag the server sent with it, or null
+ * @returns Promise resolving when done
+ */
+function cache_put(key, body, etag=null){
+    if (key === null) {
+        return Promise.resolve();
+    }
+    let now = Date.now();
+    let size = typeof body === "string" ? body.length : body.byteLength;
+    return cache_transaction((entries, responses) => {
+        responses.put({key: key, body: body});
+        entries.put({key: key, etag: etag, size: size, stored: now, used: now});
+    }).then(() => cache_transaction((entries, responses) => {
+        entries.getAll().onsuccess = (event) => {
+            let all = event.target.result;
+            let total = all.reduce((sum, entry) => sum + entry.size, 0);
+            all.sort((a, b) => a.used - b.used);
+            for (let i = 0; i < all.length && total > CACHE_MAX_SIZE; i++) {
+                entries.delete(all[i].key);
+                responses.delete(all[i].key);
+                total -= all[i].size;
+            }
+        };
+    }));
+}
+
+
+/**
+ * Remove every response from the cache
+ * @returns Promise resolving when done
+ */
+function cache_clear(){
+    return cache_transaction((entries, responses) => {
+        entries.clear();
+        responses.clear();
+    });
+}
+
+
+/**
+ * Load an HTML fragment into an element, like jQuery's load()
+ *
+ * Built pages (see build_live.py) carry their fragments inline in
+ * <template data-fragment="name.html"> elements, which saves a round trip
+ * for each one. Otherwise, the fragment is fetched from the server.
+ * @param $target - jQuery element to fill with the fragment
+ * @param html - str, the fragment file name (e.g. unitspicker.html)
+ * @param callback - function to be called once the fragment is in place
+ */
+function load_fragment($target, html, callback=null){
+    let template = document.querySelector('template[data-fragment="' + html + '"]');
+    if (template === null) {
+        $target.load(html, callback);
+        return;
+    }
+    // Stay asynchronous, like load(), so callers see the same ordering
+    setTimeout(() => {
+        $target.html(template.innerHTML);
+        if (callback) {
+            callback();
+        }
+    }, 0);
+}
+
+
 /**
  * Basic error handling for PYroMat requests
  * @param data - JSON object reply from PYroMat API
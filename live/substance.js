@@ -4,18 +4,12 @@ var substancePicker
 $(function() {
 
 
-    // Check if the infodata has been created. If not, get it from ajax and reload
-    infodata = localStorage.getItem("infodata");
-    if (infodata === null){
-        ajax_info((data)=>{
-            localStorage.setItem("infodata", JSON.stringify(data));
-            infodata = data;
-            init();
-        });
-    } else {
-        infodata = JSON.parse(infodata);
+    // Get the infodata from ajax_info() in pyromat_ajax.js, which caches it
+    localStorage.removeItem("infodata");
+    ajax_info((data)=>{
+        infodata = data;
         init();
-    }
+    });
 });
 
 function init(){
@@ -32,12 +26,6 @@ function init(){
 
 }
 
-function ajax_info(callback){
-    $.get("/info",
-        callback,
-        'json');  // Data type of the response.
-}
-
 function ajax_subst(id, callback){
     $.get("/subst?id="+id,
         callback,
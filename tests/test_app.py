@@ -0,0 +1,922 @@
+"""Tests of the PMGI routes and the models behind them
+
+    python3 -m pytest tests
+
+The routes are called through the flask test client.  Errors are
+reported in the message of a 200 response, so every test checks that
+nothing raised (a 500) as well as the message.
+"""
+
+import base64
+import gzip
+import io
+import json
+import threading
+import time
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+import flask
+import numpy as np
+import pyromat as pm
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def default_units():
+    # PYroMat's units are global, and requests change them
+    for param in pm.config:
+        if param.startswith('unit_'):
+            pm.config.restore_default(param)
+    yield
+
+
+def get(client, route, **args):
+    response = client.post(route, json=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def assert_error(out, text):
+    assert out['message']['error']
+    assert text in out['message']['message']
+
+
+# ### Property selection
+
+@pytest.mark.parametrize('args', [
+    {'T': 300, 'p': 1, 'props': 'x'},
+    {'T': 300, 'p': 1, 'props': 'T,x'},
+    {'T': 300, 'p': 1, 'props': 'g'},
+    {'h': 300, 's': 7, 'props': 'T,x'}])
+def test_state_props_not_in_model(client, args):
+    out = get(client, '/state', id='ig.N2', **args)
+    assert_error(out, 'not supported by this substance model: ')
+
+
+def test_state_props(client):
+    out = get(client, '/state', id='ig.N2', T=300, p=1, props='T,h')
+    assert not out['message']['error']
+    assert sorted(out['data']) == ['T', 'h']
+    out = get(client, '/state', id='mp.H2O', T=300, p=1, props='x,h')
+    assert not out['message']['error']
+    assert sorted(out['data']) == ['h', 'x']
+
+
+def test_grid_props_not_in_model(client):
+    out = get(client, '/grid', id='ig.N2', x='T', y='p',
+              xrange=[300, 400, 3], yrange=[1, 2, 2], props='x')
+    assert_error(out, 'not supported by this substance model: x')
+
+
+def test_isoline_props_not_in_model(client):
+    out = get(client, '/isoline', id='ig.N2', T=300, props='x')
+    assert_error(out, 'not supported by this substance model: x')
+
+
+# ### Isoline streams
+
+def stream_events(response):
+    """Split a text/event-stream body into (event, payload) pairs"""
+    events = []
+    body = response.get_data(as_text=True)
+    # Like a WSGI server, which releases the scheduler slot
+    response.close()
+    for block in body.split('\n\n'):
+        lines = block.strip().split('\n')
+        if lines == ['']:
+            continue
+        name = lines[0][len('event:'):].strip()
+        data = ''.join(line[len('data:'):].strip() for line in lines[1:])
+        events.append((name, json.loads(data)))
+    return events
+
+
+def test_isoline_stream(client):
+    response = client.post('/isoline/stream', json={'id': 'mp.H2O',
+                                                    'T': [300, 400]})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = stream_events(response)
+    assert [name for name, _ in events] == ['line', 'line', 'summary']
+    assert [payload['value'] for _, payload in events[:2]] == [300, 400]
+    assert events[0][1]['data']['T'][0] == 300
+    summary = events[-1][1]
+    assert not summary['message']['error']
+    assert summary['data'] == {'prop': 'T', 'count': 2, 'skipped': [],
+                               'late': []}
+    # The scheduler slot is released once the stream is closed
+    assert app.scheduler.running == 0
+
+
+def test_isoline_stream_failed_line(client):
+    response = client.post('/isoline/stream', json={'id': 'mp.H2O',
+                                                    'T': [300, 5000, 400]})
+    events = stream_events(response)
+    assert [payload['value'] for name, payload in events
+            if name == 'line'] == [300, 400]
+    summary = events[-1][1]
+    assert summary['message']['warn']
+    assert summary['data']['skipped'] == [5000]
+
+
+@pytest.mark.parametrize('limit, status', [
+    ('COST_REQUEST_LIMIT', 413),
+    ('COST_WORKER_LIMIT', 429)])
+def test_isoline_stream_refused(client, monkeypatch, limit, status):
+    monkeypatch.setattr(app, limit, 1.)
+    response = client.post('/isoline/stream', json={'id': 'mp.H2O',
+                                                    'T': 300,
+                                                    'default': True})
+    assert response.status_code == status
+    assert response.mimetype == 'application/json'
+    assert response.get_json()['message']['error']
+
+
+def test_isoline_stream_bad_units(client):
+    response = client.post('/isoline/stream', json={
+        'id': 'mp.H2O', 'T': 300, 'units': {'temperature': 'zz'}})
+    assert response.mimetype == 'application/json'
+    assert_error(response.get_json(), 'unrecognized value: zz')
+
+
+# ### Admission
+
+def test_admission_too_large(client, monkeypatch):
+    monkeypatch.setattr(app, 'COST_REQUEST_LIMIT', 1e3)
+    response = client.post('/state', json={'id': 'mp.H2O',
+                                           'T': [300.] * 1000, 'p': 1})
+    assert response.status_code == 413
+    assert_error(response.get_json(), 'The request is too large')
+    # Small requests are still admitted
+    out = get(client, '/state', id='mp.H2O', T=300, p=1)
+    assert not out['message']['error']
+
+
+def test_admission_busy(client, monkeypatch):
+    monkeypatch.setattr(app, 'COST_WORKER_LIMIT', 1.)
+    response = client.post('/state', json={'id': 'mp.H2O', 'T': 300,
+                                           'p': 1})
+    assert response.status_code == 429
+    assert_error(response.get_json(), 'The server is busy')
+
+
+def test_admission_released(client):
+    get(client, '/state', id='mp.H2O', T=[300.] * 100, p=1)
+    # The cost of a request is returned to the worker when it is done
+    assert app._worker_cost == 0.
+
+
+# ### Scheduling
+
+def serve_order(scheduler, waiters):
+    """Acquire the scheduler's only slot, queue the waiters, then release
+
+waiters is a list of (lane, client) pairs, which are queued in order.
+Returns the order in which they were served.
+"""
+    assert scheduler.acquire('interactive', 'holder') is not None
+    order = []
+
+    def wait(lane, client):
+        scheduler.acquire(lane, client)
+        order.append((lane, client))
+        scheduler.release(lane)
+
+    threads = []
+    for lane, client in waiters:
+        thread = threading.Thread(target=wait, args=(lane, client))
+        thread.start()
+        threads.append(thread)
+        # Queue them one at a time, so the order is known
+        while sum(ll.waiting for ll in scheduler.lanes.values()) \
+                < len(threads):
+            time.sleep(0.001)
+    scheduler.release('interactive')
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_scheduler_priority():
+    scheduler = app.PMGIScheduler(app.LANES)
+    order = serve_order(scheduler, [('bulk', 'a'), ('plot', 'b'),
+                                    ('interactive', 'c')])
+    assert order == [('interactive', 'c'), ('plot', 'b'), ('bulk', 'a')]
+
+
+def test_scheduler_clients_take_turns():
+    scheduler = app.PMGIScheduler(app.LANES)
+    order = serve_order(scheduler, [('plot', 'a'), ('plot', 'a'),
+                                    ('plot', 'b')])
+    assert order == [('plot', 'a'), ('plot', 'b'), ('plot', 'a')]
+
+
+def test_scheduler_rejects():
+    lanes = {'interactive': dict(app.LANES['interactive'], depth=0),
+             'plot': dict(app.LANES['plot'], timeout=0.01)}
+    scheduler = app.PMGIScheduler(lanes)
+    # The lane is full
+    assert scheduler.acquire('interactive', 'a') is None
+    # The wait times out while the slot is held
+    assert scheduler.acquire('plot', 'a') is not None
+    assert scheduler.acquire('plot', 'b') is None
+    scheduler.release('plot')
+    report = scheduler.report()
+    assert report['interactive']['rejected'] == 1
+    assert report['plot']['rejected'] == 1
+    assert report['plot']['served'] == 1
+
+
+def test_scheduler_lanes():
+    with app.app.test_request_context('/state', method='POST', json={
+            'id': 'mp.H2O', 'T': 300, 'p': 1}):
+        assert app.PropertyRequest(flask.request).classify() == \
+            'interactive'
+    with app.app.test_request_context('/isoline', method='POST', json={
+            'id': 'mp.H2O', 'T': 300}):
+        assert app.IsolineRequest(flask.request).classify() == 'plot'
+    with app.app.test_request_context('/state', method='POST', json={
+            'id': 'mp.H2O', 'T': [300.] * 200000, 'p': 1}):
+        assert app.PropertyRequest(flask.request).classify() == 'bulk'
+
+
+# ### Argument schemas
+# The messages are those of the handlers before the schemas were compiled
+
+ABORTED = ('\nUnit processing aborted due to an error.'
+           '\nProcessing aborted due to error.\n')
+
+
+@pytest.mark.parametrize('route, args, message', [
+    ('/state', {'id': 'mp.H2O', 'T': 300, 'p': 1, 'q': 2},
+     'ERROR: Unrecognized argument: q'),
+    ('/state', {'id': 'mp.H2O', 'T': 'abc', 'p': 1},
+     'ERROR: Invalid argument: T=abc'),
+    ('/state', {'T': 300, 'p': 1},
+     'ERROR: Missing mandatory arguments: id'),
+    ('/state', {'id': 'mp.H2O', 'T': 300, 'p': 1,
+                'units': {'temperature': 'zz'}},
+     'ERROR: Unit (temperature) was set to unrecognized value: zz'),
+    ('/state', {'id': 'mp.H2O', 'T': 300, 'p': 1, 'units': {'bogus': 'K'}},
+     'ERROR: Unit not recognized: bogus'),
+    ('/state', {'id': 'mp.H2O', 'T': 300, 'p': 1, 'units': 'K'},
+     'ERROR: The units argument was not a dictionary.'),
+    ('/isoline', {'id': 'mp.H2O', 'T': '1,a'},
+     'ERROR: Invalid argument: T=1,a')])
+def test_schema_errors(client, route, args, message):
+    out = get(client, route, **args)
+    assert out['message']['message'] == message + ABORTED
+
+
+def test_schema_get(client):
+    response = client.get('/state?id=mp.H2O&T=300,400&p=1&uT=zz')
+    assert response.get_json()['message']['message'] == \
+        'ERROR: Unit (temperature) was set to unrecognized value: zz' + \
+        ABORTED
+    out = client.get('/state?id=mp.H2O&T=300,400&p=1&uT=C').get_json()
+    assert not out['message']['error']
+    assert out['units']['temperature'] == 'C'
+    assert out['data']['T'] == [300, 400]
+
+
+# ### Packed array input
+
+T_PACKED = np.array([300., 350., 400.])
+P_PACKED = np.array([1., 2., 5.])
+
+
+def assert_packed_state(out):
+    assert not out['message']['error'], out['message']
+    np.testing.assert_allclose(out['data']['T'], T_PACKED)
+    expected = pm.get('mp.H2O').h(T=T_PACKED.copy(), p=P_PACKED.copy())
+    np.testing.assert_allclose(out['data']['h'], expected)
+
+
+def test_input_base64(client):
+    out = get(client, '/state', id='mp.H2O', props='T,h',
+              T={'base64': base64.b64encode(T_PACKED.tobytes()).decode()},
+              p={'base64': base64.b64encode(P_PACKED.tobytes()).decode()})
+    assert_packed_state(out)
+
+
+def test_input_base64_dtype(client):
+    out = get(client, '/state', id='mp.H2O', p=1,
+              T={'base64': base64.b64encode(
+                  T_PACKED.astype('<f4').tobytes()).decode(),
+                 'dtype': '<f4'})
+    assert_error(out, 'Invalid argument: T=')
+
+
+def test_input_octet_stream(client):
+    body = np.concatenate([T_PACKED, P_PACKED]).astype('<f8').tobytes()
+    response = client.post('/state?id=mp.H2O&columns=T,p&props=T,h',
+                           data=body,
+                           content_type='application/octet-stream')
+    assert_packed_state(response.get_json())
+    # The body must divide into the columns
+    response = client.post('/state?id=mp.H2O&columns=T,p', data=body[:-8],
+                           content_type='application/octet-stream')
+    assert_error(response.get_json(),
+                 'Failed to read the binary request body.')
+
+
+@pytest.mark.parametrize('structured', [False, True])
+def test_input_npy(client, structured):
+    if structured:
+        data = np.zeros(3, dtype=[('T', '<f8'), ('p', '<f8')])
+        data['T'], data['p'] = T_PACKED, P_PACKED
+        query = '/state?id=mp.H2O&props=T,h'
+    else:
+        data = np.stack([T_PACKED, P_PACKED])
+        query = '/state?id=mp.H2O&columns=T,p&props=T,h'
+    stream = io.BytesIO()
+    np.save(stream, data)
+    response = client.post(query, data=stream.getvalue(),
+                           content_type='application/x-npy')
+    assert_packed_state(response.get_json())
+
+
+# ### Grid
+
+def test_grid(client):
+    out = get(client, '/grid', id='mp.H2O', x='T', y='p',
+              xrange=[300, 600, 4], yrange=[1, 100, 3], yscale='log',
+              props='h,s')
+    assert not out['message']['error']
+    np.testing.assert_allclose(out['data']['xvals'], [300, 400, 500, 600])
+    np.testing.assert_allclose(out['data']['yvals'], [1, 10, 100])
+    T, p = np.meshgrid(out['data']['xvals'], out['data']['yvals'])
+    subst = pm.get('mp.H2O')
+    for prop in ('h', 's'):
+        assert np.shape(out['data'][prop]) == (3, 4)
+        np.testing.assert_allclose(
+            out['data'][prop], getattr(subst, prop)(T=T, p=p), rtol=1e-6)
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'x': 'T', 'y': 'T', 'xvals': [300], 'yvals': [400]},
+     'The grid axes must be different properties.'),
+    ({'x': 'T', 'y': 'cp', 'xvals': [300], 'yvals': [1]},
+     'Grid axis y must be one of: '),
+    ({'x': 'T', 'y': 'p', 'xvals': [300]},
+     'Specify yvals or yrange for the grid'),
+    ({'x': 'T', 'y': 'p', 'xvals': [300], 'yrange': [1, 2]},
+     'yrange must be start,stop,n'),
+    ({'x': 'T', 'y': 'p', 'xvals': [300], 'yrange': [0, 2, 3],
+      'yscale': 'log'},
+     'yrange must be positive for a log scale')])
+def test_grid_errors(client, args, message):
+    out = get(client, '/grid', id='mp.H2O', **args)
+    assert_error(out, message)
+
+
+# ### Saturation
+
+def test_saturation_model():
+    subst = pm.get('mp.H2O')
+    model = app.get_saturation_model(subst)
+    assert model is not None
+    T = np.linspace(model.Tt, model.Tmax, 37)
+    assert model.covers_T(T)
+    ps = subst.ps(T=T.copy())
+    np.testing.assert_allclose(model.ps(T), ps, rtol=1e-4)
+    np.testing.assert_allclose(model.Ts(ps), T, rtol=1e-6)
+
+    # The states on either side of the dome, as the model samples them
+    liquid, vapor = model.states(T)
+    dsL, dsV = subst.ds(T=T.copy())
+    for states, ds in ((liquid, dsL), (vapor, dsV)):
+        state = subst.state(T=T.copy(), d=ds)
+        for prop, values in states.items():
+            if prop == 'p':
+                expected = ps
+            else:
+                expected = state[prop]
+            # The model's error is scaled by the range of each property
+            scale = np.ptp(expected) or 1.
+            assert np.abs(values - expected).max() / scale < 1e-4, prop
+
+
+def test_saturation_route(client):
+    args = {'id': 'mp.H2O', 'T': [300, 400, 600], 'props': 'T,p,h,s'}
+    fast = get(client, '/saturation', **args)
+    exact = get(client, '/saturation', exact=True, **args)
+    assert not fast['message']['error'] and not exact['message']['error']
+    for phase in ('liquid', 'vapor'):
+        assert sorted(fast['data'][phase]) == ['T', 'h', 'p', 's']
+        for prop, values in exact['data'][phase].items():
+            np.testing.assert_allclose(fast['data'][phase][prop], values,
+                                       rtol=1e-5)
+
+
+def test_saturation_cache():
+    subst = pm.get('mp.H2O')
+    model = app.get_saturation_model(subst)
+    assert app.get_saturation_model(subst) is model
+    # Models are built in the active units
+    pm.config['unit_temperature'] = 'C'
+    assert app.get_saturation_model(subst) is not model
+
+
+# ### Response size
+
+def test_precision(client):
+    out = get(client, '/state', id='mp.H2O', T=[300.123456, 400], p=1,
+              props='T,h', precision=3)
+    assert out['data']['T'] == [300., 400.]
+    assert out['data']['h'] == [113., 2730.]
+    # Arguments are not rounded
+    assert out['args']['T'] == [300.123456, 400]
+    out = get(client, '/state', id='mp.H2O', T=300, p=1, precision=20)
+    assert_error(out, 'The precision must be between 1 and 17')
+
+
+def test_round_significant():
+    values = np.array([123456., 0.000123456, -1.5e30, 0., np.nan, np.inf])
+    rounded = app.round_significant({'a': values, 'b': [values]}, 2)
+    expected = [120000., 0.00012, -1.5e30, 0., np.nan, np.inf]
+    np.testing.assert_array_equal(rounded['a'], expected)
+    np.testing.assert_array_equal(rounded['b'][0], expected)
+    assert app.round_significant(values, None) is values
+
+
+def large_request(client, **headers):
+    return client.post('/isoline', json={'id': 'mp.H2O', 'T': 400},
+                       headers=headers)
+
+
+def test_compression_gzip(client, monkeypatch):
+    monkeypatch.setattr(app, 'brotli', None)
+    plain = large_request(client)
+    assert 'Content-Encoding' not in plain.headers
+    response = large_request(client, **{'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+
+
+def test_compression_brotli(client):
+    brotli = pytest.importorskip('brotli')
+    plain = large_request(client)
+    response = large_request(client, **{'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.get_data()) == plain.get_data()
+
+
+def test_compression_small(client):
+    response = client.post('/state', json={'id': 'mp.H2O', 'T': 300,
+                                           'p': 1},
+                           headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_etag(client):
+    response = large_request(client)
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    response = large_request(client, **{'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    response = client.post('/isoline', json={'id': 'mp.H2O', 'T': 500},
+                           headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+# ### Memory limits
+
+def test_memory_refused_on_admission(client, monkeypatch):
+    monkeypatch.setattr(app, 'MEMORY_LIMIT', 1e5)
+    response = client.post('/state', json={'id': 'mp.H2O',
+                                           'T': [300.] * 1000, 'p': 1})
+    assert response.status_code == 413
+    assert_error(response.get_json(), 'it would need about')
+
+
+def test_memory_refused_on_encoding(client, monkeypatch):
+    # Isolines do not estimate their memory, so they are only caught once
+    # the size of the response is known
+    monkeypatch.setattr(app, 'MEMORY_LIMIT', 1e4)
+    response = client.post('/isoline', json={'id': 'mp.H2O', 'T': 400})
+    assert response.status_code == 413
+    out = response.get_json()
+    assert_error(out, 'it would need about')
+    assert out['data'] == {}
+
+
+@pytest.mark.parametrize('tracing', [False, True])
+def test_memory_trace(client, monkeypatch, tracing):
+    monkeypatch.setattr(app, 'MEMORY_SAMPLE', 1.)
+    if tracing:
+        tracemalloc.start()
+    try:
+        get(client, '/state', id='mp.H2O', T=[300.] * 100, p=1)
+        # Tracing that was started elsewhere is left running
+        assert tracemalloc.is_tracing() == tracing
+    finally:
+        tracemalloc.stop()
+    out = get(client, '/info', substances=False, versions=False,
+              memory=True)
+    assert out['data']['memory']['routes']['/state']['traced'] > 0
+
+
+# ### Comparisons
+
+@pytest.mark.parametrize('cls', app.IDEAL_GAS_CLASSES)
+def test_ideal_gas_table(cls):
+    table = app.get_ideal_gas_table(cls)
+    ids = table.ids[::max(1, len(table.ids) // 8)]
+    T = np.array([300., 500., 1000., 1500.])
+    p = np.array([0.5, 1., 10., 100.])
+    values = table.evaluate(table.index(ids), app.IDEAL_GAS_PROPS, T, p)
+    for row, idstr in enumerate(ids):
+        subst = pm.get(idstr)
+        for prop in app.IDEAL_GAS_PROPS:
+            # PYroMat may change its arguments in place
+            expected = getattr(subst, prop)(T=T.copy(), p=p.copy())
+            np.testing.assert_allclose(values[prop][row], expected,
+                                       rtol=1e-9, err_msg=idstr + ' ' + prop)
+
+
+def test_compare(client):
+    ids = ['ig.N2', 'ig.O2', 'mp.H2O', 'ig.air', 'ig.CO2']
+    T = np.array([300., 500.])
+    out = get(client, '/compare', id=','.join(ids), T=T.tolist(), p=1,
+              props='cp,h')
+    assert not out['message']['error']
+    assert out['data']['id'] == ids
+    # Each class of ideal gas is evaluated at once, the others one by one
+    for row, idstr in enumerate(ids):
+        subst = pm.get(idstr)
+        for prop in ('cp', 'h'):
+            np.testing.assert_allclose(
+                out['data'][prop][row],
+                getattr(subst, prop)(T=T.copy(), p=np.ones(2)),
+                rtol=1e-9, err_msg=idstr + ' ' + prop)
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'id': 'ig.N2', 'T': 300, 'props': 'x'},
+     'Properties not supported for comparison: x'),
+    ({'id': 'ig.N2', 'T': [300, 400, 500], 'p': [1, 2]},
+     'T and p must be the same length.'),
+    ({'id': 'ig.N2,zz.Q', 'T': 300},
+     'Substance not found: zz.Q')])
+def test_compare_errors(client, args, message):
+    out = get(client, '/compare', **args)
+    assert_error(out, message)
+
+
+# ### Diagram tiles
+
+def tile(client, **args):
+    args = dict({'id': 'mp.H2O', 'x': 's', 'y': 'T'}, **args)
+    response = client.post('/tiles', json=args)
+    assert response.status_code == 200
+    return response
+
+
+def test_tiles(client):
+    response = tile(client)
+    assert response.cache_control.public
+    assert response.cache_control.max_age == app.TILE_MAX_AGE
+    whole = response.get_json()['data']
+    x0, x1, y0, y1 = whole['extent']
+    assert whole['window'] == whole['extent']
+    assert whole['levels'] == app.TILE_LEVELS
+    assert set(whole['lines']) == set(app.TILE_FAMILIES) | {'steamdome'}
+
+    out = tile(client, level=1, i=1, j=0).get_json()['data']
+    assert out['extent'] == whole['extent']
+    np.testing.assert_allclose(out['window'],
+                               [(x0 + x1) / 2, x1, y0, (y0 + y1) / 2])
+    # The lines of the axis properties lie along their values
+    for family, axis in (('s', 'x'), ('T', 'y')):
+        lines = out['lines'][family]
+        np.testing.assert_array_equal(
+            np.array(lines['value'], dtype=float),
+            np.array(lines[axis], dtype=float))
+    # Every piece of a line crosses the window
+    wx0, wx1, wy0, wy1 = out['window']
+    x = np.array(out['lines']['p']['x'], dtype=float)
+    y = np.array(out['lines']['p']['y'], dtype=float)
+    inside = (x >= wx0) & (x <= wx1) & (y >= wy0) & (y <= wy1)
+    pieces = np.split(inside, np.nonzero(np.isnan(x))[0] + 1)
+    assert all(piece.any() for piece in pieces if piece.size > 1)
+
+
+def test_tiles_log(client):
+    out = tile(client, x='h', y='p', yscale='log').get_json()['data']
+    # Level 0 holds all of the lines, which span the extent
+    p = np.concatenate([np.array(lines['y'], dtype=float)
+                        for lines in out['lines'].values()])
+    p = p[np.isfinite(p) & (p > 0)]
+    np.testing.assert_allclose(out['extent'][2:],
+                               np.log10([p.min(), p.max()]))
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'x': 'T'}, 'The diagram axes must be two different properties of: '),
+    ({'x': 'q'}, 'The diagram axes must be two different properties of: '),
+    ({'xscale': 'exp'}, 'The axis scales must be linear or log.'),
+    ({'level': app.TILE_LEVELS},
+     f'The zoom level must be from 0 to {app.TILE_LEVELS - 1}.'),
+    ({'level': 1, 'i': 2},
+     'There are 2 tiles across each axis at zoom level 1.')])
+def test_tiles_errors(client, args, message):
+    response = tile(client, **args)
+    assert response.cache_control.max_age is None
+    assert_error(response.get_json(), message)
+
+
+# ### Request deadlines
+
+def slow_lines(monkeypatch, delay):
+    """Make every isoline take at least delay seconds"""
+    compute_iso_line = app.compute_iso_line
+
+    def slow(*args, **kwargs):
+        line = compute_iso_line(*args, **kwargs)
+        time.sleep(delay)
+        return line
+    monkeypatch.setattr(app, 'compute_iso_line', slow)
+
+
+def test_deadline_partial(client, monkeypatch):
+    slow_lines(monkeypatch, .6)
+    out = get(client, '/isoline', id='mp.H2O', T=[300, 400, 500, 600],
+              deadline=1.)
+    assert not out['message']['error']
+    assert out['message']['warn']
+    assert [line['T'][0] for line in out['data']] == [300, 400]
+    assert 'Skipped the isolines at T = 500, 600' in \
+        out['message']['message']
+
+
+def test_deadline_capped(client, monkeypatch):
+    # The client can't extend the deadline of the server
+    monkeypatch.setattr(app, 'DEADLINE', 0.)
+    out = get(client, '/isoline', id='mp.H2O', T=[300, 400], deadline=60.)
+    assert out['data'] == []
+    assert 'Skipped the isolines at T = 300, 400' in \
+        out['message']['message']
+
+
+def test_deadline_single_line(client):
+    out = get(client, '/isoline', id='mp.H2O', T=300, deadline=0.)
+    assert_error(out, 'The isoline was not finished before the deadline')
+
+
+@pytest.mark.parametrize('prop', ['s', 'p'])
+def test_deadline_chunks(client, prop):
+    # Lines that are split into chunks for a deadline come out the same as
+    # the lines of one call, including the points that are out of bounds
+    subst = pm.get('mp.H2O')
+    expected = [app.compute_iso_line(subst, n=50, **{prop: value})
+                for value in app.get_default_lines(subst, prop)]
+    for deadline in ({}, {'deadline': 60.}):
+        out = get(client, '/isoline', id='mp.H2O', default=True,
+                  **{prop: 0}, **deadline)
+        assert len(out['data']) == len(expected)
+        for line, states in zip(out['data'], expected):
+            for name, value in states.items():
+                np.testing.assert_array_equal(
+                    np.array(line[name], dtype=float), value)
+
+
+# ### State validity
+
+def test_state_valid(client):
+    out = get(client, '/state', id='mp.H2O', T=[300, 5000, 400, 500],
+              p=[1, 1, -1, 10], props='h')
+    assert not out['message']['error']
+    assert out['valid'] == [True, False, False, True]
+    # Only the valid states are evaluated
+    h = out['data']['h']
+    assert h[1:3] == ['nan', 'nan']
+    np.testing.assert_allclose(
+        [h[0], h[3]],
+        pm.get('mp.H2O').h(T=np.array([300., 500.]), p=np.array([1., 10.])))
+
+
+def test_state_all_invalid(client):
+    out = get(client, '/state', id='mp.H2O', T=[5000, 6000], p=1)
+    assert_error(out, 'Failed to generate parameter set.')
+    assert 'All of the states are out of bounds' in out['message']['message']
+
+
+def test_grid_valid(client):
+    out = get(client, '/grid', id='mp.H2O', x='T', y='p',
+              xvals=[200, 300, 400, 5000], yvals=[1, -1, 10], props='h')
+    assert out['message']['warn']
+    assert 'valid' not in out['data']
+    assert out['valid'] == [[False, True, True, False],
+                            [False, False, False, False],
+                            [False, True, True, False]]
+    assert out['data']['h'][1] == ['nan'] * 4
+
+
+# ### Diagram images
+
+SVG = '{http://www.w3.org/2000/svg}'
+
+
+@pytest.mark.parametrize('lo, hi, scale, labels', [
+    (-0.297, 13.07, 'linear', ['0', '5', '10']),
+    (-0.35, 0.3, 'linear', ['-0.2', '0', '0.2']),
+    (-1.2, 2.5, 'log', ['0.1', '1', '10', '100'])])
+def test_diagram_ticks(lo, hi, scale, labels):
+    ticks, out = app.diagram_ticks(lo, hi, scale)
+    assert out == labels
+    assert len(ticks) == len(labels)
+
+
+def test_diagram_svg(client):
+    response = client.get('/diagram?id=mp.H2O&diagram=ph&width=320'
+                          '&height=240&uP=Pa')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    assert response.cache_control.public
+    assert response.cache_control.max_age == app.TILE_MAX_AGE
+    svg = ElementTree.fromstring(response.get_data())
+    assert svg.get('width') == '320' and svg.get('height') == '240'
+    assert svg.find(SVG + 'title').text == 'mp.H2O p-h diagram'
+    labels = [text.text for text in svg.iter(SVG + 'text')]
+    assert 'p (Pa)' in labels
+    assert '-0' not in labels
+    assert len(list(svg.iter(SVG + 'path'))) > len(app.TILE_FAMILIES)
+
+
+def test_diagram_cache():
+    subst = pm.get('mp.H2O')
+    image = app.get_diagram(subst, 'Ts', 'svg', 200, 200)
+    assert app.get_diagram(subst, 'Ts', 'svg', 200, 200) is image
+    assert app.get_diagram(subst, 'Ts', 'svg', 200, 300) is not image
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'diagram': 'hs'}, 'The diagram must be one of: Ts, ph, pv'),
+    ({'format': 'gif'}, 'The format must be one of: svg, png'),
+    ({'width': 50}, 'The width and height must be from'),
+    ({'height': 5000}, 'The width and height must be from'),
+    ({'id': 'zz.Q'}, 'Substance not found')])
+def test_diagram_errors(client, args, message):
+    response = client.post('/diagram', json=dict({'id': 'mp.H2O'}, **args))
+    assert response.mimetype == 'application/json'
+    assert_error(response.get_json(), message)
+
+
+def test_diagram_png(client):
+    response = client.post('/diagram', json={'id': 'mp.H2O',
+                                             'format': 'png'})
+    if app.cairosvg is None:
+        assert_error(response.get_json(),
+                     'PNG diagrams are not available on this server.')
+    else:
+        assert response.mimetype == 'image/png'
+        assert response.get_data().startswith(b'\x89PNG')
+
+
+# ### Cycles
+
+def cycle(client, states, **args):
+    return get(client, '/cycle', states=json.dumps(states), **args)
+
+
+def test_cycle_rankine(client):
+    out = cycle(client, [{'p': 0.1, 'x': 0},
+                         {'process': 'isentropic', 'p': [50, 100],
+                          'efficiency': 0.8},
+                         {'process': 'isobaric', 'T': 800},
+                         {'process': 'isentropic', 'p': 0.1,
+                          'efficiency': 0.9}],
+                id='mp.H2O', close=True)
+    assert not out['message']['error']
+    data = out['data']
+    states = [{prop: np.array(value, dtype=float)
+               for prop, value in state.items()} for state in data['states']]
+    np.testing.assert_allclose(states[2]['p'], [50, 100])
+    np.testing.assert_allclose(states[2]['T'], 800)
+    # The turbine expands to 90% of the isentropic enthalpy drop
+    subst = pm.get('mp.H2O')
+    h3s = subst.h(s=states[2]['s'].copy(), p=np.full(2, 0.1))
+    np.testing.assert_allclose(states[3]['h'] - states[2]['h'],
+                               .9 * (h3s - states[2]['h']), rtol=1e-6)
+    assert [process['process'] for process in data['processes']] == \
+        ['isentropic', 'isobaric', 'isentropic', 'close']
+    q_in, q_out = np.array(data['q_in']), np.array(data['q_out'])
+    np.testing.assert_allclose(data['w_net'], q_in - q_out, rtol=1e-9)
+    np.testing.assert_allclose(data['eta'], (q_in - q_out) / q_in)
+
+
+def test_cycle_mismatched_state(client):
+    out = cycle(client, [{'T': [300, 400, 500], 'p': [1, 2]}], id='ig.air')
+    assert_error(out, 'State 0 has values of different lengths')
+
+
+def test_cycle_mismatched_process(client):
+    out = cycle(client, [{'T': 300, 'p': [100, 200, 300]},
+                         {'process': 'isentropic', 'T': [800, 900]}],
+                id='ig.air')
+    assert_error(out, 'State 1 has values of different lengths')
+
+
+def test_cycle_mismatched_summary(client):
+    out = cycle(client, [{'T': 300, 'p': [100, 200, 300]},
+                         {'T': [800, 900], 'p': 1},
+                         {'process': 'isobaric', 'T': 500}],
+                id='ig.air', close=True)
+    assert_error(out, 'The states of the cycle have values of different')
+
+
+def test_cycle_props_not_in_model(client):
+    out = cycle(client, [{'T': 300, 'p': 100},
+                         {'process': 'isentropic', 'p': 1000}],
+                id='ig.air', props='T,x')
+    assert_error(out, 'not supported by this substance model: x')
+
+
+def test_cycle_props(client):
+    out = cycle(client, [{'T': 300, 'p': 1},
+                         {'process': 'isentropic', 'p': 10}],
+                id='mp.H2O', props='T,x')
+    assert not out['message']['error']
+    assert [sorted(state) for state in out['data']['states']] == \
+        [['T', 'x'], ['T', 'x']]
+
+
+# ### Unit conversions
+
+def convert_units(data, from_units, to_units, conversions, mw):
+    """Convert a dict of property arrays, as convert_units() in
+    live/pyromat_ajax.js does"""
+    def scale(unit_class, unit):
+        if unit_class == 'matter':
+            if unit in conversions['scale']['mass']:
+                return conversions['scale']['mass'][unit]
+            return conversions['scale']['molar'][unit] / mw
+        return conversions['scale'][unit_class][unit]
+
+    out = {}
+    for prop, value in data.items():
+        factor = 1.
+        for unit_class, power in conversions['dimensions'][prop].items():
+            factor *= (scale(unit_class, to_units[unit_class]) /
+                       scale(unit_class, from_units[unit_class])) ** power
+        offset_from = offset_to = 0.
+        if prop == 'T':
+            offset_from = conversions['offset']['temperature'][
+                from_units['temperature']]
+            offset_to = conversions['offset']['temperature'][
+                to_units['temperature']]
+        out[prop] = (np.array(value, dtype=float) - offset_from) * factor + \
+            offset_to
+    return out
+
+
+def test_info_conversions(client):
+    conversions = get(client, '/info', substances=False, versions=False,
+                      conversions=True)['data']['conversions']
+    assert conversions['reference'] == app.UNIT_REFERENCE
+    assert conversions['scale']['pressure']['Pa'] == 1.
+    assert conversions['scale']['pressure']['bar'] == pytest.approx(1e-5)
+    assert conversions['offset']['temperature']['C'] == \
+        pytest.approx(-273.15)
+    for unit_class, units in app.get_valid_units().items():
+        if unit_class != 'matter':
+            assert set(conversions['scale'][unit_class]) == set(units)
+
+    out = get(client, '/info', substances=False, versions=False,
+              conversions=False)
+    assert out['data']['conversions'] == {}
+
+
+@pytest.mark.parametrize('to_units', [
+    {'temperature': 'F', 'pressure': 'psi', 'energy': 'BTU',
+     'matter': 'lbm', 'volume': 'ft3'},
+    {'temperature': 'C', 'pressure': 'kPa', 'energy': 'J',
+     'matter': 'kmol', 'volume': 'L'}])
+def test_info_conversions_match_requests(client, to_units):
+    # Converting the data of a request gives the data of the same request
+    # in the new units
+    conversions = get(client, '/info', substances=False, versions=False,
+                      conversions=True)['data']['conversions']
+    from_units = {'temperature': 'K', 'pressure': 'bar', 'energy': 'kJ',
+                  'matter': 'kg', 'volume': 'm3'}
+    mw = pm.get('mp.H2O').mw()
+    state = {'T': [300., 500., 800.], 'p': [1., 1., 10.]}
+    out = get(client, '/state', id='mp.H2O', units=from_units, **state)
+    expected = convert_units(out['data'], from_units, to_units,
+                             conversions, mw)
+    args = convert_units(state, from_units, to_units, conversions, mw)
+    out = get(client, '/state', id='mp.H2O', units=to_units,
+              **{prop: value.tolist() for prop, value in args.items()})
+    for prop, value in expected.items():
+        np.testing.assert_allclose(np.array(out['data'][prop], dtype=float),
+                                   value, rtol=1e-6, err_msg=prop)